@@ -2,6 +2,10 @@
 認證相關功能 - Audio2Score Backend
 包含密碼加密和 JWT Token 處理
 """
+import asyncio
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
@@ -9,6 +13,91 @@ import bcrypt
 from fastapi import HTTPException, status
 from config import settings
 
+# bcrypt 專用的執行緒池，限制同時計算的數量
+_password_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt"
+)
+
+class PasswordMetrics:
+    """密碼雜湊與登入統計（只在事件迴圈執行緒中更新）"""
+    
+    def __init__(self):
+        self.operations = {"hash": 0, "verify": 0}
+        self.seconds = {"hash": 0.0, "verify": 0.0}
+        self.in_flight = 0
+        self.logins = {"success": 0, "failure": 0}
+        self.rehashes = 0
+    
+    def snapshot(self) -> dict:
+        return {
+            "operations": dict(self.operations),
+            "seconds": dict(self.seconds),
+            "in_flight": self.in_flight,
+            "logins": dict(self.logins),
+            "rehashes": self.rehashes,
+        }
+
+password_metrics = PasswordMetrics()
+
+class TTLCache:
+    """有大小上限（LRU）與存活時間的簡單快取，只在事件迴圈執行緒中使用"""
+    
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: "OrderedDict[object, tuple]" = OrderedDict()  # key -> (到期時間, 值)
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        item = self._items.get(key)
+        if item is None or item[0] <= time.monotonic():
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+    
+    def set(self, key, value, ttl: Optional[float] = None):
+        if self.max_size <= 0:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self._items[key] = (time.monotonic() + ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+    
+    def invalidate(self, key):
+        self._items.pop(key, None)
+    
+    def clear(self):
+        self._items.clear()
+    
+    def __len__(self):
+        return len(self._items)
+
+# 已驗證的 Token 與使用者資料；多個工作程序時各自快取，資料最多延遲 TTL 秒
+token_cache = TTLCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+user_cache = TTLCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
+
+def invalidate_user(user_id: int):
+    """使用者資料變更後清除快取"""
+    user_cache.invalidate(user_id)
+
+async def _run_password_op(operation: str, func, *args):
+    """在 bcrypt 執行緒池中執行並記錄耗時（含排隊時間）"""
+    loop = asyncio.get_running_loop()
+    password_metrics.in_flight += 1
+    start = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_password_executor, func, *args)
+    finally:
+        password_metrics.in_flight -= 1
+        password_metrics.operations[operation] += 1
+        password_metrics.seconds[operation] += time.perf_counter() - start
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
     驗證密碼
@@ -38,12 +127,52 @@ def get_password_hash(password: str) -> str:
     """
     # 將字串轉換為 bytes 並加密
     password_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password_bytes, salt)
     
     # 返回字串格式
     return hashed.decode('utf-8')
 
+def needs_rehash(hashed_password: str) -> bool:
+    """
+    雜湊的 cost factor 是否與目前設定不同
+    
+    Args:
+        hashed_password: 加密後的密碼（$2b$<rounds>$...）
+    
+    Returns:
+        bool: 是否需要以目前設定重新加密
+    """
+    try:
+        return int(hashed_password.split("$")[2]) != settings.BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """在執行緒池中驗證密碼，不阻塞事件迴圈"""
+    return await _run_password_op("verify", verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """在執行緒池中加密密碼，不阻塞事件迴圈"""
+    return await _run_password_op("hash", get_password_hash, password)
+
+def user_claims(user) -> dict:
+    """
+    放入 Token 的使用者資料，足以直接回應 /api/auth/me
+    
+    Args:
+        user: 含 id、username、email、created_at 的資料列
+    
+    Returns:
+        dict: Token claims
+    """
+    return {
+        "id": user["id"],
+        "username": user["username"],
+        "email": user["email"],
+        "created_at": user["created_at"].isoformat(),
+    }
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
     建立 JWT Token
@@ -85,12 +214,20 @@ def verify_token(token: str) -> dict:
     Raises:
         HTTPException: Token 無效時拋出
     """
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+    
     try:
         payload = jwt.decode(
             token,
             settings.JWT_SECRET,
             algorithms=[settings.JWT_ALGORITHM]
         )
+        # 快取不超過 Token 本身的有效期限
+        remaining = payload["exp"] - time.time() if "exp" in payload else settings.TOKEN_CACHE_TTL
+        if remaining > 0:
+            token_cache.set(token, payload, remaining)
         return payload
     except JWTError:
         raise HTTPException(
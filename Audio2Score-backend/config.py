@@ -2,11 +2,14 @@
 配置管理 - Audio2Score Backend
 """
 import os
+from pathlib import Path
 from dotenv import load_dotenv
 
 # 載入環境變數
 load_dotenv()
 
+BASE_DIR = Path(__file__).resolve().parent
+
 class Settings:
     """應用程式設定"""
     
@@ -16,16 +19,98 @@ class Settings:
     DB_NAME: str = os.getenv("DB_NAME", "audio2score")
     DB_USER: str = os.getenv("DB_USER", "postgres")
     DB_PASSWORD: str = os.getenv("DB_PASSWORD", "")
+    DB_POOL_MIN_SIZE: int = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+    DB_POOL_MAX_SIZE: int = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+    DB_COMMAND_TIMEOUT: float = float(os.getenv("DB_COMMAND_TIMEOUT", "60"))
+    DB_ACQUIRE_TIMEOUT: float = float(os.getenv("DB_ACQUIRE_TIMEOUT", "5"))  # 取不到連線時回傳 503
+    DB_STATEMENT_CACHE_SIZE: int = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "1024"))  # 每條連線的 prepared statement 快取
+    DB_MAX_INACTIVE_LIFETIME: float = float(os.getenv("DB_MAX_INACTIVE_LIFETIME", "300"))
     
     # JWT 設定
     JWT_SECRET: str = os.getenv("JWT_SECRET", "your-secret-key-change-this")
     JWT_ALGORITHM: str = os.getenv("JWT_ALGORITHM", "HS256")
     JWT_EXPIRATION_DAYS: int = int(os.getenv("JWT_EXPIRATION_DAYS", "7"))
     
+    # 密碼雜湊設定（bcrypt 會釋放 GIL，在執行緒池中計算不會卡住事件迴圈）
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+    
+    # 認證快取（每個工作程序各自一份）
+    TOKEN_CACHE_SIZE: int = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+    TOKEN_CACHE_TTL: float = float(os.getenv("TOKEN_CACHE_TTL", "300"))
+    USER_CACHE_SIZE: int = int(os.getenv("USER_CACHE_SIZE", "10000"))
+    USER_CACHE_TTL: float = float(os.getenv("USER_CACHE_TTL", "60"))
+    # 為 true 時 /api/auth/me 直接以 Token 內的使用者資料回應，不查詢資料庫
+    ME_FROM_TOKEN_CLAIMS: bool = os.getenv("ME_FROM_TOKEN_CLAIMS", "false").lower() == "true"
+    
     # 伺服器設定
     ENVIRONMENT: str = os.getenv("ENVIRONMENT", "development")
     PORT: int = int(os.getenv("PORT", "3000"))
     
+    # 生產模式（gunicorn）設定
+    WEB_CONCURRENCY: int = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+    GRACEFUL_TIMEOUT: int = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+    # false 時 API 程序不執行推論，改由 transcriber.py 獨立執行；
+    # 生產模式預設為 false，避免每個 gunicorn 工作程序各自啟動轉錄工作程序
+    TRANSCRIBE_IN_PROCESS: bool = os.getenv(
+        "TRANSCRIBE_IN_PROCESS", "false" if ENVIRONMENT == "production" else "true"
+    ).lower() == "true"
+    TRANSCRIBER_METRICS_PORT: int = int(os.getenv("TRANSCRIBER_METRICS_PORT", "9101"))
+    
+    # 轉錄設定
+    UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", str(BASE_DIR / "uploads"))
+    UPLOAD_CHUNK_SIZE: int = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+    UPLOAD_MAX_SIZE: int = int(os.getenv("UPLOAD_MAX_SIZE", str(1024 * 1024 * 1024)))
+    MODEL_PATH: str = os.getenv(
+        "MODEL_PATH", str(BASE_DIR / "music_conversion_tool" / "saved_models" / "best_model.keras")
+    )
+    TRANSCRIBE_WORKERS: int = int(os.getenv("TRANSCRIBE_WORKERS", "1"))
+    TRANSCRIBE_CONCURRENCY: int = int(os.getenv("TRANSCRIBE_CONCURRENCY", "4"))
+    TRANSCRIBE_THRESHOLD: float = float(os.getenv("TRANSCRIBE_THRESHOLD", "0.3"))
+    TRANSCRIBE_POLL_INTERVAL: float = float(os.getenv("TRANSCRIBE_POLL_INTERVAL", "2"))
+    TRANSCRIBE_PROGRESS_INTERVAL: float = float(os.getenv("TRANSCRIBE_PROGRESS_INTERVAL", "1"))
+    # 音訊長度（秒）達到此值時改用串流轉錄，記憶體不隨音訊長度增加；0 表示一律串流
+    TRANSCRIBE_STREAM_MIN_SECONDS: float = float(os.getenv("TRANSCRIBE_STREAM_MIN_SECONDS", "600"))
+    # 單一工作的執行時間上限（秒），逾時的工作標記為失敗並重新啟動該工作程序；0 表示不限制
+    TRANSCRIBE_JOB_TIMEOUT: float = float(os.getenv("TRANSCRIBE_JOB_TIMEOUT", "3600"))
+    # 執行中工作的租約（秒）：領取工作的程序定期更新心跳，超過租約未更新的工作由其他程序重新排隊
+    TRANSCRIBE_JOB_LEASE: float = float(os.getenv("TRANSCRIBE_JOB_LEASE", "60"))
+    
+    # 特徵參數（MaestroDataProcessor）
+    SAMPLE_RATE: int = int(os.getenv("SAMPLE_RATE", "22050"))
+    HOP_LENGTH: int = int(os.getenv("HOP_LENGTH", "512"))
+    N_MELS: int = int(os.getenv("N_MELS", "128"))
+    SEQUENCE_LENGTH: int = int(os.getenv("SEQUENCE_LENGTH", "100"))
+    FEATURE_DTYPE: str = os.getenv("FEATURE_DTYPE", "float32")  # float32 或 float16
+    ROLL_DTYPE: str = os.getenv("ROLL_DTYPE", "float32")  # 合併後鋼琴捲（也是快取的鋼琴捲）的型別
+    
+    # 轉錄結果快取
+    RESULT_CACHE_DIR: str = os.getenv("RESULT_CACHE_DIR", str(BASE_DIR / "cache"))
+    RESULT_CACHE_MAX_SIZE: int = int(os.getenv("RESULT_CACHE_MAX_SIZE", str(5 * 1024 * 1024 * 1024)))
+    
+    # 推論動態批次設定
+    INFERENCE_MAX_BATCH_SIZE: int = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "64"))
+    INFERENCE_MAX_WAIT_MS: float = float(os.getenv("INFERENCE_MAX_WAIT_MS", "10"))
+    
+    # 推論後端：keras（MODEL_PATH）或 tflite（TFLITE_MODEL_PATH，以 music_conversion_tool/export_tflite.py 匯出）
+    INFERENCE_BACKEND: str = os.getenv("INFERENCE_BACKEND", "keras")
+    TFLITE_MODEL_PATH: str = os.getenv(
+        "TFLITE_MODEL_PATH", str(BASE_DIR / "music_conversion_tool" / "saved_models" / "best_model.tflite")
+    )
+    TFLITE_NUM_THREADS: int = int(os.getenv("TFLITE_NUM_THREADS", "0"))  # 0 表示 CPU 核心數平均分給各轉錄工作程序
+    
+    @property
+    def inference_model_path(self) -> str:
+        """目前推論後端使用的模型檔案"""
+        return self.TFLITE_MODEL_PATH if self.INFERENCE_BACKEND == "tflite" else self.MODEL_PATH
+    
+    @property
+    def tflite_num_threads(self) -> int:
+        """每個轉錄工作程序的 TFLite 執行緒數，避免多個工作程序搶同一批核心"""
+        if self.TFLITE_NUM_THREADS > 0:
+            return self.TFLITE_NUM_THREADS
+        return max(1, (os.cpu_count() or 1) // max(1, self.TRANSCRIBE_WORKERS))
+    
     @property
     def database_url(self) -> str:
         """取得資料庫連線字串"""
@@ -1,15 +1,88 @@
 """
 資料庫連線和管理 - Audio2Score Backend
 """
-import asyncpg
+import asyncio
+import bisect
+import time
+from contextlib import asynccontextmanager
 from typing import Optional
+
+import asyncpg
+from fastapi import HTTPException, status
+
 from config import settings
+from migrations import migrate
+
+# 熱門查詢：以固定的 SQL 文字執行，asyncpg 會在每條連線的 statement cache 中重用 prepared statement
+QUERIES = {
+    "user_by_email": "SELECT id, username, email, password_hash, created_at FROM users WHERE email = $1",
+    "user_by_id": "SELECT id, username, email, created_at FROM users WHERE id = $1",
+    # 一次來回完成註冊：依 users 的唯一限制略過重複資料，並回報衝突的欄位
+    # conflict 為 NULL 且 id 也為 NULL 時，代表衝突的資料列由尚未對本語句可見的並行交易寫入
+    "insert_user": """
+        WITH inserted AS (
+            INSERT INTO users (username, email, password_hash, created_at, updated_at)
+            VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT DO NOTHING
+            RETURNING id, username, email, created_at
+        )
+        SELECT inserted.id, inserted.username, inserted.email, inserted.created_at,
+               CASE
+                   WHEN inserted.id IS NOT NULL THEN NULL
+                   WHEN EXISTS (SELECT 1 FROM users WHERE email = $2) THEN 'email'
+                   WHEN EXISTS (SELECT 1 FROM users WHERE username = $1) THEN 'username'
+               END AS conflict
+        FROM (SELECT 1) AS attempt
+        LEFT JOIN inserted ON TRUE
+    """,
+    "update_password_hash": "UPDATE users SET password_hash = $1, updated_at = NOW() WHERE id = $2",
+}
+
+class DatabaseBusy(HTTPException):
+    """連線池在 DB_ACQUIRE_TIMEOUT 內沒有可用連線"""
+    
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="資料庫忙碌中，請稍後再試",
+            headers={"Retry-After": "1"}
+        )
+
+class PoolMetrics:
+    """連線池等待時間與查詢延遲統計（只在事件迴圈執行緒中更新）"""
+    
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+    
+    def __init__(self):
+        self.waiting = 0
+        self.timeouts = 0
+        self.acquire = self._histogram()
+        self.queries = {}
+    
+    def _histogram(self) -> dict:
+        return {"count": 0, "seconds": 0.0, "buckets": [0] * len(self.BUCKETS)}
+    
+    def _observe(self, histogram: dict, seconds: float):
+        histogram["count"] += 1
+        histogram["seconds"] += seconds
+        index = bisect.bisect_left(self.BUCKETS, seconds)
+        for i in range(index, len(self.BUCKETS)):
+            histogram["buckets"][i] += 1
+    
+    def observe_acquire(self, seconds: float):
+        self._observe(self.acquire, seconds)
+    
+    def observe_query(self, name: str, seconds: float):
+        if name not in self.queries:
+            self.queries[name] = self._histogram()
+        self._observe(self.queries[name], seconds)
 
 class Database:
     """資料庫管理類別"""
     
     def __init__(self):
         self.pool: Optional[asyncpg.Pool] = None
+        self.metrics = PoolMetrics()
     
     async def connect(self):
         """建立資料庫連線池"""
@@ -26,9 +99,11 @@ class Database:
                     user=settings.DB_USER,
                     password=settings.DB_PASSWORD,
                     database=settings.DB_NAME,
-                    min_size=1,
-                    max_size=10,
-                    command_timeout=60
+                    min_size=settings.DB_POOL_MIN_SIZE,
+                    max_size=settings.DB_POOL_MAX_SIZE,
+                    command_timeout=settings.DB_COMMAND_TIMEOUT,
+                    statement_cache_size=settings.DB_STATEMENT_CACHE_SIZE,
+                    max_inactive_connection_lifetime=settings.DB_MAX_INACTIVE_LIFETIME
                 )
                 
                 # 測試連線
@@ -51,7 +126,6 @@ class Database:
                     return
                 
                 # 等待後重試
-                import asyncio
                 await asyncio.sleep(3)
     
     async def disconnect(self):
@@ -63,12 +137,59 @@ class Database:
     def get_pool(self) -> Optional[asyncpg.Pool]:
         """取得資料庫連線池"""
         return self.pool
+    
+    @asynccontextmanager
+    async def acquire(self, timeout: Optional[float] = None):
+        """從連線池取得連線；超過 DB_ACQUIRE_TIMEOUT 時拋出 DatabaseBusy（503），不會無限等待"""
+        timeout = settings.DB_ACQUIRE_TIMEOUT if timeout is None else timeout
+        self.metrics.waiting += 1
+        start = time.perf_counter()
+        try:
+            conn = await self.pool.acquire(timeout=timeout)
+        except asyncio.TimeoutError:
+            self.metrics.timeouts += 1
+            print(f"⚠️ 等待資料庫連線逾時 ({timeout} 秒)，連線池已滿")
+            raise DatabaseBusy()
+        finally:
+            self.metrics.waiting -= 1
+            self.metrics.observe_acquire(time.perf_counter() - start)
+        
+        try:
+            yield conn
+        finally:
+            await self.pool.release(conn)
+    
+    async def fetchrow(self, conn: asyncpg.Connection, name: str, *args):
+        """執行 QUERIES 中的熱門查詢並記錄延遲"""
+        start = time.perf_counter()
+        try:
+            return await conn.fetchrow(QUERIES[name], *args)
+        finally:
+            self.metrics.observe_query(name, time.perf_counter() - start)
+    
+    async def execute(self, conn: asyncpg.Connection, name: str, *args):
+        """執行 QUERIES 中的熱門指令並記錄延遲"""
+        start = time.perf_counter()
+        try:
+            return await conn.execute(QUERIES[name], *args)
+        finally:
+            self.metrics.observe_query(name, time.perf_counter() - start)
+    
+    def pool_stats(self) -> dict:
+        """連線池目前的使用狀況"""
+        if not self.pool:
+            return {"size": 0, "idle": 0, "max_size": settings.DB_POOL_MAX_SIZE}
+        return {
+            "size": self.pool.get_size(),
+            "idle": self.pool.get_idle_size(),
+            "max_size": self.pool.get_max_size(),
+        }
 
 # 全域資料庫實例
 database = Database()
 
 async def init_db():
-    """初始化資料庫表格"""
+    """套用尚未執行的資料庫遷移；結構已是最新時不執行任何 DDL"""
     pool = database.get_pool()
     if not pool:
         print("⚠️  資料庫未連線，跳過表格初始化")
@@ -76,26 +197,8 @@ async def init_db():
     
     try:
         async with pool.acquire() as conn:
-            # 建立 users 表格
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    username VARCHAR(50) UNIQUE NOT NULL,
-                    email VARCHAR(100) UNIQUE NOT NULL,
-                    password_hash VARCHAR(255) NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # 建立索引
-            await conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)
-            ''')
-            await conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)
-            ''')
-            
+            applied = await migrate(conn)
+        if applied:
             print("✅ 資料庫表格初始化完成")
             
     except Exception as e:
@@ -0,0 +1,96 @@
+"""
+gunicorn 生產環境設定 - Audio2Score Backend
+
+用法：gunicorn -c gunicorn.conf.py main:app（或 ENVIRONMENT=production python main.py）
+
+- 以 uvicorn worker 執行，工作程序數預設為 CPU 核心數（WEB_CONCURRENCY）
+- preload_app 只在主程序匯入程式碼；資料庫連線池在各工作程序的 lifespan 中建立，不會跨 fork 共用
+- 推論在獨立的轉錄服務（transcriber.py）中執行，API 工作程序不載入模型；
+  主程序以監控執行緒看管轉錄服務，意外結束時以指數退避重新啟動
+"""
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from multiprocessing.connection import wait
+
+# 必須在匯入 config 之前設定：API 工作程序只建立工作，不執行推論
+os.environ.setdefault("TRANSCRIBE_IN_PROCESS", "false")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import settings
+
+bind = f"0.0.0.0:{settings.PORT}"
+workers = settings.WEB_CONCURRENCY
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+graceful_timeout = settings.GRACEFUL_TIMEOUT
+timeout = 120  # 上傳大檔案時的單一請求上限
+keepalive = 5
+accesslog = "-"
+
+TRANSCRIBER_MAX_BACKOFF = 60.0  # 重新啟動的最長等待（秒）；執行超過此時間後退避重設為 1 秒
+
+_transcriber = None
+_transcriber_lock = threading.Lock()
+_stopping = threading.Event()
+
+def _transcriber_alive(process) -> bool:
+    """以 sentinel 判斷是否仍在執行：arbiter 會以 waitpid(-1) 回收所有子程序，is_alive() 因此不可靠"""
+    return not wait([process.sentinel], 0)
+
+def _start_transcriber(server):
+    """啟動轉錄服務（spawn，不繼承主程序狀態）；關閉中時不啟動"""
+    global _transcriber
+    import transcriber
+    
+    with _transcriber_lock:
+        if _stopping.is_set():
+            return None
+        _transcriber = multiprocessing.get_context("spawn").Process(
+            target=transcriber.main, name="transcriber"
+        )
+        _transcriber.start()
+    server.log.info(f"Started transcriber process (pid {_transcriber.pid})")
+    return _transcriber
+
+def _supervise_transcriber(server, process):
+    """轉錄服務結束時以指數退避重新啟動，直到 gunicorn 關閉"""
+    backoff = 1.0
+    while process is not None:
+        started_at = time.monotonic()
+        wait([process.sentinel])
+        if _stopping.is_set():
+            return
+        if time.monotonic() - started_at >= TRANSCRIBER_MAX_BACKOFF:
+            backoff = 1.0
+        exit_code = process.exitcode if process.exitcode is not None else "unknown"
+        server.log.error(f"Transcriber exited (pid {process.pid}, exit code {exit_code}), "
+                         f"restarting in {backoff:g}s")
+        if _stopping.wait(backoff):
+            return
+        backoff = min(backoff * 2, TRANSCRIBER_MAX_BACKOFF)
+        process = _start_transcriber(server)
+
+def on_starting(server):
+    """主程序啟動時另外啟動轉錄服務，並以監控執行緒在它結束時重新啟動"""
+    if settings.TRANSCRIBE_IN_PROCESS:
+        return
+    process = _start_transcriber(server)
+    threading.Thread(
+        target=_supervise_transcriber, args=(server, process), name="transcriber-supervisor", daemon=True
+    ).start()
+
+def on_exit(server):
+    """關閉時停止監控並送出 SIGTERM，讓轉錄服務完成收尾後結束"""
+    with _transcriber_lock:
+        _stopping.set()
+    if _transcriber is None or not _transcriber_alive(_transcriber):
+        return
+    _transcriber.terminate()
+    wait([_transcriber.sentinel], settings.GRACEFUL_TIMEOUT)
+    if _transcriber_alive(_transcriber):
+        server.log.warning("Transcriber did not stop in time, killing it")
+        _transcriber.kill()
@@ -0,0 +1,652 @@
+"""
+轉錄工作佇列 - Audio2Score Backend
+上傳後立即建立工作並回傳，由獨立的工作程序執行 MidiGenerator.wav_to_midi
+（長度達 TRANSCRIBE_STREAM_MIN_SECONDS 的音訊改用 stream_wav_to_midi）
+
+工作佇列存在 transcription_jobs 表格中：API 程序只寫入工作並以 NOTIFY 通知，
+執行推論的程序（開發模式下是 API 程序本身，生產模式下是 transcriber.py）
+以 FOR UPDATE SKIP LOCKED 領取工作，並定期把進度寫回資料庫。
+領取的工作記錄 worker_id 並定期更新 heartbeat_at；程序停止後心跳中斷，
+超過 TRANSCRIBE_JOB_LEASE 的工作才由其他（或重新啟動的）程序重新排隊，不會搶走仍在執行的工作。
+
+每個工作程序有自己的工作佇列與結果管道；工作程序異常結束（OOM、segfault、模型載入失敗）時，
+執行中的工作標記為失敗並重新啟動該程序，逾時的工作也會讓該程序被重新啟動。
+"""
+import asyncio
+import multiprocessing
+import os
+import shutil
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import connection
+from pathlib import Path
+from typing import Optional
+
+from config import settings
+from database import database
+from result_cache import result_cache
+
+JOBS_CHANNEL = "transcription_jobs"  # 新工作的 LISTEN/NOTIFY 頻道
+WORKER_RESTART_MAX_DELAY = 60.0  # 工作程序無法啟動時，重新啟動的最長間隔（秒）
+_REQUEUE = object()  # 工作程序被終止時，尚未完成的工作交回佇列
+
+def _create_generator():
+    """在工作程序中載入轉錄模型，並讓程序內所有工作共用同一個動態批次器"""
+    from music_conversion_tool import music_tool
+    
+    processor = music_tool.MaestroDataProcessor(
+        sr=settings.SAMPLE_RATE,
+        hop_length=settings.HOP_LENGTH,
+        n_mels=settings.N_MELS,
+        sequence_length=settings.SEQUENCE_LENGTH,
+        feature_dtype=settings.FEATURE_DTYPE
+    )
+    generator = music_tool.MidiGenerator(
+        settings.inference_model_path, processor, roll_dtype=settings.ROLL_DTYPE,
+        backend=settings.INFERENCE_BACKEND, num_threads=settings.tflite_num_threads,
+        max_batch_size=settings.INFERENCE_MAX_BATCH_SIZE
+    )
+    generator.batcher = music_tool.InferenceBatcher(
+        generator.forward,
+        max_batch_size=settings.INFERENCE_MAX_BATCH_SIZE,
+        max_wait=settings.INFERENCE_MAX_WAIT_MS / 1000
+    )
+    return generator
+
+def _worker_main(job_queue, result_conn, progress, metrics, concurrency: int):
+    """
+    工作程序主迴圈：同時執行最多 concurrency 個轉錄工作
+    
+    Args:
+        job_queue: 待執行的工作 (job_id, input_path, output_path, threshold, roll_path, roll_cached)，
+                   None 表示結束
+        result_conn: 回報訊息的管道：模型載入完成時送出 ("ready",)，
+                     每個工作完成時送出 ("done", job_id, error)，error 為 None 表示成功
+        progress: 跨程序共享的進度字典
+        metrics: 跨程序共享的推論與各階段耗時統計字典（以程序 ID 為 key）
+        concurrency: 同時執行的工作數
+    """
+    generator = _create_generator()
+    slots = threading.Semaphore(concurrency)
+    send_lock = threading.Lock()
+    
+    def send(*message):
+        with send_lock:
+            result_conn.send(message)
+    
+    import numpy as np
+    import soundfile as sf
+    from music_conversion_tool.music_tool import pipeline_profiler
+    
+    def use_streaming(input_path: str) -> bool:
+        """長音訊改用串流轉錄；無法讀取長度時（例如非 soundfile 支援的格式）使用整段轉錄"""
+        try:
+            return sf.info(input_path).duration >= settings.TRANSCRIBE_STREAM_MIN_SECONDS
+        except Exception:
+            return False
+
+    def run(job_id: str, input_path: str, output_path: str, threshold: float,
+            roll_path: Optional[str], roll_cached: bool):
+        try:
+            def report(fraction: float):
+                progress[job_id] = fraction
+            
+            if roll_cached:
+                # 快取中已有鋼琴捲機率，只需重新套用門檻值
+                generator._piano_roll_to_midi(np.load(roll_path, mmap_mode="r"), output_path, threshold)
+            else:
+                tmp_path = f"{roll_path}.{uuid.uuid4().hex}.tmp.npy" if roll_path else None
+                try:
+                    if use_streaming(input_path):
+                        # 鋼琴捲逐段寫入暫存檔，不會整段留在記憶體
+                        succeeded = generator.stream_wav_to_midi(
+                            input_path, output_path, threshold, progress_callback=report, roll_path=tmp_path
+                        ) is not None
+                    else:
+                        piano_roll = generator.wav_to_midi(input_path, output_path, threshold,
+                                                           progress_callback=report)
+                        succeeded = piano_roll is not None
+                        if tmp_path and succeeded:
+                            np.save(tmp_path, piano_roll)
+                    if tmp_path and succeeded:
+                        os.replace(tmp_path, roll_path)
+                finally:
+                    if tmp_path and os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+            
+            if not Path(output_path).exists():
+                raise RuntimeError("轉錄失敗，未產生 MIDI 檔案")
+            send("done", job_id, None)
+        except Exception as e:
+            send("done", job_id, str(e))
+        finally:
+            metrics[os.getpid()] = {
+                "inference": generator.batcher.metrics(),
+                "stages": pipeline_profiler.snapshot(),
+            }
+            slots.release()
+    
+    send("ready")
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            # 有空位時才取下一個工作，讓其他程序也能分到工作
+            slots.acquire()
+            job = job_queue.get()
+            if job is None:
+                break
+            executor.submit(run, *job)
+
+class _Worker:
+    """一個轉錄工作程序及其工作佇列、結果管道與執行中的工作"""
+    
+    def __init__(self, index: int):
+        self.index = index
+        self.channel = None  # (Process, 結果管道的讀取端)，一起替換讓結果執行緒看到一致的組合
+        self.queue = None
+        self.jobs = set()  # 已交給此程序、尚未回報結果的 job_id
+        self.ready: Optional[asyncio.Event] = None  # 模型載入完成、可以接受工作
+        self.terminated = False  # 由管理程序終止（例如工作逾時），其餘工作交回佇列
+        self.failures = 0  # 連續無法完成啟動的次數
+        self.restart_task: Optional[asyncio.Task] = None
+    
+    @property
+    def process(self):
+        return self.channel[0] if self.channel else None
+    
+    def spawn(self, context, progress, metrics):
+        """啟動新的工作程序；舊程序留在佇列中的工作一併捨棄"""
+        reader, writer = context.Pipe(duplex=False)
+        self.queue = context.Queue()
+        self.terminated = False
+        process = context.Process(
+            target=_worker_main,
+            args=(self.queue, writer, progress, metrics, settings.TRANSCRIBE_CONCURRENCY),
+            name=f"transcriber-{self.index}",
+            daemon=True
+        )
+        process.start()
+        writer.close()  # 只留子程序持有寫入端，子程序結束時讀取端才會收到 EOF
+        self.channel = (process, reader)
+    
+    def terminate(self):
+        """終止工作程序，由結果執行緒偵測結束後重新啟動"""
+        process = self.process
+        if process is not None and process.is_alive():
+            self.terminated = True
+            self.ready.clear()  # 程序結束前不再分派工作給它
+            process.terminate()
+
+class JobManager:
+    """轉錄工作管理類別"""
+    
+    def __init__(self):
+        self.run_workers = False
+        self.progress = None
+        self.metrics = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._listen_conn = None
+        self._progress_task: Optional[asyncio.Task] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self.worker_id: Optional[str] = None  # 寫入 transcription_jobs.worker_id，識別領取工作的程序
+        self._manager = None
+        self._context = None
+        self._workers = []
+        self._pending = {}  # job_id -> 等待工作程序結果的 asyncio.Future
+        self._dispatchers = []
+        self._result_thread: Optional[threading.Thread] = None
+        self._stopping = False
+    
+    async def start(self, run_workers: bool = True):
+        """
+        啟動工作程序，並重新排入上次未完成的工作
+        
+        Args:
+            run_workers: False 時只負責建立工作（生產模式的 API 程序），由 transcriber.py 執行
+        """
+        self.run_workers = run_workers
+        if not run_workers:
+            print("ℹ️  轉錄工作交由獨立的轉錄服務執行")
+            return
+        
+        self._stopping = False
+        self.worker_id = f"{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._context = multiprocessing.get_context("spawn")
+        self._manager = self._context.Manager()
+        self.progress = self._manager.dict()
+        self.metrics = self._manager.dict()
+        self._workers = [_Worker(index) for index in range(settings.TRANSCRIBE_WORKERS)]
+        for worker in self._workers:
+            worker.ready = asyncio.Event()
+            worker.spawn(self._context, self.progress, self.metrics)
+        
+        loop = asyncio.get_running_loop()
+        self._result_thread = threading.Thread(
+            target=self._collect_results, args=(loop,), name="job-results", daemon=True
+        )
+        self._result_thread.start()
+        self._wakeup = asyncio.Event()
+        
+        pool = database.get_pool()
+        if pool:
+            # 可能有多個轉錄服務同時執行，只重新排入租約已過期（擁有的程序已停止）的工作
+            await self._requeue_expired()
+            
+            # 其他程序建立工作時立即喚醒分派器
+            self._listen_conn = await pool.acquire()
+            await self._listen_conn.add_listener(JOBS_CHANNEL, self._on_notify)
+            self._progress_task = asyncio.create_task(self._flush_progress())
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        
+        # 每個工作程序有 TRANSCRIBE_CONCURRENCY 個分派器，各自負責一個執行位置
+        self._dispatchers = [
+            asyncio.create_task(self._dispatch(worker))
+            for worker in self._workers
+            for _ in range(settings.TRANSCRIBE_CONCURRENCY)
+        ]
+        print(f"✅ 轉錄工作程序已啟動 ({settings.TRANSCRIBE_WORKERS} 個程序，"
+              f"每個程序 {settings.TRANSCRIBE_CONCURRENCY} 個工作)")
+    
+    async def stop(self):
+        """停止分派並關閉工作程序"""
+        if not self.run_workers:
+            return
+        
+        self._stopping = True
+        restarts = [worker.restart_task for worker in self._workers if worker.restart_task]
+        background = [task for task in (self._progress_task, self._heartbeat_task) if task]
+        tasks = self._dispatchers + restarts + background
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._dispatchers = []
+        self._progress_task = None
+        self._heartbeat_task = None
+        
+        if self._listen_conn is not None:
+            try:
+                await self._listen_conn.remove_listener(JOBS_CHANNEL, self._on_notify)
+                await database.get_pool().release(self._listen_conn)
+            except Exception as e:
+                print(f"⚠️  無法釋放 LISTEN 連線: {e}")
+            self._listen_conn = None
+        
+        for worker in self._workers:
+            worker.queue.put(None)
+        for worker in self._workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        if self._result_thread is not None:
+            self._result_thread.join(timeout=5)
+            self._result_thread = None
+        for worker in self._workers:
+            worker.channel[1].close()
+        self._workers = []
+        if self._manager:
+            self._manager.shutdown()
+            self._manager = None
+        print("✅ 轉錄工作程序已關閉")
+    
+    def _collect_results(self, loop: asyncio.AbstractEventLoop):
+        """在背景執行緒讀取工作程序的結果並監看程序是否結束，交回事件迴圈"""
+        exited = set()  # 已回報結束的程序
+        while not self._stopping:
+            watched = {}
+            for worker in list(self._workers):
+                process, reader = worker.channel
+                if process not in exited:
+                    watched[reader] = watched[process.sentinel] = (worker, process, reader)
+            
+            # 逾時後重新整理監看清單，納入重新啟動的程序
+            for ready in connection.wait(list(watched), timeout=1.0):
+                worker, process, reader = watched[ready]
+                if process in exited:
+                    continue
+                if ready is reader:
+                    try:
+                        message = reader.recv()
+                    except (EOFError, OSError):
+                        continue  # 程序已結束，等 sentinel 處理
+                    loop.call_soon_threadsafe(self._on_message, worker, process, message)
+                else:
+                    # 先讀完程序結束前送出的結果，再回報結束
+                    try:
+                        while reader.poll():
+                            loop.call_soon_threadsafe(self._on_message, worker, process, reader.recv())
+                    except (EOFError, OSError):
+                        pass
+                    process.join(timeout=1)  # 回收程序以取得 exit code
+                    exited.add(process)
+                    loop.call_soon_threadsafe(self._on_worker_exit, worker, process)
+    
+    def _on_message(self, worker: _Worker, process, message: tuple):
+        if message[0] == "ready":
+            if worker.process is process:
+                worker.failures = 0
+                worker.ready.set()
+        else:
+            _, job_id, error = message
+            self._resolve(job_id, error)
+    
+    def _on_worker_exit(self, worker: _Worker, process):
+        """工作程序結束：處理執行中的工作並重新啟動程序"""
+        if self._stopping or worker.process is not process:
+            return
+        
+        started = worker.ready.is_set()
+        worker.ready.clear()
+        try:
+            self.metrics.pop(process.pid, None)
+        except Exception:
+            pass
+        
+        if worker.terminated:
+            outcome = _REQUEUE
+        else:
+            outcome = f"轉錄工作程序異常結束 (exit code {process.exitcode})"
+        for job_id in list(worker.jobs):
+            self._resolve(job_id, outcome)
+        
+        if started or worker.terminated:
+            delay = 0.0
+        else:
+            # 還沒載入完模型就結束（例如模型檔不存在），逐次拉長重新啟動的間隔
+            worker.failures += 1
+            delay = min(WORKER_RESTART_MAX_DELAY, 2.0 ** worker.failures)
+        print(f"⚠️  [轉錄] 工作程序 {process.pid} 已結束 (exit code {process.exitcode})，"
+              f"{len(worker.jobs)} 個執行中的工作{'交回佇列' if outcome is _REQUEUE else '標記為失敗'}，"
+              f"{delay:g} 秒後重新啟動")
+        worker.restart_task = asyncio.create_task(self._restart(worker, delay))
+    
+    async def _restart(self, worker: _Worker, delay: float):
+        await asyncio.sleep(delay)
+        if not self._stopping:
+            worker.spawn(self._context, self.progress, self.metrics)
+    
+    def _on_notify(self, connection, pid, channel, payload):
+        self._wakeup.set()
+    
+    def _resolve(self, job_id: str, error):
+        future = self._pending.pop(job_id, None)
+        if future is not None and not future.done():
+            future.set_result(error)
+    
+    async def enqueue(self, job_id: str, filename: str, input_path: str, output_path: str,
+                      audio_sha256: Optional[str] = None, threshold: Optional[float] = None):
+        """建立工作並排入佇列"""
+        if threshold is None:
+            threshold = settings.TRANSCRIBE_THRESHOLD
+        
+        async with database.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO transcription_jobs
+                    (id, filename, input_path, output_path, status, audio_sha256, threshold)
+                VALUES ($1, $2, $3, $4, 'queued', $5, $6)
+                """,
+                job_id, filename, input_path, output_path, audio_sha256, threshold
+            )
+            await conn.execute("SELECT pg_notify($1, $2)", JOBS_CHANNEL, job_id)
+        if self._wakeup is not None:
+            self._wakeup.set()
+    
+    async def get(self, job_id: str) -> Optional[dict]:
+        """取得工作狀態，執行中的工作會帶入最新進度"""
+        async with database.acquire() as conn:
+            row = await conn.fetchrow("SELECT * FROM transcription_jobs WHERE id = $1", job_id)
+        if not row:
+            return None
+        
+        job = dict(row)
+        if job["status"] == "running" and self.progress is not None:
+            job["progress"] = self.progress.get(job_id, job["progress"])
+        return job
+    
+    def inference_metrics(self) -> dict:
+        """各工作程序的動態批次統計"""
+        if self.metrics is None:
+            return {}
+        return {pid: worker["inference"] for pid, worker in self.metrics.items()}
+    
+    def stage_metrics(self) -> dict:
+        """合併所有工作程序的各階段耗時統計"""
+        merged = {}
+        if self.metrics is None:
+            return merged
+        for worker in self.metrics.values():
+            for name, stats in worker["stages"].items():
+                total = merged.setdefault(name, {
+                    "count": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_rss_growth_bytes": 0,
+                    "buckets": [0] * len(stats["buckets"]), "bucket_bounds": stats["bucket_bounds"],
+                })
+                total["count"] += stats["count"]
+                total["wall_seconds"] += stats["wall_seconds"]
+                total["cpu_seconds"] += stats["cpu_seconds"]
+                total["peak_rss_growth_bytes"] = max(total["peak_rss_growth_bytes"], stats["peak_rss_growth_bytes"])
+                total["buckets"] = [a + b for a, b in zip(total["buckets"], stats["buckets"])]
+        return merged
+    
+    async def _requeue(self, job_id: str):
+        """把已領取但未執行完的工作交回佇列"""
+        pool = database.get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE transcription_jobs
+                SET status = 'queued', progress = 0, worker_id = NULL, heartbeat_at = NULL, updated_at = NOW()
+                WHERE id = $1 AND worker_id = $2
+                """,
+                job_id, self.worker_id
+            )
+        self._wakeup.set()
+        print(f"🔁 [轉錄] 工作 {job_id} 重新排隊")
+    
+    async def _requeue_expired(self):
+        """重新排入租約已過期的執行中工作（擁有的程序已停止或失去資料庫連線）"""
+        pool = database.get_pool()
+        async with pool.acquire() as conn:
+            requeued = await conn.fetch(
+                """
+                UPDATE transcription_jobs
+                SET status = 'queued', progress = 0, worker_id = NULL, heartbeat_at = NULL, updated_at = NOW()
+                WHERE status = 'running'
+                  AND (heartbeat_at IS NULL OR heartbeat_at < NOW() - make_interval(secs => $1))
+                RETURNING id
+                """,
+                settings.TRANSCRIBE_JOB_LEASE
+            )
+        if requeued:
+            print(f"🔁 重新排入 {len(requeued)} 個租約過期的轉錄工作")
+            self._wakeup.set()
+    
+    async def _heartbeat(self):
+        """定期更新本程序執行中工作的心跳，並重新排入其他程序留下的過期工作"""
+        while True:
+            await asyncio.sleep(settings.TRANSCRIBE_JOB_LEASE / 3)
+            try:
+                pool = database.get_pool()
+                async with pool.acquire() as conn:
+                    await conn.execute(
+                        """
+                        UPDATE transcription_jobs SET heartbeat_at = NOW()
+                        WHERE worker_id = $1 AND status = 'running'
+                        """,
+                        self.worker_id
+                    )
+                await self._requeue_expired()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️  [轉錄] 無法更新工作心跳: {e}")
+    
+    async def _update(self, job_id: str, status: str, progress: float, error: Optional[str] = None):
+        """更新本程序領取的工作狀態；租約過期後已被重新排隊的工作不會被覆寫"""
+        pool = database.get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE transcription_jobs SET status = $2, progress = $3, error = $4, updated_at = NOW()
+                WHERE id = $1 AND worker_id = $5
+                """,
+                job_id, status, progress, error, self.worker_id
+            )
+    
+    async def _lookup_cache(self, job: dict):
+        """
+        取得工作對應的快取項目
+        
+        Returns:
+            (CacheEntry 或 None, 鋼琴捲是否已在快取中)
+        """
+        if not job.get("audio_sha256") or not result_cache.enabled:
+            return None, False
+        try:
+            entry = await result_cache.entry_for(job["audio_sha256"])
+            return entry, await result_cache.touch(entry)
+        except Exception as e:
+            print(f"⚠️  [快取] 查詢失敗，改為完整轉錄: {e}")
+            return None, False
+    
+    async def _claim(self) -> Optional[dict]:
+        """從資料庫領取最早的待處理工作並標記為執行中"""
+        pool = database.get_pool()
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow(
+                """
+                UPDATE transcription_jobs
+                SET status = 'running', progress = 0, worker_id = $1, heartbeat_at = NOW(), updated_at = NOW()
+                WHERE id = (
+                    SELECT id FROM transcription_jobs WHERE status = 'queued'
+                    ORDER BY created_at
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING *
+                """,
+                self.worker_id
+            )
+        return dict(row) if row else None
+    
+    async def _flush_progress(self):
+        """定期把工作程序回報的進度寫回資料庫，讓其他程序查詢得到"""
+        while True:
+            await asyncio.sleep(settings.TRANSCRIBE_PROGRESS_INTERVAL)
+            try:
+                updates = [(job_id, progress, self.worker_id) for job_id, progress in self.progress.items()]
+                if updates:
+                    pool = database.get_pool()
+                    async with pool.acquire() as conn:
+                        await conn.executemany(
+                            """
+                            UPDATE transcription_jobs SET progress = $2, updated_at = NOW()
+                            WHERE id = $1 AND status = 'running' AND worker_id = $3
+                            """,
+                            updates
+                        )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️  [轉錄] 無法更新進度: {e}")
+    
+    async def _dispatch(self, worker: _Worker):
+        """從資料庫領取工作並交給指定的工作程序執行"""
+        while True:
+            # 工作程序載入模型（或重新啟動）期間不領取工作
+            await worker.ready.wait()
+            # 先清除喚醒旗標再領取，領取期間建立的工作會再次喚醒
+            self._wakeup.clear()
+            try:
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ [轉錄] 無法領取工作: {e}")
+                job = None
+            
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.TRANSCRIBE_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            await self._run_job(job, worker)
+    
+    async def _run_job(self, job: dict, worker: _Worker):
+        """執行一個已領取的工作"""
+        loop = asyncio.get_running_loop()
+        job_id = job["id"]
+        staging = None  # 未命中快取時，鋼琴捲先寫入的暫存目錄
+        try:
+            print(f"🎹 [轉錄] 開始工作 {job_id}: {job['filename']}")
+            threshold = job["threshold"]
+            
+            # 查詢快取：同樣的 MIDI 直接複製，只有鋼琴捲時交給工作程序重新套用門檻值
+            entry, roll_cached = await self._lookup_cache(job)
+            if roll_cached and entry.midi_path(threshold).exists():
+                await asyncio.to_thread(shutil.copyfile, entry.midi_path(threshold), job["output_path"])
+                await self._update(job_id, "done", 1.0)
+                print(f"⚡ [轉錄] 工作 {job_id} 命中快取")
+                return
+            
+            if not worker.ready.is_set():
+                # 領取期間工作程序已結束
+                await self._requeue(job_id)
+                return
+            
+            roll_path = None
+            if entry is not None:
+                roll_path = entry.roll_path
+                if not roll_cached:
+                    staging = await asyncio.to_thread(result_cache.create_staging, entry)
+                    roll_path = staging / entry.roll_path.name
+            
+            self._pending[job_id] = loop.create_future()
+            worker.jobs.add(job_id)
+            worker.queue.put((
+                job_id, job["input_path"], job["output_path"], threshold,
+                str(roll_path) if roll_path else None, roll_cached
+            ))
+            timeout = settings.TRANSCRIBE_JOB_TIMEOUT or None
+            try:
+                error = await asyncio.wait_for(self._pending[job_id], timeout)
+            except asyncio.TimeoutError:
+                # 工作程序可能卡住，終止後重新啟動，同一程序的其他工作交回佇列
+                error = f"轉錄逾時（超過 {timeout:g} 秒）"
+                worker.jobs.discard(job_id)
+                worker.terminate()
+            
+            if error is _REQUEUE:
+                await self._requeue(job_id)
+            elif error is None:
+                if entry is not None:
+                    try:
+                        await result_cache.store(entry, threshold, job["output_path"], staging)
+                    except Exception as cache_error:
+                        print(f"⚠️  [快取] 無法保存轉錄結果: {cache_error}")
+                await self._update(job_id, "done", 1.0)
+                print(f"✅ [轉錄] 完成工作 {job_id}")
+            else:
+                await self._update(job_id, "failed", 0.0, error)
+                print(f"❌ [轉錄] 工作 {job_id} 失敗: {error}")
+            
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ [轉錄] 工作 {job_id} 失敗: {e}")
+            try:
+                await self._update(job_id, "failed", 0.0, str(e))
+            except Exception as update_error:
+                print(f"❌ [轉錄] 無法更新工作狀態: {update_error}")
+        finally:
+            worker.jobs.discard(job_id)
+            self._pending.pop(job_id, None)
+            self.progress.pop(job_id, None)
+            if staging is not None:
+                # 失敗、逾時或重新排隊時刪除暫存目錄（保存成功時已移走）
+                shutil.rmtree(staging, ignore_errors=True)
+
+# 全域工作管理實例
+job_manager = JobManager()
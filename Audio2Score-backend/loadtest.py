@@ -0,0 +1,247 @@
+"""
+後端壓力測試腳本 - Audio2Score Backend
+
+以 httpx + asyncio 模擬大量同時連線的客戶端，依設定的比例混合
+register / login / me / upload 請求，統計各端點的 p50/p95/p99 延遲、吞吐量與錯誤率。
+
+預設在同一個程序內直接對 main:app（ASGI）送出請求，使用 .env 中的 PostgreSQL；
+建議以 --db-name 指向專用的測試資料庫，並以 --transcribe-workers 0 只測上傳而不執行轉錄。
+也可以用 --url 對已啟動的伺服器測試。
+
+用法：
+    python loadtest.py --clients 500 --duration 30
+    python loadtest.py --mix login=5,me=10,register=1,upload=1 --db-name audio2score_loadtest
+    python loadtest.py --url http://127.0.0.1:3000 --clients 200
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+import numpy as np
+import soundfile as sf
+
+ENDPOINTS = ("register", "login", "me", "upload")
+
+
+def parse_mix(text):
+    """把 "login=5,me=10" 轉成 {端點: 權重}"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"未知的端點: {name}（可用: {', '.join(ENDPOINTS)}）")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def synthetic_wav(seconds, sr=22050):
+    """產生上傳用的 WAV（正弦波）"""
+    t = np.arange(int(seconds * sr)) / sr
+    buffer = io.BytesIO()
+    sf.write(buffer, 0.2 * np.sin(2 * np.pi * 440 * t), sr, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+class LoadTest:
+    """壓力測試狀態與各端點的請求"""
+
+    def __init__(self, client, args):
+        self.client = client
+        self.args = args
+        self.run_id = uuid.uuid4().hex[:8]
+        self.password = "loadtest-password"
+        self.users = []  # (email, token)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.wav = synthetic_wav(args.upload_seconds)
+        self._counter = 0
+
+    def _new_user(self):
+        self._counter += 1
+        name = f"lt_{self.run_id}_{self._counter}"
+        return {"username": name, "email": f"{name}@loadtest.local", "password": self.password}
+
+    async def _timed(self, endpoint, request, ok_statuses):
+        start = time.perf_counter()
+        try:
+            response = await request
+            status_code = response.status_code
+        except Exception as e:
+            response = None
+            status_code = type(e).__name__
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        self.statuses[endpoint][status_code] += 1
+        if status_code not in ok_statuses:
+            self.errors[endpoint] += 1
+            return None
+        return response
+
+    async def register(self):
+        return await self._timed(
+            "register", self.client.post("/api/auth/register", json=self._new_user()), (201,)
+        )
+
+    async def login(self):
+        email, _ = random.choice(self.users)
+        return await self._timed(
+            "login",
+            self.client.post("/api/auth/login", json={"email": email, "password": self.password}),
+            (200,)
+        )
+
+    async def me(self):
+        _, token = random.choice(self.users)
+        return await self._timed(
+            "me", self.client.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"}), (200,)
+        )
+
+    async def upload(self):
+        files = {"file": (f"loadtest_{self.run_id}.wav", self.wav, "audio/wav")}
+        return await self._timed("upload", self.client.post("/api/upload", files=files), (202,))
+
+    async def setup_users(self):
+        """先註冊一批使用者，供 login / me 使用"""
+        print(f"⏳ 建立 {self.args.users} 個測試使用者...")
+        semaphore = asyncio.Semaphore(min(self.args.clients, 50))
+
+        async def create():
+            user = self._new_user()
+            async with semaphore:
+                response = await self.client.post("/api/auth/register", json=user)
+            if response.status_code == 201:
+                self.users.append((user["email"], response.json()["token"]))
+            else:
+                print(f"❌ 註冊失敗 ({response.status_code}): {response.text[:200]}")
+
+        await asyncio.gather(*(create() for _ in range(self.args.users)))
+        if not self.users:
+            raise RuntimeError("無法建立任何測試使用者，請檢查資料庫連線")
+        print(f"✅ 已建立 {len(self.users)} 個測試使用者")
+
+    async def client_loop(self, mix, deadline, rng):
+        names = list(mix)
+        weights = list(mix.values())
+        while time.perf_counter() < deadline:
+            endpoint = rng.choices(names, weights)[0]
+            await getattr(self, endpoint)()
+
+    async def run(self, mix):
+        await self.setup_users()
+        # 重設統計，不計入建立使用者的請求
+        self.latencies.clear()
+        self.errors.clear()
+        self.statuses.clear()
+
+        print(f"🚀 {self.args.clients} 個客戶端，持續 {self.args.duration} 秒，比例 {mix}")
+        started = time.perf_counter()
+        deadline = started + self.args.duration
+        await asyncio.gather(*(
+            self.client_loop(mix, deadline, random.Random(self.args.seed + i))
+            for i in range(self.args.clients)
+        ))
+        return time.perf_counter() - started
+
+    def report(self, elapsed):
+        """各端點的延遲百分位數、吞吐量與錯誤率"""
+        rows = {}
+        for endpoint in ENDPOINTS:
+            latencies = self.latencies.get(endpoint)
+            if not latencies:
+                continue
+            ms = np.array(latencies) * 1000
+            rows[endpoint] = {
+                "requests": len(ms),
+                "errors": self.errors[endpoint],
+                "error_rate": self.errors[endpoint] / len(ms),
+                "throughput_rps": len(ms) / elapsed,
+                "p50_ms": float(np.percentile(ms, 50)),
+                "p95_ms": float(np.percentile(ms, 95)),
+                "p99_ms": float(np.percentile(ms, 99)),
+                "max_ms": float(ms.max()),
+                "statuses": {str(code): count for code, count in self.statuses[endpoint].items()},
+            }
+
+        total = sum(row["requests"] for row in rows.values())
+        print("\n" + "=" * 96)
+        print(f"{'endpoint':<10}{'requests':>10}{'rps':>10}{'errors':>9}{'err%':>8}"
+              f"{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'max ms':>11}")
+        print("-" * 96)
+        for endpoint, row in rows.items():
+            print(f"{endpoint:<10}{row['requests']:>10}{row['throughput_rps']:>10.1f}{row['errors']:>9}"
+                  f"{row['error_rate'] * 100:>7.2f}%{row['p50_ms']:>11.1f}{row['p95_ms']:>11.1f}"
+                  f"{row['p99_ms']:>11.1f}{row['max_ms']:>11.1f}")
+        print("-" * 96)
+        print(f"總計 {total} 個請求，{elapsed:.1f} 秒，{total / elapsed:.1f} req/s")
+        for endpoint, row in rows.items():
+            if row["errors"]:
+                print(f"⚠️ {endpoint} 狀態碼分佈: {row['statuses']}")
+        print("=" * 96)
+        return {"elapsed_seconds": elapsed, "total_requests": total, "endpoints": rows}
+
+
+async def main(args):
+    mix = parse_mix(args.mix)
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    timeout = httpx.Timeout(args.timeout)
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=timeout) as client:
+            test = LoadTest(client, args)
+            elapsed = await test.run(mix)
+        return test.report(elapsed)
+
+    # 在同一個程序內執行 ASGI app（含 lifespan：資料庫連線、建表、轉錄工作程序）
+    from main import app
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://loadtest", limits=limits, timeout=timeout
+        ) as client:
+            test = LoadTest(client, args)
+            elapsed = await test.run(mix)
+    return test.report(elapsed)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Audio2Score 後端壓力測試")
+    parser.add_argument("--url", help="測試已啟動的伺服器；未指定時直接在程序內執行 main:app")
+    parser.add_argument("--clients", type=int, default=500, help="同時連線的客戶端數")
+    parser.add_argument("--duration", type=float, default=30, help="測試秒數")
+    parser.add_argument("--mix", default="register=1,login=5,me=10,upload=1",
+                        help="各端點的請求比例，例如 login=5,me=10")
+    parser.add_argument("--users", type=int, default=50, help="預先建立的測試使用者數")
+    parser.add_argument("--upload-seconds", type=float, default=5, help="上傳音訊的長度（秒）")
+    parser.add_argument("--timeout", type=float, default=60, help="單一請求逾時（秒）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db-name", help="程序內模式使用的資料庫名稱（建議使用專用的測試資料庫）")
+    parser.add_argument("--transcribe-workers", type=int,
+                        help="程序內模式的轉錄工作程序數，0 表示上傳的工作只排隊不執行")
+    parser.add_argument("--output", help="將結果另存為 JSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # 程序內模式的設定必須在匯入 config 之前寫入環境變數
+    if args.db_name:
+        os.environ["DB_NAME"] = args.db_name
+    if args.transcribe_workers is not None:
+        os.environ["TRANSCRIBE_WORKERS"] = str(args.transcribe_workers)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    result = asyncio.run(main(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"結果已儲存至 {args.output}")
@@ -2,9 +2,10 @@
 FastAPI 主程式 - Audio2Score Backend
 支援前端連接和資料庫操作
 """
+from startup import startup_report  # 最先匯入，從這裡開始計算匯入耗時
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from datetime import datetime
 import uvicorn
 import sys
@@ -20,8 +21,12 @@ logger = logging.getLogger("uvicorn.error")
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from config import settings
-from database import database, init_db
+from database import DatabaseBusy, database, init_db
 from routes import router as auth_router
+from jobs import job_manager
+from metrics import render_metrics
+
+startup_report.mark("imports")
 
 # Lifespan 事件處理器
 @asynccontextmanager
@@ -30,13 +35,20 @@ async def lifespan(app: FastAPI):
     print("=" * 50)
     print("🚀 Audio2Score Backend 啟動中...")
     print("=" * 50)
+    startup_report.begin()
     await database.connect()
+    startup_report.mark("database")
     await init_db()
+    startup_report.mark("migrations")
+    await job_manager.start(run_workers=settings.TRANSCRIBE_IN_PROCESS)
+    startup_report.mark("jobs")
+    startup_report.log("API")
     print("✅ 應用程式初始化完成")
     print("=" * 50)
     yield
     # Shutdown code
     print("🛑 Audio2Score Backend 停止中...")
+    await job_manager.stop()
     await database.disconnect()
 
 # 建立 FastAPI 應用程式
@@ -104,9 +116,8 @@ async def root():
 async def health_check():
     """健康檢查端點"""
     try:
-        pool = database.get_pool()
-        if pool:
-            async with pool.acquire() as conn:
+        if database.get_pool():
+            async with database.acquire() as conn:
                 result = await conn.fetchval("SELECT NOW()")
                 return {
                     "status": "ok",
@@ -121,6 +132,17 @@ async def health_check():
                 "database": "disconnected",
                 "message": "資料庫未連線，但伺服器正常運行"
             }
+    except DatabaseBusy as e:
+        return JSONResponse(
+            status_code=e.status_code,
+            headers=e.headers,
+            content={
+                "status": "busy",
+                "timestamp": datetime.now().isoformat(),
+                "database": "saturated",
+                "error": e.detail
+            }
+        )
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -132,6 +154,12 @@ async def health_check():
             }
         )
 
+# Prometheus 指標
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """轉錄各階段耗時與推論批次統計（Prometheus 文字格式）"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 # 404 處理
 @app.exception_handler(404)
 async def not_found_handler(request: Request, exc):
@@ -161,12 +189,21 @@ if __name__ == "__main__":
     print(f"📝 本地存取: http://127.0.0.1:{settings.PORT}")
     print(f"📝 API 文件: http://127.0.0.1:{settings.PORT}/docs")
     print(f"📝 健康檢查: http://127.0.0.1:{settings.PORT}/health")
+    print(f"📝 指標: http://127.0.0.1:{settings.PORT}/metrics")
     print(f"📝 API 端點:")
     print(f"   POST http://127.0.0.1:{settings.PORT}/api/auth/register")
     print(f"   POST http://127.0.0.1:{settings.PORT}/api/auth/login")
     print(f"   GET  http://127.0.0.1:{settings.PORT}/api/auth/me")
+    print(f"   POST http://127.0.0.1:{settings.PORT}/api/upload")
+    print(f"   GET  http://127.0.0.1:{settings.PORT}/api/jobs/{{job_id}}")
+    print(f"   GET  http://127.0.0.1:{settings.PORT}/api/jobs/{{job_id}}/download")
     print("=" * 50)
     
+    if settings.ENVIRONMENT == "production":
+        # 生產模式：gunicorn 多工作程序 + 獨立的轉錄服務（見 gunicorn.conf.py）
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        os.execvp("gunicorn", ["gunicorn", "-c", "gunicorn.conf.py", "main:app"])
+    
     uvicorn.run(
         "main:app",
         host="0.0.0.0",  # 改為 0.0.0.0 以支援外部連線（ngrok）
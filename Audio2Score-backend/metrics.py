@@ -0,0 +1,164 @@
+"""
+Prometheus 指標 - Audio2Score Backend
+把轉錄工作程序回報的各階段耗時與動態批次統計輸出成 Prometheus 文字格式
+"""
+from typing import Dict, Iterable, List, Optional
+
+from auth import password_metrics, token_cache, user_cache
+from database import database
+from startup import startup_report
+from jobs import job_manager
+
+PREFIX = "audio2score"
+
+def _labels(labels: Optional[Dict[str, object]]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+def _metric(lines: List[str], name: str, metric_type: str, help_text: str,
+            samples: Iterable[tuple]):
+    """加入一個指標的 HELP / TYPE 與所有樣本 (後綴, 標籤, 值)"""
+    lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+    lines.append(f"# TYPE {PREFIX}_{name} {metric_type}")
+    for suffix, labels, value in samples:
+        lines.append(f"{PREFIX}_{name}{suffix}{_labels(labels)} {value}")
+
+def _stage_metrics(lines: List[str]):
+    stages = job_manager.stage_metrics()
+    
+    histogram = []
+    for stage, stats in stages.items():
+        for bound, count in zip(stats["bucket_bounds"], stats["buckets"]):
+            histogram.append(("_bucket", {"stage": stage, "le": bound}, count))
+        histogram.append(("_bucket", {"stage": stage, "le": "+Inf"}, stats["count"]))
+        histogram.append(("_sum", {"stage": stage}, stats["wall_seconds"]))
+        histogram.append(("_count", {"stage": stage}, stats["count"]))
+    _metric(lines, "stage_wall_seconds", "histogram", "Wall time per transcription stage", histogram)
+    
+    _metric(lines, "stage_cpu_seconds_total", "counter",
+            "CPU time per transcription stage, including batched inference run on the batcher thread", (
+        ("", {"stage": stage}, stats["cpu_seconds"]) for stage, stats in stages.items()
+    ))
+    _metric(lines, "stage_peak_rss_growth_bytes", "gauge",
+            "Largest worker resident memory growth within a stage, relative to the RSS at stage entry", (
+        ("", {"stage": stage}, stats["peak_rss_growth_bytes"]) for stage, stats in stages.items()
+    ))
+
+def _inference_metrics(lines: List[str]):
+    workers = job_manager.inference_metrics()
+    
+    _metric(lines, "inference_windows_total", "counter", "Windows run through the model", (
+        ("", {"worker": pid}, stats["windows"]) for pid, stats in workers.items()
+    ))
+    _metric(lines, "inference_batches_total", "counter", "Model batches executed", (
+        ("", {"worker": pid}, stats["batches"]) for pid, stats in workers.items()
+    ))
+    _metric(lines, "inference_pending_windows", "gauge", "Windows waiting for a batch", (
+        ("", {"worker": pid}, stats["pending_windows"]) for pid, stats in workers.items()
+    ))
+    _metric(lines, "inference_queue_latency_seconds", "summary", "Batch queue latency (quantiles over the last 1000 requests)", (
+        sample for pid, stats in workers.items()
+        for sample in (
+            *(("", {"worker": pid, "quantile": quantile}, stats[f"queue_latency_{key}"])
+              for quantile, key in (("0.5", "p50"), ("0.95", "p95"), ("1", "max"))),
+            ("_sum", {"worker": pid}, stats["queue_latency_sum"]),
+            ("_count", {"worker": pid}, stats["queue_latency_count"]),
+        )
+    ))
+
+def _password_metrics(lines: List[str]):
+    stats = password_metrics.snapshot()
+    
+    _metric(lines, "password_operations_total", "counter", "bcrypt hash/verify operations", (
+        ("", {"operation": operation}, count) for operation, count in stats["operations"].items()
+    ))
+    _metric(lines, "password_operation_seconds_total", "counter", "Time spent in bcrypt including pool wait", (
+        ("", {"operation": operation}, seconds) for operation, seconds in stats["seconds"].items()
+    ))
+    _metric(lines, "password_operations_in_flight", "gauge", "bcrypt operations queued or running", (
+        ("", None, stats["in_flight"]),
+    ))
+    _metric(lines, "logins_total", "counter", "Login attempts by result", (
+        ("", {"result": result}, count) for result, count in stats["logins"].items()
+    ))
+    _metric(lines, "password_rehashes_total", "counter", "Password hashes upgraded to the configured cost on login", (
+        ("", None, stats["rehashes"]),
+    ))
+
+def _auth_cache_metrics(lines: List[str]):
+    caches = {"token": token_cache, "user": user_cache}
+    _metric(lines, "auth_cache_hits_total", "counter", "Auth cache hits", (
+        ("", {"cache": name}, cache.hits) for name, cache in caches.items()
+    ))
+    _metric(lines, "auth_cache_misses_total", "counter", "Auth cache misses", (
+        ("", {"cache": name}, cache.misses) for name, cache in caches.items()
+    ))
+    _metric(lines, "auth_cache_entries", "gauge", "Entries currently cached", (
+        ("", {"cache": name}, len(cache)) for name, cache in caches.items()
+    ))
+
+def _histogram_samples(bounds, stats: dict, labels: Optional[Dict[str, object]] = None):
+    labels = labels or {}
+    for bound, count in zip(bounds, stats["buckets"]):
+        yield "_bucket", {**labels, "le": bound}, count
+    yield "_bucket", {**labels, "le": "+Inf"}, stats["count"]
+    yield "_sum", labels or None, stats["seconds"]
+    yield "_count", labels or None, stats["count"]
+
+def _database_metrics(lines: List[str]):
+    pool = database.pool_stats()
+    stats = database.metrics
+    
+    _metric(lines, "db_pool_connections", "gauge", "Connections in the asyncpg pool", (
+        ("", {"state": "open"}, pool["size"]),
+        ("", {"state": "idle"}, pool["idle"]),
+        ("", {"state": "in_use"}, pool["size"] - pool["idle"]),
+        ("", {"state": "max"}, pool["max_size"]),
+    ))
+    _metric(lines, "db_pool_waiting", "gauge", "Requests waiting to acquire a connection", (
+        ("", None, stats.waiting),
+    ))
+    _metric(lines, "db_pool_acquire_timeouts_total", "counter", "Acquisitions that timed out and returned 503", (
+        ("", None, stats.timeouts),
+    ))
+    _metric(lines, "db_pool_acquire_seconds", "histogram", "Time spent waiting for a pool connection",
+            _histogram_samples(stats.BUCKETS, stats.acquire))
+    _metric(lines, "db_query_seconds", "histogram", "Latency of the prepared hot queries", (
+        sample for name, query in stats.queries.items()
+        for sample in _histogram_samples(stats.BUCKETS, query, {"query": name})
+    ))
+
+def _startup_metrics(lines: List[str]):
+    _metric(lines, "startup_phase_seconds", "gauge", "Time spent in each startup phase of this process", (
+        ("", {"phase": phase}, seconds) for phase, seconds in startup_report.phases.items()
+    ))
+    _metric(lines, "heavy_modules_loaded", "gauge", "Inference libraries imported into this process", (
+        ("", None, len(startup_report.heavy_modules())),
+    ))
+
+def render_transcription_metrics() -> str:
+    """轉錄服務的指標（各階段耗時、動態批次統計與連線池）"""
+    lines: List[str] = []
+    _startup_metrics(lines)
+    _database_metrics(lines)
+    _stage_metrics(lines)
+    _inference_metrics(lines)
+    return "\n".join(lines) + "\n"
+
+def render_metrics() -> str:
+    """產生 /metrics 的內容（每個 uvicorn 工作程序各自統計）"""
+    lines: List[str] = []
+    _password_metrics(lines)
+    _auth_cache_metrics(lines)
+    _startup_metrics(lines)
+    _database_metrics(lines)
+    if job_manager.run_workers:
+        # 開發模式下推論在 API 程序內執行；生產模式請抓取 transcriber.py 的指標
+        _stage_metrics(lines)
+        _inference_metrics(lines)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,136 @@
+"""
+資料庫結構遷移 - Audio2Score Backend
+
+每個遷移有遞增的版本號，套用後記錄在 schema_version 表格。
+啟動時只查詢一次目前版本；結構已是最新時不執行任何 DDL，
+有待套用的遷移時才取得 advisory lock，讓多個工作程序同時啟動也只會有一個程序執行。
+
+新增遷移：在 MIGRATIONS 結尾加入 (下一個版本號, 說明, SQL)，不要修改已發佈的遷移。
+
+用法：python migrations.py（手動套用，例如部署前）
+"""
+import asyncio
+import os
+import sys
+from typing import List, Tuple
+
+import asyncpg
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import settings
+
+MIGRATION_LOCK_ID = 0x41325343  # 遷移使用的 advisory lock
+
+# (版本, 說明, SQL)；版本 1、3、4 使用 IF NOT EXISTS，可直接套用在舊版 init_db 建立的資料庫上
+MIGRATIONS: List[Tuple[int, str, str]] = [
+    (1, "建立 users 表格", '''
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(50) UNIQUE NOT NULL,
+            email VARCHAR(100) UNIQUE NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    '''),
+    (2, "移除與 UNIQUE 限制重複的 users 索引", '''
+        DROP INDEX IF EXISTS idx_users_email;
+        DROP INDEX IF EXISTS idx_users_username;
+    '''),
+    (3, "建立 transcription_jobs 表格（上傳檔案與轉錄工作）", '''
+        CREATE TABLE IF NOT EXISTS transcription_jobs (
+            id VARCHAR(32) PRIMARY KEY,
+            filename VARCHAR(255) NOT NULL,
+            input_path TEXT NOT NULL,
+            output_path TEXT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            progress REAL NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        ALTER TABLE transcription_jobs
+            ADD COLUMN IF NOT EXISTS audio_sha256 CHAR(64),
+            ADD COLUMN IF NOT EXISTS threshold REAL NOT NULL DEFAULT 0.3;
+        CREATE INDEX IF NOT EXISTS idx_transcription_jobs_status ON transcription_jobs(status, created_at);
+    '''),
+    (4, "建立 transcription_cache 表格（轉錄結果快取索引）", '''
+        CREATE TABLE IF NOT EXISTS transcription_cache (
+            cache_key CHAR(64) PRIMARY KEY,
+            audio_sha256 CHAR(64) NOT NULL,
+            model_sha256 CHAR(64) NOT NULL,
+            params TEXT NOT NULL,
+            size_bytes BIGINT NOT NULL DEFAULT 0,
+            hit_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_accessed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_transcription_cache_lru ON transcription_cache(last_accessed_at);
+    '''),
+    (5, "transcription_jobs 加入 worker_id 與 heartbeat_at（執行中工作的租約）", '''
+        ALTER TABLE transcription_jobs
+            ADD COLUMN IF NOT EXISTS worker_id VARCHAR(64),
+            ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP;
+    '''),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+async def current_version(conn: asyncpg.Connection) -> int:
+    """目前的結構版本；尚未建立 schema_version 時為 0"""
+    if await conn.fetchval("SELECT to_regclass('schema_version')") is None:
+        return 0
+    return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+
+async def migrate(conn: asyncpg.Connection) -> int:
+    """
+    套用所有尚未執行的遷移
+
+    Args:
+        conn: 資料庫連線（在此期間獨佔）
+
+    Returns:
+        int: 本次套用的遷移數量
+    """
+    # 快速路徑：結構已是最新時不取鎖、不執行 DDL
+    if await current_version(conn) >= LATEST_VERSION:
+        return 0
+
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+    try:
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # 等待鎖的期間其他程序可能已經套用完畢
+        version = await current_version(conn)
+        applied = 0
+        for number, description, sql in MIGRATIONS:
+            if number <= version:
+                continue
+            async with conn.transaction():
+                await conn.execute(sql)
+                await conn.execute(
+                    "INSERT INTO schema_version (version, description) VALUES ($1, $2)",
+                    number, description
+                )
+            print(f"✅ 已套用資料庫遷移 {number}: {description}")
+            applied += 1
+        return applied
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+
+async def main():
+    conn = await asyncpg.connect(settings.database_url)
+    try:
+        applied = await migrate(conn)
+        print(f"📦 資料庫結構版本: {await current_version(conn)}（本次套用 {applied} 個遷移）")
+    finally:
+        await conn.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -42,3 +42,15 @@ class TokenData(BaseModel):
     """Token 解碼資料"""
     id: Optional[int] = None
     username: Optional[str] = None
+
+class JobResponse(BaseModel):
+    """轉錄工作狀態"""
+    id: str
+    filename: str
+    status: str = Field(..., description="queued / running / done / failed")
+    progress: float = Field(..., description="進度（0-1）")
+    threshold: Optional[float] = Field(None, description="音符門檻值")
+    error: Optional[str] = None
+    download_url: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
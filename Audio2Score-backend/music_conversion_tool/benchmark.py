@@ -0,0 +1,235 @@
+"""
+轉錄流程效能基準測試（離線、僅使用 CPU）
+
+以合成的鋼琴音訊測量特徵抽取、窗口切分、不同批次大小的模型推論、
+_piano_roll_to_midi 與完整 wav_to_midi，輸出 frames/sec、即時倍率 (RTF) 與峰值記憶體，
+並存成 JSON 基準檔，可與其他 commit 的結果比較。
+
+用法：
+    python benchmark.py                                  # 10 秒到 1 小時
+    python benchmark.py --durations 10,60 --repeats 5
+    python benchmark.py --compare benchmarks/<舊結果>.json
+"""
+import os
+
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "-1")  # 固定在 CPU 上測量，結果才能互相比較
+os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+import shutil
+
+import keras
+import numpy as np
+import soundfile as sf
+import tensorflow as tf
+
+from music_tool import THIS_DIR, MaestroDataProcessor, MidiGenerationModel, MidiGenerator, pipeline_profiler
+
+AUDIO_SR = 44100  # 合成音訊的取樣率，讓測量包含重取樣
+BLOCK_SECONDS = 10
+
+
+def synthetic_notes(duration, seed, notes_per_second=8.0):
+    """產生固定亂數種子的音符 (start, end, pitch, velocity)"""
+    rng = np.random.default_rng(seed)
+    n_notes = int(duration * notes_per_second)
+    starts = np.sort(rng.uniform(0, duration, n_notes))
+    ends = np.minimum(starts + np.clip(rng.exponential(0.4, n_notes), 0.05, 4.0), duration)
+    pitches = rng.integers(36, 97, n_notes)
+    velocities = rng.integers(40, 111, n_notes)
+    return np.stack([starts, ends, pitches, velocities], axis=1)
+
+
+def write_synthetic_audio(path, notes, duration):
+    """把音符合成為衰減的正弦波並分區塊寫入 WAV，記憶體與長度無關"""
+    block_size = BLOCK_SECONDS * AUDIO_SR
+    n_samples = int(duration * AUDIO_SR)
+    with sf.SoundFile(path, "w", samplerate=AUDIO_SR, channels=1, subtype="PCM_16") as f:
+        for block_start in range(0, n_samples, block_size):
+            t = np.arange(block_start, min(block_start + block_size, n_samples)) / AUDIO_SR
+            block = np.zeros(len(t))
+            t0, t1 = t[0], t[-1]
+            active = notes[(notes[:, 0] <= t1) & (notes[:, 1] >= t0)]
+            for start, end, pitch, velocity in active:
+                mask = (t >= start) & (t < end)
+                dt = t[mask] - start
+                freq = 440.0 * 2 ** ((pitch - 69) / 12)
+                block[mask] += velocity / 127 * np.exp(-3 * dt) * np.sin(2 * np.pi * freq * dt)
+            f.write(0.1 * block)
+
+
+def timed(fn, repeats):
+    """執行 repeats 次，回傳 (最後一次的結果, 各次秒數)"""
+    times = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, times
+
+
+def record(results, benchmark, duration, times, frames, **extra):
+    seconds = float(np.median(times))
+    entry = {
+        "benchmark": benchmark,
+        "duration_s": duration,
+        **extra,
+        "seconds_median": seconds,
+        "seconds_min": float(np.min(times)),
+        "frames": int(frames),
+        "frames_per_second": frames / seconds if seconds > 0 else 0.0,
+        "real_time_factor": seconds / duration,
+        "peak_rss_bytes": pipeline_profiler.peak_rss(),
+    }
+    results.append(entry)
+    label = f"{benchmark}" + "".join(f" {key}={value}" for key, value in extra.items())
+    print(f"  {label:<32} {seconds * 1000:10.1f} ms  {entry['frames_per_second']:12.0f} frames/s  "
+          f"RTF {entry['real_time_factor']:.4f}  peak {entry['peak_rss_bytes'] / 2**20:.0f} MiB")
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=THIS_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    keras.utils.set_random_seed(args.seed)
+    processor = MaestroDataProcessor()
+
+    workdir = Path(tempfile.mkdtemp(prefix="a2s_bench_"))
+    model_path = workdir / "random_model.keras"
+    input_shape = (processor.sequence_length, processor.n_mels)
+    MidiGenerationModel(input_shape, (processor.sequence_length, 128)).save(model_path)
+    generator = MidiGenerator(model_path, processor)
+
+    results = []
+    try:
+        # 由短到長執行，峰值記憶體是程序至今的最大值
+        for duration in sorted(args.durations):
+            run_duration(args, processor, generator, workdir, duration, results)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "tensorflow": tf.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        },
+        "results": results,
+    }
+
+
+def run_duration(args, processor, generator, workdir, duration, results):
+    """對一段指定長度的合成音訊執行所有測試"""
+    print(f"\n=== {duration:g} s synthetic audio ===")
+    notes = synthetic_notes(duration, args.seed)
+    wav_path = workdir / f"synthetic_{duration:g}s.wav"
+    write_synthetic_audio(wav_path, notes, duration)
+
+    features, times = timed(lambda: processor.load_audio_features(wav_path), args.repeats)
+    n_frames = len(features)
+    record(results, "feature_extraction", duration, times, n_frames)
+
+    (windows, tail_window), times = timed(lambda: generator._frame_windows(features), args.repeats)
+    record(results, "windowing", duration, times, n_frames)
+
+    # 推論只取前 max_windows 個窗口，避免長音訊在小批次時耗時過久
+    sample = np.ascontiguousarray(windows[:args.max_windows])
+    for batch_size in args.batch_sizes:
+        generator.batch_size = batch_size
+        generator._predict(sample[:batch_size])  # 暖身：建立該批次大小的計算圖
+        _, times = timed(lambda: generator._predict(sample), args.repeats)
+        record(results, "inference", duration, times, len(sample) * processor.sequence_length,
+               batch_size=batch_size)
+    generator.batch_size = args.e2e_batch_size
+
+    roll = processor._rasterize_notes(notes, n_frames, np.float32)
+    midi_path = workdir / "bench.mid"
+    _, times = timed(lambda: generator._piano_roll_to_midi(roll, midi_path), args.repeats)
+    record(results, "piano_roll_to_midi", duration, times, n_frames)
+
+    _, times = timed(lambda: generator.wav_to_midi(wav_path, midi_path), args.repeats)
+    record(results, "wav_to_midi", duration, times, n_frames, batch_size=args.e2e_batch_size)
+
+    wav_path.unlink()
+
+
+def compare(current, baseline_path, tolerance):
+    """與基準檔逐項比較，回傳是否有超過容忍度的退步"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    def key(entry):
+        return entry["benchmark"], entry["duration_s"], entry.get("batch_size")
+
+    previous = {key(entry): entry for entry in baseline["results"]}
+    print(f"\n=== Compared with {baseline_path} (commit {baseline['meta'].get('commit')}) ===")
+    regressed = False
+    for entry in current["results"]:
+        old = previous.get(key(entry))
+        if old is None:
+            continue
+        ratio = entry["seconds_median"] / old["seconds_median"] if old["seconds_median"] > 0 else 1.0
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  ⚠️ regression"
+            regressed = True
+        benchmark, duration, batch_size = key(entry)
+        label = f"{benchmark} {duration:g}s" + (f" batch={batch_size}" if batch_size else "")
+        print(f"  {label:<36} {old['seconds_median'] * 1000:10.1f} ms -> "
+              f"{entry['seconds_median'] * 1000:10.1f} ms  ({ratio:.2f}x){flag}")
+    return regressed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Audio2Score 轉錄效能基準測試")
+    parser.add_argument("--durations", default="10,60,600,3600",
+                        help="合成音訊長度（秒），以逗號分隔")
+    parser.add_argument("--batch-sizes", default="1,8,32,64", help="推論批次大小，以逗號分隔")
+    parser.add_argument("--e2e-batch-size", type=int, default=8, help="wav_to_midi 使用的批次大小")
+    parser.add_argument("--max-windows", type=int, default=256, help="推論測試最多使用的窗口數")
+    parser.add_argument("--repeats", type=int, default=3, help="每項測試重複次數（取中位數）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON 結果路徑（預設 benchmarks/<commit>_<時間>.json）")
+    parser.add_argument("--compare", help="要比較的基準 JSON 檔")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="視為退步的變慢比例")
+    args = parser.parse_args()
+    args.durations = [float(value) for value in args.durations.split(",")]
+    args.batch_sizes = [int(value) for value in args.batch_sizes.split(",")]
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run(args)
+
+    output = Path(args.output) if args.output else (
+        THIS_DIR / "benchmarks" / f"{report['meta']['commit'] or 'local'}_{datetime.now():%Y%m%d_%H%M%S}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.compare and compare(report, args.compare, args.tolerance):
+        sys.exit(1)
@@ -0,0 +1,186 @@
+"""
+把訓練好的 Keras 模型匯出為 TFLite，並與 Keras 模型比對推論結果
+
+匯出後以範例音訊（未指定時使用合成音訊）同時跑 Keras 與 TFLite 後端，
+比較窗口預測的誤差、以門檻值二值化後的鋼琴捲 F1，以及每個窗口的推論延遲；
+誤差超過容忍度時以非零狀態結束。
+
+部署：設定 INFERENCE_BACKEND=tflite 與 TFLITE_MODEL_PATH=<匯出的 .tflite>
+
+用法：
+    python export_tflite.py                                  # saved_models/best_model.keras -> best_model.tflite
+    python export_tflite.py --quantize int8                  # 動態範圍 int8 量化 -> best_model_int8.tflite
+    python export_tflite.py --audio test2.wav --threads 4
+    python export_tflite.py --skip-export --output saved_models/best_model_int8.tflite
+"""
+import os
+
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "-1")  # 在 CPU 上比對，與部署環境一致
+os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import keras
+import numpy as np
+import tensorflow as tf
+
+from music_tool import THIS_DIR, MaestroDataProcessor, MidiGenerator
+
+DEFAULT_MODEL = THIS_DIR / "saved_models" / "best_model.keras"
+
+
+def export_tflite(model_path, output_path, quantize=None, select_tf_ops=False):
+    """
+    將 .keras 模型轉為 .tflite（批次維度保持動態）
+
+    Args:
+        quantize: None 或 "int8"（動態範圍量化：權重存成 int8，啟動與記憶體更小）
+        select_tf_ops: 允許 TFLite 內建運算以外的 TF 運算（需要完整 TensorFlow 的 Flex delegate）
+    """
+    model = keras.models.load_model(model_path)
+    signature = tf.TensorSpec([None, *model.input_shape[1:]], tf.float32)
+    forward = tf.function(lambda x: model(x, training=False), input_signature=[signature])
+
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([forward.get_concrete_function()], model)
+    if quantize == "int8":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if select_tf_ops:
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS
+        ]
+        converter._experimental_lower_tensor_list_ops = False
+
+    flatbuffer = converter.convert()
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_bytes(flatbuffer)
+    print(f"TFLite model saved to: {output_path} "
+          f"({os.path.getsize(model_path) / 2**20:.1f} MiB -> {len(flatbuffer) / 2**20:.1f} MiB)")
+
+
+def sample_audio(workdir, seconds, seed):
+    """產生比對用的合成鋼琴音訊"""
+    from benchmark import synthetic_notes, write_synthetic_audio
+
+    path = workdir / f"parity_{seconds:g}s.wav"
+    write_synthetic_audio(path, synthetic_notes(seconds, seed), seconds)
+    return path
+
+
+def per_window_latency(generator, windows, batch_size, repeats):
+    """每個窗口的推論延遲中位數（毫秒）"""
+    generator.batch_size = batch_size
+    generator._predict(windows[:batch_size])  # 暖身
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        generator._predict(windows)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)) / len(windows) * 1000
+
+
+def parity_check(model_path, tflite_path, audio_paths, threshold, batch_size, threads, repeats):
+    """以同一批窗口比較 Keras 與 TFLite 的輸出，回傳每個音訊檔的比對結果"""
+    processor = MaestroDataProcessor()
+    keras_generator = MidiGenerator(model_path, processor, use_tf_function=True)
+    tflite_generator = MidiGenerator(tflite_path, processor, backend="tflite", num_threads=threads)
+
+    results = []
+    for audio_path in audio_paths:
+        features = processor.load_audio_features(audio_path)
+        windows, tail_window = keras_generator._frame_windows(features)
+        if windows is None:
+            print(f"⚠️ {audio_path} 太短，略過")
+            continue
+        windows = np.concatenate([windows, tail_window])
+
+        expected = keras_generator._predict(windows)
+        actual = tflite_generator._predict(windows)
+        error = np.abs(expected.astype(np.float32) - actual.astype(np.float32))
+
+        # 以門檻值二值化後的逐幀音符一致程度
+        expected_on, actual_on = expected >= threshold, actual >= threshold
+        true_positive = np.count_nonzero(expected_on & actual_on)
+        denominator = np.count_nonzero(expected_on) + np.count_nonzero(actual_on)
+        f1 = 2 * true_positive / denominator if denominator else 1.0
+
+        result = {
+            "audio": str(audio_path),
+            "windows": len(windows),
+            "max_abs_error": float(error.max()),
+            "mean_abs_error": float(error.mean()),
+            "binary_f1": f1,
+            "keras_ms_per_window": per_window_latency(keras_generator, windows, batch_size, repeats),
+            "tflite_ms_per_window": per_window_latency(tflite_generator, windows, batch_size, repeats),
+        }
+        results.append(result)
+        print(f"  {Path(audio_path).name}: {result['windows']} windows, "
+              f"max |Δ| {result['max_abs_error']:.5f}, mean |Δ| {result['mean_abs_error']:.6f}, "
+              f"F1@{threshold} {result['binary_f1']:.4f}, "
+              f"{result['keras_ms_per_window']:.2f} -> {result['tflite_ms_per_window']:.2f} ms/window")
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="匯出 TFLite 模型並檢查與 Keras 模型的一致性")
+    parser.add_argument("--model", type=Path, default=DEFAULT_MODEL, help="要匯出的 .keras 模型")
+    parser.add_argument("--output", type=Path, help="輸出的 .tflite（預設與模型同目錄同名）")
+    parser.add_argument("--quantize", choices=("none", "int8"), default="none", help="int8 為動態範圍量化")
+    parser.add_argument("--select-tf-ops", action="store_true",
+                        help="轉換失敗時允許 TF 運算（執行時需要完整 TensorFlow）")
+    parser.add_argument("--skip-export", action="store_true", help="只對既有的 --output 做一致性檢查")
+    parser.add_argument("--audio", action="append", type=Path, help="比對用的音訊，可重複指定；預設使用合成音訊")
+    parser.add_argument("--sample-seconds", type=float, default=30, help="合成音訊長度（秒）")
+    parser.add_argument("--threshold", type=float, default=0.3, help="計算 F1 的音符門檻值")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--threads", type=int, help="TFLite interpreter 執行緒數，預設為 CPU 核心數")
+    parser.add_argument("--repeats", type=int, default=3, help="延遲量測的重複次數")
+    parser.add_argument("--max-error", type=float, help="容許的最大絕對誤差（預設 float32 1e-3，int8 0.1）")
+    parser.add_argument("--min-f1", type=float, help="容許的最低 F1（預設 float32 0.99，int8 0.95）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--report", type=Path, help="將比對結果另存為 JSON")
+    args = parser.parse_args()
+
+    quantized = args.quantize == "int8"
+    if args.output is None:
+        args.output = args.model.with_name(args.model.stem + ("_int8" if quantized else "") + ".tflite")
+    if args.max_error is None:
+        args.max_error = 0.1 if quantized else 1e-3
+    if args.min_f1 is None:
+        args.min_f1 = 0.95 if quantized else 0.99
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    keras.utils.set_random_seed(args.seed)
+
+    if not args.skip_export:
+        export_tflite(args.model, args.output, None if args.quantize == "none" else args.quantize,
+                      args.select_tf_ops)
+
+    workdir = Path(tempfile.mkdtemp(prefix="a2s_tflite_"))
+    try:
+        audio_paths = args.audio or [sample_audio(workdir, args.sample_seconds, args.seed)]
+        print(f"\n=== Parity: {args.model.name} vs {args.output.name} ===")
+        results = parity_check(args.model, args.output, audio_paths, args.threshold,
+                               args.batch_size, args.threads, args.repeats)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"model": str(args.model), "tflite": str(args.output), "quantize": args.quantize,
+                       "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Results saved to {args.report}")
+
+    failed = [r for r in results if r["max_abs_error"] > args.max_error or r["binary_f1"] < args.min_f1]
+    if not results or failed:
+        print(f"❌ Parity check failed (max |Δ| <= {args.max_error}, F1 >= {args.min_f1})")
+        sys.exit(1)
+    print(f"✅ Parity check passed (max |Δ| <= {args.max_error}, F1 >= {args.min_f1})")
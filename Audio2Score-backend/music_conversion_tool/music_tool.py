@@ -1,82 +1,383 @@
 import os
+import importlib
+import types
 from pathlib import Path
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import librosa
+import soundfile as sf
+import soxr
 import pretty_midi
 from midiutil import MIDIFile
-import tensorflow as tf
-import keras
-from keras import layers
 import json
+import csv
+import threading
+import time
+import multiprocessing as mp
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 import glob
-from matplotlib import pyplot as plt
-from sklearn.model_selection import train_test_split
+try:
+    import resource
+except ImportError:  # Windows 沒有 resource 模組，不記錄峰值記憶體
+    resource = None
 
-print("Num GPUs Available: ", len(tf.config.list_physical_devices('GPU')))
+THIS_DIR = Path(__file__).resolve().parent
+
+
+class _LazyModule(types.ModuleType):
+    """第一次存取屬性時才匯入的模組：只抽取特徵的程序（例如特徵庫的平行工作程序）不必載入 TensorFlow"""
+    
+    def __init__(self, name):
+        super().__init__(name)
+        self._module = None
+    
+    def __getattr__(self, attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        if self._module is None:
+            start = time.perf_counter()
+            self._module = importlib.import_module(self.__name__)
+            print(f"⏱️ 載入 {self.__name__} 耗時 {time.perf_counter() - start:.2f} 秒")
+        return getattr(self._module, attr)
+
+
+tf = _LazyModule("tensorflow")
+keras = _LazyModule("keras")
+layers = _LazyModule("keras.layers")
+
+
+class PipelineProfiler:
+    """轉錄流程各階段的耗時統計：牆鐘時間、CPU 時間與階段內的常駐記憶體增加量
+    
+    CPU 時間為呼叫執行緒的時間，加上由其他執行緒代為執行的工作（InferenceBatcher 的前向運算）以 charge_cpu 記入的時間。
+    記憶體增加量以進入階段時的 RSS 為基準：程序峰值在階段內創新高時取新的峰值，否則取離開時的 RSS；
+    同一程序同時執行多個工作時為近似值。
+    """
+    
+    BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._local = threading.local()  # 目前執行緒正在記錄的單次轉錄
+    
+    @staticmethod
+    def peak_rss():
+        """程序至今的峰值常駐記憶體（bytes）"""
+        if resource is None:
+            return 0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    
+    @classmethod
+    def memory(cls):
+        """目前與至今峰值的常駐記憶體 (rss, peak)（bytes）；沒有 /proc 時目前值為 0"""
+        try:
+            with open("/proc/self/status", "rb") as f:
+                fields = dict(line.split(b":", 1) for line in f if line.startswith((b"VmRSS", b"VmHWM")))
+            return int(fields[b"VmRSS"].split()[0]) * 1024, int(fields[b"VmHWM"].split()[0]) * 1024
+        except (OSError, KeyError, ValueError):
+            return 0, cls.peak_rss()
+    
+    def charge_cpu(self, seconds):
+        """把其他執行緒代為執行的 CPU 時間記入目前執行緒進行中的所有階段"""
+        for charged in getattr(self._local, "charged", ()):
+            charged[0] += seconds
+    
+    @contextmanager
+    def _measure(self, measured):
+        """量測一段程式，離開時把 wall、cpu、growth 寫入 measured"""
+        if not hasattr(self._local, "charged"):
+            self._local.charged = []
+        charged = [0.0]
+        self._local.charged.append(charged)
+        rss_start, peak_start = self.memory()
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            measured["wall"] = time.perf_counter() - wall_start
+            self._local.charged.remove(charged)
+            measured["cpu"] = time.thread_time() - cpu_start + charged[0]
+            rss_end, peak_end = self.memory()
+            measured["growth"] = max(0, max(rss_end, peak_end if peak_end > peak_start else 0) - rss_start)
+    
+    def _record(self, name, wall, cpu, growth):
+        with self._lock:
+            stats = self._stages.setdefault(name, {
+                "count": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_rss_growth_bytes": 0,
+                "buckets": [0] * len(self.BUCKETS),
+            })
+            stats["count"] += 1
+            stats["wall_seconds"] += wall
+            stats["cpu_seconds"] += cpu
+            stats["peak_rss_growth_bytes"] = max(stats["peak_rss_growth_bytes"], growth)
+            for i, bound in enumerate(self.BUCKETS):
+                if wall <= bound:
+                    stats["buckets"][i] += 1
+        
+        records = getattr(self._local, "records", None)
+        if records is not None:
+            records.append({"stage": name, "wall_seconds": round(wall, 6),
+                            "cpu_seconds": round(cpu, 6), "peak_rss_growth_bytes": growth})
+    
+    @contextmanager
+    def stage(self, name):
+        """記錄一個階段；在 run() 之內時也會寫入該次轉錄的結構化日誌"""
+        measured = {}
+        try:
+            with self._measure(measured):
+                yield
+        finally:
+            self._record(name, **measured)
+    
+    @contextmanager
+    def block_stage(self, name):
+        """串流轉錄中每個區塊重複的階段：在 run() 之內累加，run 結束時每個階段記錄一次
+        
+        與 wav_to_midi 使用相同的階段名稱，兩種轉錄的統計可直接比較；記憶體增加量取各區塊的最大值。
+        """
+        totals = getattr(self._local, "block_totals", None)
+        if totals is None:
+            with self.stage(name):
+                yield
+            return
+        measured = {}
+        try:
+            with self._measure(measured):
+                yield
+        finally:
+            total = totals.setdefault(name, {"wall": 0.0, "cpu": 0.0, "growth": 0})
+            total["wall"] += measured["wall"]
+            total["cpu"] += measured["cpu"]
+            total["growth"] = max(total["growth"], measured["growth"])
+    
+    @contextmanager
+    def run(self, **fields):
+        """包住一次完整轉錄，結束時以一行 JSON 輸出各階段耗時"""
+        self._local.records = records = []
+        self._local.block_totals = block_totals = {}
+        wall_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.block_totals = None
+            for name, total in block_totals.items():
+                self._record(name, **total)
+            self._local.records = None
+            print(json.dumps({
+                "event": "transcription_profile",
+                **fields,
+                "total_seconds": round(time.perf_counter() - wall_start, 6),
+                "stages": records,
+            }, ensure_ascii=False))
+    
+    def snapshot(self):
+        """各階段累計統計（可跨程序傳遞的純 dict）"""
+        with self._lock:
+            return {
+                name: {**stats, "buckets": list(stats["buckets"]), "bucket_bounds": list(self.BUCKETS)}
+                for name, stats in self._stages.items()
+            }
+
+
+pipeline_profiler = PipelineProfiler()
 
 class MaestroDataProcessor:
-    def __init__(self, sr=22050, hop_length=512, n_mels=128, sequence_length=100):
+    def __init__(self, sr=22050, hop_length=512, n_mels=128, sequence_length=100,
+                 feature_dtype=np.float32, target_dtype=np.float16):
         self.sr = sr
         self.hop_length = hop_length
         self.n_mels = n_mels
         self.sequence_length = sequence_length
         self.frames_per_second = sr / hop_length
+        # 資料型別設定：特徵 float32/float16，目標 float16（velocity/127）或 uint8（原始 velocity）
+        self.feature_dtype = np.dtype(feature_dtype)
+        self.target_dtype = np.dtype(target_dtype)
         
     def load_audio_features(self, audio_path):
-        """從WAV檔案提取音訊特徵"""
+        """從WAV檔案提取音訊特徵；失敗時回傳 None"""
         try:
-            # 載入音訊
-            y, sr = librosa.load(audio_path, sr=self.sr)
-            
-            # 提取Mel頻譜圖
+            return self.extract_audio_features(audio_path)
+        except Exception as e:
+            print(f"Error processing audio {audio_path}: {e}")
+            return None
+    
+    def extract_audio_features(self, audio_path):
+        """從WAV檔案提取音訊特徵 (時間幀, 頻率)；失敗時拋出例外"""
+        # 載入音訊（分開解碼與重取樣以便分別計時，結果與 librosa.load(sr=self.sr) 相同）
+        with pipeline_profiler.stage("decode"):
+            y, sr = librosa.load(audio_path, sr=None)
+        with pipeline_profiler.stage("resample"):
+            if sr != self.sr:
+                y = librosa.resample(y, orig_sr=sr, target_sr=self.sr)
+                sr = self.sr
+        
+        # 提取Mel頻譜圖
+        with pipeline_profiler.stage("mel"):
             mel_spec = librosa.feature.melspectrogram(
                 y=y, sr=sr, n_mels=self.n_mels, hop_length=self.hop_length
             )
+        
+        with pipeline_profiler.stage("normalize"):
             log_mel_spec = librosa.power_to_db(mel_spec, ref=np.max)
             
             # 正規化到 [0, 1]
             log_mel_spec = (log_mel_spec - np.min(log_mel_spec)) / (np.max(log_mel_spec) - np.min(log_mel_spec) + 1e-8)
             
-            return log_mel_spec.T  # 轉置為 (時間幀, 頻率)
-            
-        except Exception as e:
-            print(f"Error processing audio {audio_path}: {e}")
-            return None
+            return np.ascontiguousarray(log_mel_spec.T, dtype=self.feature_dtype)  # 轉置為 (時間幀, 頻率)
+    
+    def stream_audio(self, audio_path, block_frames=2048):
+        """以區塊讀取WAV檔案，轉為單聲道並串流重取樣到 self.sr"""
+        info = sf.info(str(audio_path))
+        resampler = None
+        if info.samplerate != self.sr:
+            resampler = soxr.ResampleStream(info.samplerate, self.sr, 1, dtype='float32', quality='HQ')
+        
+        # 每個區塊約對應 block_frames 個 Mel 幀
+        block_size = int(np.ceil(block_frames * self.hop_length * info.samplerate / self.sr))
+        blocks = sf.blocks(str(audio_path), blocksize=block_size, dtype='float32', always_2d=True)
+        while True:
+            with pipeline_profiler.block_stage("decode"):
+                block = next(blocks, None)
+                if block is not None:
+                    y = block.mean(axis=1, dtype=np.float32)
+            if block is None:
+                break
+            if resampler is not None:
+                with pipeline_profiler.block_stage("resample"):
+                    y = resampler.resample_chunk(y)
+            if len(y):
+                yield y
+        
+        if resampler is not None:
+            with pipeline_profiler.block_stage("resample"):
+                y = resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+            if len(y):
+                yield y
+    
+    def stream_mel_power(self, audio_path, block_frames=2048, n_fft=2048):
+        """逐區塊計算Mel功率頻譜 (n_mels, 幀)，幀的位置與 center=True 的整段計算相同"""
+        # 前後各補 n_fft // 2 個零，等同 librosa 的 center=True, pad_mode='constant'
+        buffer = np.zeros(n_fft // 2, dtype=np.float32)
+        
+        def take_frames(buffer):
+            n_frames = 1 + (len(buffer) - n_fft) // self.hop_length if len(buffer) >= n_fft else 0
+            if n_frames == 0:
+                return None, buffer
+            with pipeline_profiler.block_stage("mel"):
+                mel_spec = librosa.feature.melspectrogram(
+                    y=buffer[:(n_frames - 1) * self.hop_length + n_fft], sr=self.sr,
+                    n_fft=n_fft, n_mels=self.n_mels, hop_length=self.hop_length, center=False
+                )
+            return mel_spec, buffer[n_frames * self.hop_length:]
+        
+        for y in self.stream_audio(audio_path, block_frames):
+            buffer = np.concatenate([buffer, y])
+            mel_spec, buffer = take_frames(buffer)
+            if mel_spec is not None:
+                yield mel_spec
+        
+        buffer = np.concatenate([buffer, np.zeros(n_fft // 2, dtype=np.float32)])
+        mel_spec, _ = take_frames(buffer)
+        if mel_spec is not None:
+            yield mel_spec
+    
+    def stream_audio_features(self, audio_path, block_frames=2048, top_db=80.0):
+        """串流版 load_audio_features：逐區塊產生正規化後的 (時間幀, 頻率) 特徵
+        
+        正規化需要整段的最大/最小值，因此先串流一次統計功率極值，
+        第二次才輸出特徵；記憶體只與區塊大小有關，結果與整段計算一致。
+        """
+        power_min, power_max = np.inf, 0.0
+        for mel_spec in self.stream_mel_power(audio_path, block_frames):
+            power_min = min(power_min, float(mel_spec.min()))
+            power_max = max(power_max, float(mel_spec.max()))
+        if not np.isfinite(power_min):
+            return
+        
+        # 對應 power_to_db(ref=np.max, top_db=80) 之後的最小/最大值
+        db_floor = -top_db
+        db_min = max(float(librosa.power_to_db(power_min, ref=power_max, top_db=None)), db_floor)
+        db_max = 0.0
+        
+        for mel_spec in self.stream_mel_power(audio_path, block_frames):
+            with pipeline_profiler.block_stage("normalize"):
+                log_mel_spec = librosa.power_to_db(mel_spec, ref=power_max, top_db=None)
+                np.maximum(log_mel_spec, db_floor, out=log_mel_spec)
+                log_mel_spec = (log_mel_spec - db_min) / (db_max - db_min + 1e-8)
+                features = np.ascontiguousarray(log_mel_spec.T, dtype=self.feature_dtype)
+            yield features
     
-    def load_midi_data(self, midi_path):
-        """從MIDI檔案提取鋼琴捲表示"""
+    def load_midi_data(self, midi_path, n_frames=None, dtype=None, onsets_offsets=False):
+        """從MIDI檔案提取鋼琴捲表示
+        
+        n_frames 通常傳入音訊特徵的幀數；未指定時依 MIDI 結束時間決定長度。
+        dtype 預設為 target_dtype。
+        float 輸出為 velocity/127，uint8 輸出為原始 velocity。
+        onsets_offsets=True 時回傳 (piano_roll, onsets, offsets)，後兩者為 0/1 的 uint8。
+        失敗時回傳 None。
+        """
         try:
-            midi_data = pretty_midi.PrettyMIDI(midi_path)
-            
-            # 使用更精細的時間解析度
-            total_frames = int(self.sequence_length * self.frames_per_second)
-            piano_roll = np.zeros((total_frames, 128))
-            
-            for instrument in midi_data.instruments:
-                # 只處理鋼琴樂器
-                if not instrument.is_drum:
-                    for note in instrument.notes:
-                        # 計算開始和結束幀
-                        start_frame = int(note.start * self.frames_per_second)
-                        end_frame = int(note.end * self.frames_per_second)
-                        
-                        # 確保在範圍內
-                        start_frame = min(start_frame, total_frames - 1)
-                        end_frame = min(end_frame, total_frames - 1)
-                        
-                        if start_frame < end_frame:  # 確保有效的音符範圍
-                            pitch = int(note.pitch)
-                            if 0 <= pitch < 128:
-                                # 使用velocity信息（歸一化到0-1）
-                                velocity_norm = note.velocity / 127.0
-                                piano_roll[start_frame:end_frame, pitch] = velocity_norm
-            
-            return piano_roll
-            
+            return self.extract_midi_data(midi_path, n_frames, dtype, onsets_offsets)
         except Exception as e:
             print(f"Error processing MIDI {midi_path}: {e}")
             return None
     
+    def extract_midi_data(self, midi_path, n_frames=None, dtype=None, onsets_offsets=False):
+        """與 load_midi_data 相同，但失敗時拋出例外"""
+        midi_data = pretty_midi.PrettyMIDI(midi_path)
+        
+        # 只處理鋼琴樂器
+        notes = [
+            (note.start, note.end, note.pitch, note.velocity)
+            for instrument in midi_data.instruments if not instrument.is_drum
+            for note in instrument.notes
+        ]
+        notes = np.array(notes, dtype=np.float64).reshape(-1, 4)
+        
+        if n_frames is None:
+            n_frames = int(np.ceil(midi_data.get_end_time() * self.frames_per_second)) + 1
+        
+        return self._rasterize_notes(notes, n_frames, dtype or self.target_dtype, onsets_offsets)
+    
+    def _rasterize_notes(self, notes, n_frames, dtype=np.float16, onsets_offsets=False):
+        """把 (start, end, pitch, velocity) 陣列向量化地填入 (幀, 128) 鋼琴捲"""
+        piano_roll = np.zeros((n_frames, 128), dtype=dtype)
+        
+        # 計算開始和結束幀，超出範圍的部分直接截掉
+        start_frames = (notes[:, 0] * self.frames_per_second).astype(np.int64)
+        end_frames = np.minimum((notes[:, 1] * self.frames_per_second).astype(np.int64), n_frames)
+        pitches = notes[:, 2].astype(np.int64)
+        velocities = notes[:, 3]
+        
+        # 確保有效的音符範圍
+        valid = (start_frames < end_frames) & (pitches >= 0) & (pitches < 128)
+        start_frames, end_frames = start_frames[valid], end_frames[valid]
+        pitches, velocities = pitches[valid], velocities[valid]
+        
+        # 展開每個音符涵蓋的所有幀；重疊時與逐音符填寫相同，後面的音符覆蓋前面的
+        lengths = end_frames - start_frames
+        note_offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        frames = np.repeat(start_frames, lengths) + np.arange(lengths.sum()) - note_offsets
+        if np.issubdtype(dtype, np.integer):
+            values = velocities
+        else:
+            values = velocities / 127.0
+        piano_roll[frames, np.repeat(pitches, lengths)] = np.repeat(values, lengths)
+        
+        if not onsets_offsets:
+            return piano_roll
+        
+        onsets = np.zeros((n_frames, 128), dtype=np.uint8)
+        offsets = np.zeros((n_frames, 128), dtype=np.uint8)
+        onsets[start_frames, pitches] = 1
+        ended = end_frames < n_frames
+        offsets[end_frames[ended], pitches[ended]] = 1
+        return piano_roll, onsets, offsets
+    
     def create_sequences(self, features, targets):
         """創建訓練序列 - 改進版本"""
         X, y = [], []
@@ -90,16 +391,103 @@ class MaestroDataProcessor:
         
         return np.array(X), np.array(y)
     
-    def process_dataset(self, data_dir, max_files=None):
-        """處理整個MAESTRO資料集 - 改進版本"""
+    METADATA_FILES = ("maestro-v3.0.0.csv", "maestro-v3.0.0.json")
+    
+    def load_metadata(self, data_dir):
+        """讀取 MAESTRO 附帶的 metadata（csv 或 json），找不到時回傳 None"""
+        for filename in self.METADATA_FILES:
+            metadata_path = Path(data_dir) / filename
+            if metadata_path.exists():
+                break
+        else:
+            return None
+        
+        if metadata_path.suffix == ".csv":
+            with open(metadata_path, newline="", encoding="utf-8") as f:
+                rows = list(csv.DictReader(f))
+        else:
+            # json 為欄位導向：{欄位: {列號: 值}}
+            with open(metadata_path, encoding="utf-8") as f:
+                columns = json.load(f)
+            row_ids = sorted(next(iter(columns.values())), key=int)
+            rows = [{column: values[row_id] for column, values in columns.items()} for row_id in row_ids]
+        
+        for row in rows:
+            row["year"] = int(row["year"])
+            row["duration"] = float(row["duration"])
+        return rows
+    
+    def select_recordings(self, data_dir, split=None, years=None, composers=None, max_duration=None, max_files=None):
+        """依 metadata 選出錄音（split / 年份 / 作曲家 / 總長度上限，單位秒），不需掃描檔案系統
+        
+        回傳的每筆錄音包含 audio_path、midi_path 與 split、year、composer、duration。
+        沒有 metadata 時退回以 glob 搜尋，此時無法依條件篩選。
+        """
+        metadata = self.load_metadata(data_dir)
+        if metadata is None:
+            if split or years or composers or max_duration:
+                print(f"MAESTRO metadata not found in {data_dir}, ignoring split/year/composer/duration filters")
+            return [
+                {"audio_path": audio_path, "midi_path": midi_path, "split": None}
+                for audio_path, midi_path in self._glob_pairs(data_dir, max_files)
+            ]
+        
+        splits = {split} if isinstance(split, str) else set(split or ())
+        years = set(years or ())
+        composers = [composer.lower() for composer in composers or ()]
+        
+        recordings = []
+        total_duration = 0.0
+        missing = []  # metadata 中有、但檔案不存在的錄音
+        for row in metadata:
+            if splits and row["split"] not in splits:
+                continue
+            if years and row["year"] not in years:
+                continue
+            if composers and not any(c in row["canonical_composer"].lower() for c in composers):
+                continue
+            if max_duration is not None and total_duration + row["duration"] > max_duration:
+                break
+            if max_files and len(recordings) >= max_files:
+                break
+            
+            audio_path = os.path.join(data_dir, row["audio_filename"])
+            midi_path = os.path.join(data_dir, row["midi_filename"])
+            if not (os.path.exists(audio_path) and os.path.exists(midi_path)):
+                missing.append(row["audio_filename"])
+                continue
+            
+            recordings.append({
+                "audio_path": audio_path,
+                "midi_path": midi_path,
+                "split": row["split"],
+                "year": row["year"],
+                "composer": row["canonical_composer"],
+                "duration": row["duration"],
+            })
+            total_duration += row["duration"]
+        
+        if missing:
+            examples = ", ".join(missing[:3]) + (", ..." if len(missing) > 3 else "")
+            print(f"⚠️ Missing files for {len(missing)} recordings, skipped (e.g. {examples})")
+        print(f"Selected {len(recordings)} recordings ({total_duration / 3600:.1f} h) from metadata")
+        return recordings
+    
+    def find_pairs(self, data_dir, max_files=None, **filters):
+        """找出資料集中的 (WAV, MIDI) 檔案配對"""
+        return [
+            (recording["audio_path"], recording["midi_path"])
+            for recording in self.select_recordings(data_dir, max_files=max_files, **filters)
+        ]
+    
+    def _glob_pairs(self, data_dir, max_files=None):
+        """沒有 metadata 時以 glob 搜尋 (WAV, MIDI) 檔案配對"""
         audio_files = glob.glob(os.path.join(data_dir, "**/*.wav"), recursive=True)
         
         if max_files:
             audio_files = audio_files[:max_files]
         
-        all_X, all_y = [], []
-        processed_count = 0
-        
+        pairs = []
         for audio_path in audio_files:
             # 找到對應的MIDI檔案
             midi_path = audio_path.replace('.wav', '.midi')
@@ -109,28 +497,51 @@ class MaestroDataProcessor:
             if not os.path.exists(midi_path):
                 print(f"MIDI file not found for {audio_path}")
                 continue
+            pairs.append((audio_path, midi_path))
+        return pairs
+    
+    def load_pair(self, audio_path, midi_path, strict=False):
+        """提取一組錄音的特徵與目標，並裁成相同長度；長度不足時回傳 None
+        
+        strict=True 時解碼或讀取 MIDI 失敗會拋出例外（供特徵庫重試），否則同樣回傳 None
+        """
+        if strict:
+            audio_features = self.extract_audio_features(audio_path)
+            midi_targets = self.extract_midi_data(midi_path, n_frames=len(audio_features))
+        else:
+            audio_features = self.load_audio_features(audio_path)
+            if audio_features is None:
+                return None
             
+            midi_targets = self.load_midi_data(midi_path, n_frames=len(audio_features))
+            if midi_targets is None:
+                return None
+        
+        # 確保長度匹配
+        min_length = min(len(audio_features), len(midi_targets))
+        if min_length <= self.sequence_length:  # 確保有足夠的長度
+            return None
+        return audio_features[:min_length], midi_targets[:min_length]
+    
+    def process_dataset(self, data_dir, max_files=None):
+        """處理整個MAESTRO資料集 - 改進版本"""
+        all_X, all_y = [], []
+        processed_count = 0
+        
+        for audio_path, midi_path in self.find_pairs(data_dir, max_files):
             print(f"Processing: {os.path.basename(audio_path)}")
             
             # 提取特徵
-            audio_features = self.load_audio_features(audio_path)
-            midi_targets = self.load_midi_data(midi_path)
-            
-            if audio_features is not None and midi_targets is not None:
-                # 確保長度匹配
-                min_length = min(len(audio_features), len(midi_targets))
-                if min_length > self.sequence_length:  # 確保有足夠的長度
-                    audio_features = audio_features[:min_length]
-                    midi_targets = midi_targets[:min_length]
-                    
-                    # 創建序列
-                    X_seq, y_seq = self.create_sequences(audio_features, midi_targets)
-                    
-                    if len(X_seq) > 0:
-                        all_X.append(X_seq)
-                        all_y.append(y_seq)
-                        processed_count += 1
-                        print(f"  Added {len(X_seq)} sequences")
+            pair = self.load_pair(audio_path, midi_path)
+            if pair is not None:
+                # 創建序列
+                X_seq, y_seq = self.create_sequences(*pair)
+                
+                if len(X_seq) > 0:
+                    all_X.append(X_seq)
+                    all_y.append(y_seq)
+                    processed_count += 1
+                    print(f"  Added {len(X_seq)} sequences")
         
         # 合併所有資料
         if all_X:
@@ -141,12 +552,292 @@ class MaestroDataProcessor:
         else:
             print("No data processed. Check your data directory.")
             return None, None
+    
+    def feature_params(self):
+        """決定特徵內容的參數，用來檢查特徵庫是否相容"""
+        # targets 版本：2 起鋼琴捲涵蓋整段錄音（舊版只到前 sequence_length 秒）
+        return {
+            "sr": self.sr, "hop_length": self.hop_length, "n_mels": self.n_mels, "targets": 2,
+            "feature_dtype": self.feature_dtype.name, "target_dtype": self.target_dtype.name,
+        }
+    
+    def build_feature_store(self, data_dir, store_dir, max_files=None, workers=1, retries=1, **filters):
+        """離線計算每個錄音的Mel頻譜與鋼琴捲並寫入特徵庫；已完成的錄音會直接跳過
+        
+        filters 傳給 select_recordings（split、years、composers、max_duration），
+        錄音的 split 等 metadata 會一併記在索引中。
+        workers > 1 時以多個行程平行抽取，每完成一個檔案就寫入磁碟；
+        失敗的檔案（解碼、MIDI 錯誤或子行程異常結束）最多重試 retries 次後略過；
+        長度不足的錄音直接略過不重試。特徵庫中的錄音順序固定依檔案路徑排序。
+        """
+        store = FeatureStore(store_dir)
+        store.set_params(self.feature_params())
+        
+        recordings = self.select_recordings(data_dir, max_files=max_files, **filters)
+        recordings.sort(key=lambda recording: recording["audio_path"])
+        names = [FeatureStore.recording_name(data_dir, recording["audio_path"]) for recording in recordings]
+        pending = [(name, recording) for name, recording in zip(names, recordings) if name not in store]
+        total = len(pending)
+        
+        if workers <= 1:
+            for done, (name, recording) in enumerate(pending, 1):
+                print(f"[{done}/{total}] Extracting: {name}")
+                for attempt in range(retries + 1):
+                    try:
+                        entry = _extract_recording(self, str(store.store_dir), name, recording)
+                        break
+                    except Exception as e:
+                        if attempt < retries:
+                            print(f"  Retrying {name} after error: {e}")
+                            continue
+                        print(f"  Skipping {name}: {e}")
+                        entry = None
+                if entry is not None:
+                    store.add_entry(entry)
+        else:
+            self._extract_parallel(store, pending, workers, retries)
+        
+        store.sort(names)
+        print(f"Feature store ready: {len(store.recordings)} recordings, {store.total_frames} frames")
+        return store
+    
+    def _extract_parallel(self, store, pending, workers, retries):
+        """以行程池抽取特徵；子行程直接寫入 .npy，主行程負責更新索引
+        
+        子行程異常結束（例如 OOM）時行程池會損壞，所有執行中的工作都會失敗；
+        此時重建行程池並重新送出，無法判斷是哪個錄音造成的，因此每個執行中的錄音都計一次嘗試。
+        """
+        total = len(pending)
+        attempts = {}
+        futures = {}
+        done = 0
+        # 與轉譜工作行程相同，使用 spawn 避免 fork 已初始化的 TensorFlow
+        context = mp.get_context("spawn")
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        
+        def submit(name, recording):
+            nonlocal executor
+            attempts[name] = attempts.get(name, 0) + 1
+            args = (_extract_recording, self, str(store.store_dir), name, recording)
+            try:
+                future = executor.submit(*args)
+            except BrokenProcessPool:
+                print("  Worker process died, restarting the process pool")
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+                future = executor.submit(*args)
+            futures[future] = (name, recording)
+        
+        try:
+            for name, recording in pending:
+                submit(name, recording)
+            while futures:
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name, recording = futures.pop(future)
+                    try:
+                        entry = future.result()
+                    except Exception as e:
+                        if attempts[name] <= retries:
+                            print(f"  Retrying {name} after error: {e}")
+                            submit(name, recording)
+                            continue
+                        print(f"  Skipping {name}: {e}")
+                        entry = None
+                    
+                    done += 1
+                    if entry is None:
+                        print(f"[{done}/{total}] Skipped: {name}")
+                    else:
+                        store.add_entry(entry)
+                        print(f"[{done}/{total}] Stored: {name} ({entry['frames']} frames)")
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+
+def _extract_recording(processor, store_dir, name, recording):
+    """抽取一個錄音並寫入特徵檔，回傳尚未加入索引的項目（行程池工作函式）
+    
+    解碼或 MIDI 錯誤時拋出例外以便重試；錄音太短時回傳 None
+    """
+    audio_path, midi_path = recording["audio_path"], recording["midi_path"]
+    pair = processor.load_pair(audio_path, midi_path, strict=True)
+    if pair is None:
+        return None
+    
+    metadata = {key: value for key, value in recording.items() if key not in ("audio_path", "midi_path")}
+    store = FeatureStore(store_dir)
+    return store.write_recording(name, *pair, audio=str(audio_path), midi=str(midi_path), **metadata)
+
+
+class FeatureStore:
+    """預先計算的特徵庫：每個錄音一組 Mel / 鋼琴捲 .npy 檔加上 index.json，訓練時以 memmap 讀取"""
+    
+    INDEX_FILE = "index.json"
+    
+    def __init__(self, store_dir, max_open_files=256):
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.max_open_files = max_open_files
+        self._arrays = {}  # 已開啟的 memmap（最近使用的排在後面）
+        self._lock = threading.Lock()  # tf.data 平行 map 會同時讀取
+        
+        index_path = self.store_dir / self.INDEX_FILE
+        if index_path.exists():
+            with open(index_path, encoding="utf-8") as f:
+                self.index = json.load(f)
+        else:
+            self.index = {"params": None, "recordings": []}
+        self._names = {entry["name"] for entry in self.index["recordings"]}
+    
+    @staticmethod
+    def recording_name(data_dir, audio_path):
+        """以相對於資料集根目錄的路徑作為錄音名稱"""
+        relative = Path(audio_path).resolve().relative_to(Path(data_dir).resolve())
+        return relative.with_suffix("").as_posix().replace("/", "__")
+    
+    @property
+    def recordings(self):
+        return self.index["recordings"]
+    
+    @property
+    def total_frames(self):
+        return sum(entry["frames"] for entry in self.recordings)
+    
+    def __contains__(self, name):
+        return name in self._names
+    
+    def set_params(self, params):
+        """記錄特徵參數；與既有特徵庫不同時拒絕寫入"""
+        if self.index["params"] is None:
+            self.index["params"] = params
+            self._save_index()
+        elif self.index["params"] != params:
+            raise ValueError(f"Feature store {self.store_dir} was built with {self.index['params']}, not {params}")
+    
+    def _save_index(self):
+        """原子性地寫入索引，中途中斷也不會留下損壞的 index.json"""
+        tmp_path = self.store_dir / f"{self.INDEX_FILE}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.store_dir / self.INDEX_FILE)
+    
+    def _save_array(self, filename, array):
+        tmp_path = self.store_dir / f"{filename}.tmp.npy"
+        np.save(tmp_path, np.ascontiguousarray(array))  # 型別由 MaestroDataProcessor 決定
+        os.replace(tmp_path, self.store_dir / filename)
+    
+    def write_recording(self, name, features, targets, **metadata):
+        """寫入一個錄音的特徵 (幀, n_mels) 與目標 (幀, 128)，回傳尚未加入索引的項目"""
+        entry = {
+            "name": name,
+            "frames": int(len(features)),
+            "mel": f"{name}.mel.npy",
+            "roll": f"{name}.roll.npy",
+            **metadata,
+        }
+        self._save_array(entry["mel"], features)
+        self._save_array(entry["roll"], targets)
+        return entry
+    
+    def add_entry(self, entry):
+        """把已寫入磁碟的錄音加入索引"""
+        self.index["recordings"].append(entry)
+        self._names.add(entry["name"])
+        self._save_index()
+    
+    def add(self, name, features, targets, **metadata):
+        """寫入一個錄音並加入索引"""
+        self.add_entry(self.write_recording(name, features, targets, **metadata))
+    
+    def sort(self, names):
+        """依給定的名稱順序排列錄音，讓窗口索引與資料分割可重現"""
+        order = {name: i for i, name in enumerate(names)}
+        self.index["recordings"].sort(key=lambda entry: order.get(entry["name"], len(order)))
+        self._arrays.clear()
+        self._save_index()
+    
+    def load(self, recording):
+        """以 memmap 開啟錄音的 (特徵, 目標)，只保留最近使用的 max_open_files 組"""
+        with self._lock:
+            arrays = self._arrays.pop(recording, None)
+            if arrays is None:
+                entry = self.recordings[recording]
+                arrays = (
+                    np.load(self.store_dir / entry["mel"], mmap_mode="r"),
+                    np.load(self.store_dir / entry["roll"], mmap_mode="r"),
+                )
+                while len(self._arrays) >= self.max_open_files:
+                    self._arrays.pop(next(iter(self._arrays)))
+            self._arrays[recording] = arrays
+            return arrays
+    
+    def select(self, split=None):
+        """回傳符合 split 的錄音索引"""
+        return [i for i, entry in enumerate(self.recordings) if split is None or entry.get("split") == split]
+    
+    def window_index(self, sequence_length, step_size, recordings=None):
+        """列出所有窗口的 (錄音索引, 開始幀)，窗口位置與 create_sequences 相同"""
+        if recordings is None:
+            recordings = range(len(self.recordings))
+        
+        index = [
+            np.stack([np.full(len(starts), recording), starts], axis=1)
+            for recording in recordings
+            for starts in [np.arange(0, self.recordings[recording]["frames"] - sequence_length, step_size)]
+        ]
+        return np.concatenate(index) if index else np.zeros((0, 2), dtype=np.int64)
+    
+    def read_windows(self, window_index, sequence_length, dtype=np.float32):
+        """依窗口索引從 memmap 取出一批 (X, y)；X 轉為 dtype，y 為 0-1 的 float32"""
+        n_mels = self.index["params"]["n_mels"]
+        X = np.empty((len(window_index), sequence_length, n_mels), dtype=dtype)
+        y = np.empty((len(window_index), sequence_length, 128), dtype=np.float32)
+        for i, (recording, start) in enumerate(window_index):
+            features, targets = self.load(int(recording))
+            X[i] = features[start:start + sequence_length]
+            y[i] = targets[start:start + sequence_length]
+        
+        # uint8 目標存的是原始 velocity
+        if np.issubdtype(np.dtype(self.index["params"].get("target_dtype", "float16")), np.integer):
+            y /= 127.0
+        return X, y
+    
+    def as_dataset(self, window_index, sequence_length, batch_size=16, shuffle=True, shuffle_buffer=None, seed=42,
+                   dtype=np.float32):
+        """建立 tf.data 管線：只對窗口索引洗牌，批次資料在平行 map 中才從 memmap 切出並預取
+        
+        dtype 為輸入特徵的型別，混合精度訓練時可用 float16 減少頻寬。
+        """
+        n_mels = self.index["params"]["n_mels"]
+        
+        dataset = tf.data.Dataset.from_tensor_slices(np.asarray(window_index, dtype=np.int64))
+        if shuffle:
+            # 索引只有兩個整數，預設整個洗牌
+            buffer_size = shuffle_buffer or max(len(window_index), 1)
+            dataset = dataset.shuffle(buffer_size, seed=seed, reshuffle_each_iteration=True)
+        dataset = dataset.batch(batch_size)
+        
+        def read_batch(rows):
+            X, y = tf.numpy_function(
+                lambda rows: self.read_windows(rows, sequence_length, dtype),
+                [rows], [tf.as_dtype(dtype), tf.float32]
+            )
+            X.set_shape([None, sequence_length, n_mels])
+            y.set_shape([None, sequence_length, 128])
+            return X, y
         
+        dataset = dataset.map(read_batch, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
 
 class MidiGenerationModel:
-    def __init__(self, input_shape, output_shape):
+    def __init__(self, input_shape, output_shape, mixed_precision=False):
         self.input_shape = input_shape
         self.output_shape = output_shape
+        if mixed_precision:
+            # float16 運算、float32 權重；compile 時 Keras 會自動加上 loss scaling
+            keras.mixed_precision.set_global_policy("mixed_float16")
         self.model = self._build_improved_model()
     
     def _build_improved_model(self):
@@ -181,8 +872,8 @@ class MidiGenerationModel:
         x = layers.UpSampling1D(2)(x)
         x = layers.Dropout(0.2)(x)
         
-        # 輸出層 - 使用sigmoid激活處理多標籤分類
-        outputs = layers.Conv1D(128, 3, activation='sigmoid', padding='same')(x)
+        # 輸出層 - 使用sigmoid激活處理多標籤分類（混合精度時仍以 float32 輸出，避免 sigmoid/loss 溢位）
+        outputs = layers.Conv1D(128, 3, activation='sigmoid', padding='same', dtype='float32')(x)
         
         model = keras.Model(inputs, outputs)
         
@@ -203,8 +894,11 @@ class MidiGenerationModel:
         
         return model
     
-    def train(self, X_train, y_train, X_val=None, y_val=None, epochs=100, batch_size=16):
-        """訓練模型 - 改進版本"""
+    def train(self, X_train, y_train=None, X_val=None, y_val=None, epochs=100, batch_size=16):
+        """訓練模型 - 改進版本
+        
+        X_train / X_val 可以是 NumPy 陣列，或是已分批的 tf.data.Dataset（例如 FeatureStore.as_dataset，此時 y 為 None）
+        """
         # 創建保存目錄
         os.makedirs(THIS_DIR / 'saved_models', exist_ok=True)
 
@@ -235,10 +929,15 @@ class MidiGenerationModel:
             )
         ]
         
-        validation_data = (X_val, y_val) if X_val is not None else None
-        
-        print(f"Starting training with {len(X_train)} samples")
-        print(f"Input shape: {X_train.shape}, Target shape: {y_train.shape}")
+        if y_train is None:
+            # 資料集自行分批
+            validation_data = X_val
+            batch_size = None
+            print(f"Starting training with {len(X_train)} batches")
+        else:
+            validation_data = (X_val, y_val) if X_val is not None else None
+            print(f"Starting training with {len(X_train)} samples")
+            print(f"Input shape: {X_train.shape}, Target shape: {y_train.shape}")
         
         history = self.model.fit(
             X_train, y_train,
@@ -261,118 +960,695 @@ class MidiGenerationModel:
         self.model = keras.models.load_model(filepath)
 
 
+class NoteTracker:
+    """逐區塊追蹤鋼琴捲中的音符，區塊之間保留仍在發聲的音符狀態"""
+    
+    def __init__(self, frames_per_second, threshold=0.3, min_note_duration=0.05):
+        self.frames_per_second = frames_per_second
+        self.threshold = threshold
+        self.min_note_duration = min_note_duration
+        self.active_start = np.full(128, -1, dtype=np.int64)  # -1 表示未發聲
+        self.active_max = None
+        self.n_frames = 0
+    
+    def update(self, piano_roll):
+        """加入下一段鋼琴捲，回傳在這段中結束的音符（依結束幀、音高排序）"""
+        piano_roll = np.asarray(piano_roll)
+        n_frames = len(piano_roll)
+        if n_frames == 0:
+            return []
+        if self.active_max is None:
+            self.active_max = np.zeros(128, dtype=piano_roll.dtype)
+        carried = self.active_start >= 0
+        
+        # 欄位 0 補零、欄位 1 為上一段留下的狀態、最後補一幀靜音，以 np.diff 找出起訖
+        padded = np.zeros((128, n_frames + 3), dtype=np.int8)
+        padded[:, 1] = carried
+        padded[:, 2:-1] = (piano_roll > self.threshold).T
+        edges = np.diff(padded, axis=1)
+        pitches, starts = np.nonzero(edges == 1)
+        _, ends = np.nonzero(edges == -1)
+        
+        # 延伸欄位 0 為延續音符目前的最大值，之後才是這段的幀；
+        # 以 reduceat 計算每個音符區間 [start, end) 內的最大激活值
+        extended = np.empty((128, n_frames + 1), dtype=piano_roll.dtype)
+        extended[:, 0] = np.where(carried, self.active_max, 0)
+        extended[:, 1:] = piano_roll.T
+        flat = np.append(extended.ravel(), piano_roll.dtype.type(0))
+        bounds = np.empty(2 * len(pitches), dtype=np.intp)
+        bounds[0::2] = pitches * (n_frames + 1) + starts
+        bounds[1::2] = pitches * (n_frames + 1) + ends
+        max_activation = np.maximum.reduceat(flat, bounds)[0::2] if len(pitches) else flat[:0]
+        
+        # 換算為整段的幀索引
+        start_frames = np.where(starts == 0, self.active_start[pitches], self.n_frames + starts - 1)
+        end_frames = self.n_frames + ends - 1
+        closed = ends <= n_frames
+        
+        # 延續到這段結尾的音符留待下一段
+        self.active_start[:] = -1
+        self.active_start[pitches[~closed]] = start_frames[~closed]
+        self.active_max[pitches[~closed]] = max_activation[~closed]
+        self.n_frames += n_frames
+        
+        pitches, start_frames = pitches[closed], start_frames[closed]
+        end_frames, max_activation = end_frames[closed], max_activation[closed]
+        order = np.lexsort((pitches, end_frames))
+        start_times = start_frames / self.frames_per_second
+        durations = end_frames / self.frames_per_second - start_times
+        return self._to_notes(pitches, start_times, durations, max_activation, order)
+    
+    def finish(self):
+        """結束所有仍在發聲的音符（依開始幀、音高排序）並重設狀態"""
+        pitches = np.nonzero(self.active_start >= 0)[0]
+        start_frames = self.active_start[pitches]
+        max_activation = self.active_max[pitches] if self.active_max is not None else np.zeros(0)
+        self.active_start[:] = -1
+        
+        order = np.lexsort((pitches, start_frames))
+        start_times = start_frames / self.frames_per_second
+        durations = (self.n_frames - start_frames) / self.frames_per_second
+        return self._to_notes(pitches, start_times, durations, max_activation, order)
+    
+    def _to_notes(self, pitches, start_times, durations, max_activation, order):
+        """依激活值計算 velocity，並過濾過短的音符"""
+        velocities = np.clip((max_activation * 100 + 27).astype(np.int64), 30, 127)
+        keep = order[durations[order] >= self.min_note_duration]
+        return list(zip(
+            pitches[keep].tolist(),
+            start_times[keep].tolist(),
+            durations[keep].tolist(),
+            velocities[keep].tolist()
+        ))
+
+
+def _tflite_interpreter_class():
+    """優先使用獨立的 LiteRT / tflite_runtime 套件（不需載入完整的 TensorFlow），否則使用 tf.lite"""
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteModel:
+    """以多執行緒 TFLite interpreter 執行 export_tflite.py 匯出的模型
+    
+    num_threads 未指定時使用所有核心，只適合單一程序；多個工作程序時由呼叫端分配（見 settings.tflite_num_threads）
+    張量只在建立時配置一次：每個 2 的次方（最大為 max_batch_size）各一個 interpreter，
+    批次補零到最接近的大小後再截取輸出，超過 max_batch_size 的批次分段執行。
+    """
+    
+    def __init__(self, model_path, num_threads=None, max_batch_size=64):
+        interpreter_class = _tflite_interpreter_class()
+        self.max_batch_size = max_batch_size
+        self.batch_sizes = sorted({min(2 ** i, max_batch_size) for i in range(max_batch_size.bit_length() + 1)})
+        self._interpreters = {}  # 批次大小 -> (interpreter, 補零用的輸入緩衝區)
+        for batch_size in self.batch_sizes:
+            interpreter = interpreter_class(model_path=str(model_path), num_threads=num_threads or os.cpu_count())
+            self._input = interpreter.get_input_details()[0]
+            self._output = interpreter.get_output_details()[0]
+            self.input_shape = tuple(None if dim < 0 else int(dim) for dim in self._input["shape_signature"])
+            shape = (batch_size, *self.input_shape[1:])
+            interpreter.resize_tensor_input(self._input["index"], shape, strict=True)
+            interpreter.allocate_tensors()
+            self._interpreters[batch_size] = interpreter, np.zeros(shape, dtype=self._input["dtype"])
+        self._lock = threading.Lock()  # interpreter 不能同時被多個執行緒呼叫
+    
+    def predict_on_batch(self, windows):
+        """對一個批次做前向運算，不會重新配置張量"""
+        windows = np.asarray(windows, dtype=self._input["dtype"])
+        outputs = []
+        with self._lock:
+            for start in range(0, len(windows), self.max_batch_size):
+                chunk = windows[start:start + self.max_batch_size]
+                batch_size = next(size for size in self.batch_sizes if size >= len(chunk))
+                interpreter, buffer = self._interpreters[batch_size]
+                buffer[:len(chunk)] = chunk  # 其餘列為先前的內容，各窗口獨立計算，輸出截掉即可
+                interpreter.set_tensor(self._input["index"], buffer)
+                interpreter.invoke()
+                outputs.append(interpreter.get_tensor(self._output["index"])[:len(chunk)])
+        return outputs[0] if len(outputs) == 1 else np.concatenate(outputs)
+
+
+class ModelRegistry:
+    """每個程序只載入一次模型並保持常駐；模型檔案更新時自動重新載入
+    
+    推論時每個批次都會取得模型，因此最多每 check_interval 秒才檢查一次檔案 mtime，而不是每次都 stat
+    """
+    
+    def __init__(self, check_interval=5.0):
+        self.check_interval = check_interval
+        self._entries = {}  # 模型路徑 -> {"mtime", "next_check", "model", "predict_fn"}
+        self._lock = threading.Lock()
+    
+    def _entry(self, model_path, num_threads=None, max_batch_size=64):
+        """取得快取項目，檔案 mtime 改變時重新載入（.tflite 以 TFLiteModel 載入）"""
+        key = str(model_path)
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None and now < entry["next_check"]:
+            return entry
+        
+        path = str(Path(model_path).resolve())
+        mtime = os.stat(path).st_mtime_ns
+        if entry is not None and entry["mtime"] == mtime:
+            entry["next_check"] = now + self.check_interval
+            return entry
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["mtime"] != mtime:
+                print(f"Loading model: {path}")
+                if path.endswith(".tflite"):
+                    model = TFLiteModel(path, num_threads, max_batch_size)
+                else:
+                    model = keras.models.load_model(path)
+                entry = {"mtime": mtime, "model": model, "predict_fn": None}
+                self._entries[key] = entry
+            entry["next_check"] = now + self.check_interval
+            return entry
+    
+    def get(self, model_path, num_threads=None, max_batch_size=64):
+        """取得已載入的 Keras 模型或 TFLiteModel；max_batch_size 為 TFLiteModel 預先配置的最大批次"""
+        return self._entry(model_path, num_threads, max_batch_size)["model"]
+    
+    def get_predict_fn(self, model_path):
+        """取得以固定輸入簽章編譯的 tf.function 推論函式"""
+        entry = self._entry(model_path)
+        if entry["predict_fn"] is None:
+            with self._lock:
+                if entry["predict_fn"] is None:
+                    model = entry["model"]
+                    signature = tf.TensorSpec([None, *model.input_shape[1:]], tf.float32)
+                    entry["predict_fn"] = tf.function(
+                        lambda x: model(x, training=False), input_signature=[signature]
+                    )
+        return entry["predict_fn"]
+    
+    def clear(self):
+        """釋放所有已載入的模型"""
+        with self._lock:
+            self._entries.clear()
+
+
+# 全域模型快取實例
+model_registry = ModelRegistry()
+
+
+class _BatchRequest:
+    """InferenceBatcher 中單一請求的狀態"""
+    
+    def __init__(self, windows, progress_callback=None):
+        self.windows = windows
+        self.progress_callback = progress_callback
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+        self.started = False
+        self.taken = 0   # 已分配到批次的窗口數
+        self.done = 0    # 已取得結果的窗口數
+        self.output = None
+        self.cpu_seconds = 0.0  # 依窗口數分攤到的前向運算 CPU 時間
+
+
+class InferenceBatcher:
+    """跨請求動態批次：收集多個轉錄工作的窗口，合併成一次前向運算後再分送回各請求"""
+    
+    def __init__(self, forward_fn, max_batch_size=64, max_wait=0.01):
+        self.forward_fn = forward_fn  # 對一個批次做一次前向運算: ndarray -> ndarray
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._requests = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        
+        # 統計資料
+        self._started_at = time.perf_counter()
+        self._n_requests = 0
+        self._n_batches = 0
+        self._n_windows = 0
+        self._busy_time = 0.0
+        self._queue_latencies = deque(maxlen=1000)  # 最近的排隊延遲，用於分位數
+        self._queue_latency_sum = 0.0
+        self._queue_latency_count = 0
+    
+    def predict(self, windows, progress_callback=None):
+        """送出一組窗口並等待結果；可由多個執行緒同時呼叫"""
+        if len(windows) == 0:
+            return np.zeros((0, *windows.shape[1:]), dtype=np.float32)
+        
+        request = _BatchRequest(windows, progress_callback)
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+                self._thread.start()
+            self._requests.append(request)
+            self._n_requests += 1
+            self._condition.notify()
+        try:
+            return request.future.result()
+        finally:
+            # 前向運算在批次執行緒上執行，把分攤的 CPU 時間記回呼叫者的 predict 階段
+            pipeline_profiler.charge_cpu(request.cpu_seconds)
+    
+    def _pending_windows(self):
+        return sum(len(r.windows) - r.taken for r in self._requests)
+    
+    def _next_batch(self):
+        """等待到批次已滿或最早的請求超過 max_wait，再從各請求輪流取出窗口"""
+        with self._condition:
+            while not self._requests:
+                self._condition.wait()
+            deadline = self._requests[0].enqueued_at + self.max_wait
+            while self._pending_windows() < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            
+            # 輪流分配，避免單一長音檔佔滿所有批次
+            parts = []
+            capacity = self.max_batch_size
+            while capacity > 0 and self._requests:
+                quota = max(1, capacity // len(self._requests))
+                for request in list(self._requests):
+                    n = min(quota, capacity, len(request.windows) - request.taken)
+                    if n <= 0:
+                        continue
+                    parts.append((request, request.taken, request.taken + n))
+                    request.taken += n
+                    capacity -= n
+                    if request.taken == len(request.windows):
+                        self._requests.remove(request)
+            return parts
+    
+    def _run(self):
+        while True:
+            parts = self._next_batch()
+            started_at = time.perf_counter()
+            with self._condition:
+                for request, _, _ in parts:
+                    if not request.started:
+                        request.started = True
+                        latency = started_at - request.enqueued_at
+                        self._queue_latencies.append(latency)
+                        self._queue_latency_sum += latency
+                        self._queue_latency_count += 1
+            
+            cpu_start = time.process_time()  # 包含模型內部的運算執行緒
+            try:
+                batch = np.concatenate([request.windows[start:stop] for request, start, stop in parts])
+                predictions = np.asarray(self.forward_fn(batch))
+            except Exception as e:
+                for request, _, _ in parts:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                    with self._condition:
+                        if request in self._requests:
+                            self._requests.remove(request)
+                continue
+            
+            self._busy_time += time.perf_counter() - started_at
+            self._n_batches += 1
+            self._n_windows += len(batch)
+            cpu_per_window = (time.process_time() - cpu_start) / len(batch)
+            for request, start, stop in parts:
+                request.cpu_seconds += cpu_per_window * (stop - start)
+            
+            # 把結果分送回各請求
+            offset = 0
+            for request, start, stop in parts:
+                if request.future.done():
+                    offset += stop - start
+                    continue
+                if request.output is None:
+                    request.output = np.empty(
+                        (len(request.windows), *predictions.shape[1:]), dtype=predictions.dtype
+                    )
+                request.output[start:stop] = predictions[offset:offset + stop - start]
+                offset += stop - start
+                request.done += stop - start
+                if request.progress_callback is not None:
+                    try:
+                        request.progress_callback(request.done / len(request.windows))
+                    except Exception as e:
+                        print(f"Progress callback failed: {e}")
+                if request.done == len(request.windows):
+                    request.future.set_result(request.output)
+    
+    def metrics(self):
+        """吞吐量與排隊延遲統計"""
+        with self._condition:
+            latencies = np.array(self._queue_latencies) if self._queue_latencies else np.zeros(1)
+            pending_windows = self._pending_windows()
+            latency_sum, latency_count = self._queue_latency_sum, self._queue_latency_count
+        elapsed = time.perf_counter() - self._started_at
+        return {
+            "requests": self._n_requests,
+            "batches": self._n_batches,
+            "windows": self._n_windows,
+            "mean_batch_size": self._n_windows / self._n_batches if self._n_batches else 0.0,
+            "windows_per_second": self._n_windows / elapsed if elapsed > 0 else 0.0,
+            "busy_windows_per_second": self._n_windows / self._busy_time if self._busy_time > 0 else 0.0,
+            "queue_latency_p50": float(np.percentile(latencies, 50)),
+            "queue_latency_p95": float(np.percentile(latencies, 95)),
+            "queue_latency_max": float(latencies.max()),
+            "queue_latency_sum": latency_sum,
+            "queue_latency_count": latency_count,
+            "pending_windows": pending_windows,
+        }
+
+
 class MidiGenerator:
-    def __init__(self, model_path, processor):
-        self.model = keras.models.load_model(model_path)
+    BACKENDS = ("keras", "tflite")
+    
+    def __init__(self, model_path, processor, use_tf_function=False, batch_size=8, batcher=None,
+                 roll_dtype=np.float32, backend="keras", num_threads=None, max_batch_size=64):
+        """
+        Args:
+            backend: "keras"（.keras 模型）或 "tflite"（export_tflite.py 匯出的 .tflite 模型）
+            num_threads: tflite 後端的 interpreter 執行緒數，預設為 CPU 核心數
+            max_batch_size: tflite 後端預先配置張量的最大批次，應與 InferenceBatcher 的 max_batch_size 相同
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend: {backend} (expected one of {self.BACKENDS})")
+        if (backend == "tflite") != str(model_path).endswith(".tflite"):
+            raise ValueError(f"Model {model_path} does not match the {backend} backend")
+        self.model_path = model_path
         self.processor = processor
+        self.use_tf_function = use_tf_function
+        self.batch_size = batch_size
+        self.roll_dtype = np.dtype(roll_dtype)  # 合併後鋼琴捲的型別，float16 可減半記憶體與快取大小
+        self.batcher = batcher  # 設定 InferenceBatcher 時，推論會與其他請求合併批次
+        self.backend = backend
+        self.num_threads = num_threads
+        self.max_batch_size = max_batch_size
+        model_registry.get(model_path, num_threads, max_batch_size)  # 預先載入，之後的請求直接使用快取
+    
+    @property
+    def model(self):
+        """從全域快取取得模型，檔案更新時會自動換成新版本"""
+        return model_registry.get(self.model_path, self.num_threads, self.max_batch_size)
+    
+    def _predict(self, windows, verbose=0, progress_callback=None):
+        """對一批窗口進行推論，progress_callback 會收到 0-1 的完成比例"""
+        if self.batcher is not None:
+            return self.batcher.predict(windows, progress_callback)
+        
+        n_batches = -(-len(windows) // self.batch_size)
+        if self.backend == "keras" and not self.use_tf_function:
+            callbacks = []
+            if progress_callback is not None:
+                callbacks.append(keras.callbacks.LambdaCallback(
+                    on_predict_batch_end=lambda batch, logs: progress_callback((batch + 1) / n_batches)
+                ))
+            return self.model.predict(windows, verbose=verbose, batch_size=self.batch_size, callbacks=callbacks)
+        
+        outputs = []
+        for batch in range(n_batches):
+            i = batch * self.batch_size
+            outputs.append(self.forward(windows[i:i + self.batch_size]))
+            if progress_callback is not None:
+                progress_callback((batch + 1) / n_batches)
+        return np.concatenate(outputs)
+    
+    def forward(self, windows):
+        """對單一批次做一次前向運算（供 InferenceBatcher 使用）"""
+        if self.backend == "tflite":
+            return self.model.predict_on_batch(windows)
+        if self.use_tf_function:
+            predict_fn = model_registry.get_predict_fn(self.model_path)
+            return predict_fn(np.ascontiguousarray(windows, dtype=np.float32)).numpy()
+        return np.asarray(self.model.predict_on_batch(windows))
     
-    def wav_to_midi(self, wav_path, output_midi_path, threshold=0.3):
-        """將WAV檔案轉換為MIDI檔案 - 改進版本"""
+    def wav_to_midi(self, wav_path, output_midi_path, threshold=0.3, progress_callback=None):
+        """將WAV檔案轉換為MIDI檔案 - 改進版本
+        
+        progress_callback(fraction) 會在各階段收到 0-1 的整體進度；
+        成功時回傳平均後的鋼琴捲機率，可用於快取與重新設定門檻值
+        """
+        with pipeline_profiler.run(file=os.path.basename(str(wav_path))):
+            return self._wav_to_midi(wav_path, output_midi_path, threshold, progress_callback)
+    
+    def _wav_to_midi(self, wav_path, output_midi_path, threshold, progress_callback):
+        report = progress_callback or (lambda fraction: None)
+        
         # 提取特徵
         features = self.processor.load_audio_features(wav_path)
         if features is None:
             print("Failed to extract features from audio")
             return
+        report(0.1)
         
         # 預測 - 使用滑動窗口
-        sequences = []
-        step_size = self.processor.sequence_length // 2  # 50% 重疊
-        
-        for i in range(0, len(features) - self.processor.sequence_length, step_size):
-            seq = features[i:i + self.processor.sequence_length]
-            if len(seq) == self.processor.sequence_length:
-                sequences.append(seq)
-        
-        if not sequences:
+        with pipeline_profiler.stage("windowing"):
+            windows, tail_window = self._frame_windows(features)
+        if windows is None:
             print("Audio too short for processing")
             return
         
-        sequences = np.array(sequences)
-        print(f"Predicting {len(sequences)} sequences...")
-        predictions = self.model.predict(sequences, verbose=1, batch_size=8)
+        print(f"Predicting {len(windows) + 1} sequences...")
+        with pipeline_profiler.stage("predict"):
+            predictions = np.concatenate([
+                self._predict(windows, verbose=1, progress_callback=lambda fraction: report(0.1 + 0.8 * fraction)),
+                self._predict(tail_window)
+            ])
+        report(0.9)
         
         # 合併預測結果（平均重疊部分）
-        piano_roll = np.zeros((len(features), 128))
-        count_roll = np.zeros((len(features), 128))
+        with pipeline_profiler.stage("overlap_add"):
+            piano_roll = self._overlap_add(predictions, len(features))
+        
+        # 創建MIDI檔案
+        self._piano_roll_to_midi(piano_roll, output_midi_path, threshold)
+        report(1.0)
+        return piano_roll
+    
+    def _frame_windows(self, features):
+        """以 strided view 零複製切出 50% 重疊的窗口，並以補零的最後一個窗口涵蓋尾端幀"""
+        sequence_length = self.processor.sequence_length
+        step_size = sequence_length // 2  # 50% 重疊
+        n_frames = len(features)
+        if n_frames <= sequence_length:
+            return None, None
+        
+        # (窗口數, sequence_length, n_mels) 的唯讀 view，不複製資料
+        windows = sliding_window_view(features, sequence_length, axis=0)
+        windows = windows[:n_frames - sequence_length:step_size].transpose(0, 2, 1)
+        
+        # 最後一個完整窗口之後剩下的幀，補零成一個窗口
+        tail_start = len(windows) * step_size
+        tail_window = np.zeros((1, sequence_length, features.shape[1]), dtype=features.dtype)
+        tail_window[0, :n_frames - tail_start] = features[tail_start:]
+        
+        return windows, tail_window
+    
+    def _overlap_add(self, predictions, n_frames):
+        """向量化 overlap-add：依 step 切塊一次累加所有窗口，再除以覆蓋次數"""
+        piano_roll, counts = self._allocate_rolls(len(predictions), predictions.shape[2], self.roll_dtype)
+        self._accumulate(piano_roll, counts, predictions)
+        
+        piano_roll = piano_roll[:n_frames]
+        piano_roll /= counts[:n_frames, None]
+        return piano_roll
+    
+    def _allocate_rolls(self, n_windows, n_pitches, dtype):
+        """配置足以容納 n_windows 個連續窗口的累加緩衝區與覆蓋次數"""
+        sequence_length = self.processor.sequence_length
+        step_size = sequence_length // 2
+        n_chunks = -(-sequence_length // step_size)
+        total_frames = (n_windows + n_chunks - 1) * step_size
+        return np.zeros((total_frames, n_pitches), dtype=dtype), np.zeros(total_frames, dtype=np.int32)
+    
+    def _accumulate(self, piano_roll, counts, predictions):
+        """把從 piano_roll[0] 開始、間隔 step 的連續窗口預測累加進緩衝區"""
+        sequence_length = self.processor.sequence_length
+        step_size = sequence_length // 2
+        n_windows = len(predictions)
+        n_chunks = -(-sequence_length // step_size)
+        span = n_windows * step_size
+        
+        # 第 i 個窗口的第 j 塊落在第 (i + j) 個 step 上，每塊只需一次切片相加
+        for j in range(n_chunks):
+            offset = j * step_size
+            chunk = min(step_size, sequence_length - offset)
+            piano_roll[offset:offset + span].reshape(n_windows, step_size, -1)[:, :chunk] += (
+                predictions[:, offset:offset + chunk]
+            )
+            counts[offset:offset + span].reshape(n_windows, step_size)[:, :chunk] += 1
+    
+    def iter_notes(self, wav_path, threshold=0.3, block_frames=2048, min_note_duration=0.05,
+                   progress_callback=None, roll_callback=None):
+        """串流轉錄：逐區塊讀取音訊、預測，並在音符確定結束後立即產生
+        
+        產生 (pitch, start_time, duration, velocity)，順序與 _extract_notes 相同；
+        記憶體只與 block_frames 有關，與音訊長度無關。
+        progress_callback(fraction) 以音訊長度估計 0.1-0.9 的進度（與 wav_to_midi 相同）；
+        roll_callback(chunk) 依序收到平均後、不會再變動的鋼琴捲片段，可用於寫入快取。
+        """
+        sequence_length = self.processor.sequence_length
+        step_size = sequence_length // 2  # 50% 重疊
+        tracker = NoteTracker(self.processor.frames_per_second, threshold, min_note_duration)
+        report = progress_callback or (lambda fraction: None)
+        try:
+            expected_frames = sf.info(wav_path).duration * self.processor.frames_per_second
+        except Exception:
+            expected_frames = 0
+        
+        pending = None       # 尚未被窗口用完的特徵幀，從 next_start 開始
+        next_start = 0       # 下一個窗口的開始幀
+        roll_start = 0       # 累加緩衝區對應的開始幀
+        piano_roll = counts = None
+        
+        def flush(predictions, window_start, finalize_until):
+            """累加一批窗口預測，並把之後不會再被覆蓋的幀交給 tracker"""
+            nonlocal piano_roll, counts, roll_start
+            with pipeline_profiler.block_stage("overlap_add"):
+                new_roll, new_counts = self._allocate_rolls(len(predictions), predictions.shape[2], self.roll_dtype)
+                offset = window_start - roll_start
+                if piano_roll is not None:
+                    keep = len(piano_roll) - offset
+                    new_roll[:keep] += piano_roll[offset:]
+                    new_counts[:keep] += counts[offset:]
+                self._accumulate(new_roll, new_counts, predictions)
+                piano_roll, counts, roll_start = new_roll, new_counts, window_start
+                
+                n_final = finalize_until - roll_start
+                final_roll = piano_roll[:n_final]
+                final_roll /= counts[:n_final, None]
+                piano_roll, counts = piano_roll[n_final:], counts[n_final:]
+                roll_start = finalize_until
+            if roll_callback is not None:
+                roll_callback(final_roll)
+            with pipeline_profiler.block_stage("note_extraction"):
+                return tracker.update(final_roll)
         
-        for i, pred in enumerate(predictions):
-            start_idx = i * step_size
-            end_idx = start_idx + self.processor.sequence_length
-            actual_end = min(end_idx, len(features))
+        for features in self.processor.stream_audio_features(wav_path, block_frames):
+            if pending is None:
+                report(0.1)  # 第一次讀取（統計整段的功率極值）完成
+            pending = features if pending is None else np.concatenate([pending, features])
             
-            segment_length = actual_end - start_idx
-            piano_roll[start_idx:actual_end] += pred[:segment_length]
-            count_roll[start_idx:actual_end] += 1
+            # 只有之後仍有幀的窗口才算完整窗口（與 wav_to_midi 的 range 上限相同）
+            n_windows = max(0, (len(pending) - sequence_length - 1) // step_size + 1)
+            if n_windows == 0:
+                continue
+            with pipeline_profiler.block_stage("windowing"):
+                windows = sliding_window_view(pending, sequence_length, axis=0)
+                windows = windows[:n_windows * step_size:step_size].transpose(0, 2, 1)
+            with pipeline_profiler.block_stage("predict"):
+                predictions = self._predict(windows)
+            
+            window_start = next_start
+            next_start += n_windows * step_size
+            pending = pending[n_windows * step_size:]
+            yield from flush(predictions, window_start, next_start)
+            if expected_frames:
+                report(0.1 + 0.8 * min(1.0, next_start / expected_frames))
         
-        # 平均化重疊部分
-        piano_roll = np.divide(piano_roll, count_roll, where=count_roll != 0)
+        if pending is None or next_start == 0:
+            print("Audio too short for processing")
+            return
         
-        # 創建MIDI檔案
-        self._piano_roll_to_midi(piano_roll, output_midi_path, threshold)
+        # 最後剩下的幀補零成一個窗口
+        n_frames = next_start + len(pending)
+        tail_window = np.zeros((1, sequence_length, pending.shape[1]), dtype=pending.dtype)
+        tail_window[0, :len(pending)] = pending
+        with pipeline_profiler.block_stage("predict"):
+            predictions = self._predict(tail_window)
+        yield from flush(predictions, next_start, n_frames)
+        with pipeline_profiler.block_stage("note_extraction"):
+            notes = tracker.finish()
+        yield from notes
+        report(0.9)
     
-    def _piano_roll_to_midi(self, piano_roll, output_path, threshold=0.3):
-        """將鋼琴捲轉換為MIDI檔案 - 改進版本"""
+    def stream_wav_to_midi(self, wav_path, output_midi_path, threshold=0.3, block_frames=2048,
+                           progress_callback=None, roll_path=None):
+        """以串流方式將任意長度的WAV檔案轉換為MIDI檔案
+        
+        roll_path 指定時，平均後的鋼琴捲機率逐段寫入該 .npy（與 wav_to_midi 的回傳值相同），
+        不需把整段鋼琴捲留在記憶體；成功時回傳鋼琴捲幀數，音訊太短時回傳 None
+        """
+        with pipeline_profiler.run(file=os.path.basename(str(wav_path)), streaming=True):
+            roll_file = open(roll_path, "wb") if roll_path else None
+            try:
+                return self._stream_wav_to_midi(wav_path, output_midi_path, threshold, block_frames,
+                                                progress_callback, roll_file)
+            finally:
+                if roll_file is not None:
+                    roll_file.close()
+    
+    def _stream_wav_to_midi(self, wav_path, output_midi_path, threshold, block_frames,
+                            progress_callback, roll_file):
+        report = progress_callback or (lambda fraction: None)
+        shape = [0, 0]  # 已完成的鋼琴捲 (幀數, 音高數)
+        
+        def on_roll(chunk):
+            if roll_file is not None:
+                if shape[0] == 0:
+                    # 先寫入 0 幀的標頭佔位，結束後以實際幀數覆寫
+                    self._write_npy_header(roll_file, chunk.dtype, (0, chunk.shape[1]))
+                roll_file.write(np.ascontiguousarray(chunk).data)
+            shape[:] = shape[0] + len(chunk), chunk.shape[1]
+        
+        midi = self._new_midi()
+        notes = self.iter_notes(wav_path, threshold, block_frames, progress_callback=report, roll_callback=on_roll)
+        for pitch, start_time, duration, velocity in notes:
+            midi.addNote(0, 0, pitch, start_time, duration, velocity)
+        if shape[0] == 0:
+            return  # 音訊太短
+        
+        if roll_file is not None:
+            roll_file.seek(0)
+            self._write_npy_header(roll_file, self.roll_dtype, tuple(shape))
+        
+        with pipeline_profiler.stage("midi_write"):
+            with open(output_midi_path, "wb") as output_file:
+                midi.writeFile(output_file)
+        
+        print(f"MIDI file saved to: {output_midi_path}")
+        report(1.0)
+        return shape[0]
+    
+    @staticmethod
+    def _write_npy_header(file, dtype, shape):
+        """寫入 .npy 1.0 標頭；numpy 會為第一維保留位數，幀數改變時標頭長度不變，可原地覆寫"""
+        np.lib.format.write_array_header_1_0(file, {
+            "descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": shape,
+        })
+    
+    def _extract_notes(self, piano_roll, threshold=0.3, min_note_duration=0.05):
+        """以向量化方式從鋼琴捲擷取音符 (pitch, start_time, duration, velocity)"""
+        tracker = NoteTracker(self.processor.frames_per_second, threshold, min_note_duration)
+        return tracker.update(piano_roll) + tracker.finish()
+    
+    def _new_midi(self):
+        """建立含音軌名稱與速度的MIDI檔案"""
         midi = MIDIFile(1)
         track = 0
         time = 0
         midi.addTrackName(track, time, "Generated MIDI")
         midi.addTempo(track, time, 120)
+        return midi
+    
+    def _piano_roll_to_midi(self, piano_roll, output_path, threshold=0.3):
+        """將鋼琴捲轉換為MIDI檔案 - 改進版本"""
+        midi = self._new_midi()
+        track = 0
         
-        # 改進的音符偵測
-        active_notes = {}
-        frames_per_second = self.processor.frames_per_second
+        # 向量化的音符偵測
         min_note_duration = 0.05  # 最小音符持續時間（秒）
-        
-        for frame_idx, frame in enumerate(piano_roll):
-            current_time = frame_idx / frames_per_second
-            
-            for pitch in range(128):
-                activation = frame[pitch]
-                
-                if activation > threshold:
-                    if pitch not in active_notes:
-                        # 音符開始
-                        active_notes[pitch] = {
-                            'start_frame': frame_idx,
-                            'max_activation': activation
-                        }
-                    else:
-                        # 更新最大激活值
-                        active_notes[pitch]['max_activation'] = max(
-                            active_notes[pitch]['max_activation'], activation
-                        )
-                else:
-                    if pitch in active_notes:
-                        # 音符結束
-                        note_info = active_notes[pitch]
-                        start_frame = note_info['start_frame']
-                        start_time = start_frame / frames_per_second
-                        duration = current_time - start_time
-                        
-                        # 只添加持續時間足夠的音符
-                        if duration >= min_note_duration:
-                            # 根據激活值計算velocity
-                            velocity = int(note_info['max_activation'] * 100 + 27)
-                            velocity = min(max(velocity, 30), 127)
-                            
-                            midi.addNote(track, 0, pitch, start_time, duration, velocity)
-                        
-                        del active_notes[pitch]
-        
-        # 結束所有活躍的音符
-        for pitch, note_info in active_notes.items():
-            start_frame = note_info['start_frame']
-            start_time = start_frame / frames_per_second
-            duration = (len(piano_roll) - start_frame) / frames_per_second
-            
-            if duration >= min_note_duration:
-                velocity = int(note_info['max_activation'] * 100 + 27)
-                velocity = min(max(velocity, 30), 127)
-                midi.addNote(track, 0, pitch, start_time, duration, velocity)
+        with pipeline_profiler.stage("note_extraction"):
+            notes = self._extract_notes(piano_roll, threshold, min_note_duration)
         
         # 儲存MIDI檔案
-        with open(output_path, "wb") as output_file:
-            midi.writeFile(output_file)
+        with pipeline_profiler.stage("midi_write"):
+            for pitch, start_time, duration, velocity in notes:
+                midi.addNote(track, 0, pitch, start_time, duration, velocity)
+            with open(output_path, "wb") as output_file:
+                midi.writeFile(output_file)
         
         print(f"MIDI file saved to: {output_path}")
 
@@ -385,6 +1661,8 @@ def plot_training_history(history, figsize=(12, 8)):
         history: keras.callbacks.History 物件
         figsize: 圖表大小
     """
+    from matplotlib import pyplot as plt  # 只有訓練會畫圖，不放在推論的匯入路徑上
+
     output_dir = THIS_DIR / "plots"
 
     hist = history.history
@@ -410,54 +1688,74 @@ def plot_training_history(history, figsize=(12, 8)):
     plt.close()
 
 
-def train():
+def train(max_files=None, workers=os.cpu_count(), mixed_precision=None):
     # 配置參數
     DATA_DIR = THIS_DIR / "maestro-v3.0.0"  # 修改為您的MAESTRO資料集路徑
+    FEATURE_STORE_DIR = THIS_DIR / "feature_store"
     MODEL_SAVE_PATH = THIS_DIR / "saved_models/midi_generation_model.keras"
+    BATCH_SIZE = 16  # 使用更小的批次大小
+    gpus = tf.config.list_physical_devices('GPU')
+    print("Num GPUs Available: ", len(gpus))
+    if mixed_precision is None:
+        mixed_precision = len(gpus) > 0  # 只有 GPU 能從 float16 運算獲益
+    input_dtype = np.float16 if mixed_precision else np.float32
 
-    # 初始化資料處理器
+    # 初始化資料處理器（特徵庫以 float16 特徵、uint8 目標儲存）
     processor = MaestroDataProcessor(
         sr=22050,
         hop_length=512,
         n_mels=128,
-        sequence_length=100
+        sequence_length=100,
+        feature_dtype=np.float16,
+        target_dtype=np.uint8
     )
     
-    # 處理資料（可以限制檔案數量進行測試）
-    print("Processing dataset...")
-    X, y = processor.process_dataset(DATA_DIR, max_files=50)  # 先測試用少量檔案
-    
-    if X is None:
+    # 離線特徵抽取（已抽取過的錄音會跳過）
+    print("Building feature store...")
+    store = processor.build_feature_store(
+        DATA_DIR, FEATURE_STORE_DIR,
+        max_files=max_files, workers=workers, split=("train", "validation")
+    )
+    if not store.recordings:
         print("No data processed. Check your data directory.")
         return
     
-    print(f"Dataset shape: X={X.shape}, y={y.shape}")
-    print(f"Input range: [{X.min():.3f}, {X.max():.3f}]")
-    print(f"Target range: [{y.min():.3f}, {y.max():.3f}]")
+    # 依官方 split 以錄音為單位切分，避免重疊窗口同時出現在訓練集與驗證集
+    train_recordings = store.select("train")
+    val_recordings = store.select("validation")
+    if not train_recordings or not val_recordings:
+        # 沒有 metadata 時改以錄音為單位隨機切分
+        order = np.random.default_rng(42).permutation(len(store.recordings))
+        n_val = max(1, len(order) // 5)
+        val_recordings, train_recordings = order[:n_val], order[n_val:]
     
-    # 改進的資料分割
-    X_train, X_val, y_train, y_val = train_test_split(
-        X, y, test_size=0.2, random_state=42, shuffle=True
-    )
+    # 只建立窗口索引，訓練時才從 memmap 讀出窗口
+    step_size = processor.sequence_length // 4  # 75% 重疊
+    train_windows = store.window_index(processor.sequence_length, step_size, train_recordings)
+    val_windows = store.window_index(processor.sequence_length, processor.sequence_length, val_recordings)
+    
+    print(f"Dataset: {len(train_recordings)} training / {len(val_recordings)} validation recordings")
+    
+    train_data = store.as_dataset(train_windows, processor.sequence_length, BATCH_SIZE, dtype=input_dtype)
+    val_data = store.as_dataset(val_windows, processor.sequence_length, BATCH_SIZE, shuffle=False, dtype=input_dtype)
     
-    print(f"Training set: {X_train.shape}, Validation set: {X_val.shape}")
+    print(f"Training set: {len(train_windows)} windows, Validation set: {len(val_windows)} windows")
     
     # 建立模型
-    input_shape = (X.shape[1], X.shape[2])  # (sequence_length, n_mels)
-    output_shape = (y.shape[1], y.shape[2])  # (sequence_length, 128)
+    input_shape = (processor.sequence_length, processor.n_mels)  # (sequence_length, n_mels)
+    output_shape = (processor.sequence_length, 128)  # (sequence_length, 128)
     
     print(f"Input shape: {input_shape}, Output shape: {output_shape}")
     
-    model = MidiGenerationModel(input_shape, output_shape)
+    model = MidiGenerationModel(input_shape, output_shape, mixed_precision=mixed_precision)
     model.model.summary()
     
     # 訓練模型
     print("Starting training...")
     history = model.train(
-        X_train, y_train,
-        X_val, y_val,
-        epochs=5,
-        batch_size=16  # 使用更小的批次大小
+        train_data,
+        X_val=val_data,
+        epochs=5
     )
 
     # 繪製訓練歷史
@@ -485,7 +1783,6 @@ def generate_midi_from_wav():
 
 if __name__ == "__main__":
     # 創建必要的目錄
-    THIS_DIR = Path(__file__).resolve().parent
     os.makedirs(THIS_DIR / 'saved_models', exist_ok=True)
     os.makedirs(THIS_DIR / 'plots', exist_ok=True)
     os.makedirs(THIS_DIR / 'logs', exist_ok=True)
@@ -0,0 +1,211 @@
+"""
+music_tool 向量化實作與原本逐幀迴圈的一致性測試
+
+不需要模型：以 object.__new__ 建立 MidiGenerator，必要時以固定的假模型取代 _predict。
+
+用法：python -m pytest -q music_conversion_tool/test_music_tool.py
+"""
+import numpy as np
+import pytest
+import soundfile as sf
+
+from music_tool import MaestroDataProcessor, MidiGenerator, NoteTracker
+
+
+def make_generator(predict=None, roll_dtype=np.float32):
+    """不載入模型的 MidiGenerator"""
+    generator = object.__new__(MidiGenerator)
+    generator.processor = MaestroDataProcessor()
+    generator.batch_size = 8
+    generator.roll_dtype = np.dtype(roll_dtype)
+    generator.batcher = None
+    if predict is not None:
+        generator._predict = predict
+    return generator
+
+
+def fixed_piano_roll(n_frames=400, seed=0):
+    """固定的鋼琴捲：隨機短音、長延音、門檻值邊界，以及延續到結尾的音符"""
+    rng = np.random.default_rng(seed)
+    piano_roll = (rng.random((n_frames, 128)) ** 4).astype(np.float32)
+    piano_roll[50:300, 60] = np.linspace(0.4, 0.9, 250)   # 長延音
+    piano_roll[100:103, 64] = 0.3                          # 剛好等於門檻值，不算發聲
+    piano_roll[n_frames - 20:, 72] = 0.8                   # 延續到結尾
+    piano_roll[0:10, 48] = 0.95                            # 從第一幀開始
+    return piano_roll
+
+
+def reference_notes(piano_roll, frames_per_second, threshold=0.3, min_note_duration=0.05):
+    """原本 _piano_roll_to_midi 的逐幀音符偵測迴圈"""
+    notes = []
+    active_notes = {}
+    for frame_idx, frame in enumerate(piano_roll):
+        current_time = frame_idx / frames_per_second
+        for pitch in range(128):
+            activation = frame[pitch]
+            if activation > threshold:
+                if pitch not in active_notes:
+                    active_notes[pitch] = {"start_frame": frame_idx, "max_activation": activation}
+                else:
+                    active_notes[pitch]["max_activation"] = max(active_notes[pitch]["max_activation"], activation)
+            elif pitch in active_notes:
+                note_info = active_notes.pop(pitch)
+                start_time = note_info["start_frame"] / frames_per_second
+                duration = current_time - start_time
+                if duration >= min_note_duration:
+                    velocity = min(max(int(note_info["max_activation"] * 100 + 27), 30), 127)
+                    notes.append((pitch, start_time, duration, velocity))
+
+    for pitch, note_info in active_notes.items():
+        start_time = note_info["start_frame"] / frames_per_second
+        duration = (len(piano_roll) - note_info["start_frame"]) / frames_per_second
+        if duration >= min_note_duration:
+            velocity = min(max(int(note_info["max_activation"] * 100 + 27), 30), 127)
+            notes.append((pitch, start_time, duration, velocity))
+    return notes
+
+
+def assert_same_notes(actual, expected):
+    assert len(actual) == len(expected)
+    for (pitch, start, duration, velocity), note in zip(actual, expected):
+        assert (pitch, velocity) == (note[0], note[3])
+        assert start == pytest.approx(note[1])
+        assert duration == pytest.approx(note[2])
+
+
+@pytest.mark.parametrize("threshold", [0.3, 0.5])
+def test_extract_notes_matches_loop(threshold):
+    """向量化 _extract_notes 與原本迴圈擷取的音符（順序、時間、velocity）相同"""
+    generator = make_generator()
+    piano_roll = fixed_piano_roll()
+    expected = reference_notes(piano_roll, generator.processor.frames_per_second, threshold)
+    assert len(expected) > 50
+    assert_same_notes(generator._extract_notes(piano_roll, threshold), expected)
+
+
+def test_extract_notes_empty_roll():
+    generator = make_generator()
+    assert generator._extract_notes(np.zeros((100, 128), dtype=np.float32)) == []
+
+
+def reference_windows(features, sequence_length):
+    """原本 wav_to_midi 的切窗迴圈，另加上補零的尾端窗口"""
+    step_size = sequence_length // 2
+    windows = [features[i:i + sequence_length] for i in range(0, len(features) - sequence_length, step_size)]
+    tail_start = len(windows) * step_size
+    tail_window = np.zeros((1, sequence_length, features.shape[1]), dtype=features.dtype)
+    tail_window[0, :len(features) - tail_start] = features[tail_start:]
+    return np.array(windows), tail_window
+
+
+def reference_overlap_add(predictions, n_frames, sequence_length):
+    """原本 wav_to_midi 的逐窗口累加後平均"""
+    step_size = sequence_length // 2
+    piano_roll = np.zeros((n_frames, predictions.shape[2]))
+    counts = np.zeros((n_frames, predictions.shape[2]))
+    for i, prediction in enumerate(predictions):
+        start = i * step_size
+        end = min(start + sequence_length, n_frames)
+        piano_roll[start:end] += prediction[:end - start]
+        counts[start:end] += 1
+    return piano_roll / counts
+
+
+@pytest.mark.parametrize("n_frames", [101, 150, 151, 399, 1000])
+def test_frame_windows_matches_loop(n_frames):
+    """strided view 切出的窗口與原本迴圈相同，尾端窗口補零"""
+    generator = make_generator()
+    features = np.random.default_rng(n_frames).random((n_frames, 16), dtype=np.float32)
+    windows, tail_window = generator._frame_windows(features)
+    expected_windows, expected_tail = reference_windows(features, generator.processor.sequence_length)
+    np.testing.assert_array_equal(windows, expected_windows)
+    np.testing.assert_array_equal(tail_window, expected_tail)
+
+
+def test_frame_windows_too_short():
+    generator = make_generator()
+    assert generator._frame_windows(np.zeros((100, 16), dtype=np.float32)) == (None, None)
+
+
+@pytest.mark.parametrize("roll_dtype", [np.float32, np.float16])
+@pytest.mark.parametrize("n_frames", [101, 150, 399, 1000])
+def test_overlap_add_matches_loop(n_frames, roll_dtype):
+    """向量化 overlap-add 與逐窗口累加的結果相同"""
+    generator = make_generator(roll_dtype=roll_dtype)
+    sequence_length = generator.processor.sequence_length
+    windows, _ = generator._frame_windows(np.zeros((n_frames, 1), dtype=np.float32))
+    n_windows = len(windows) + 1  # 含尾端窗口
+    predictions = np.random.default_rng(n_frames).random((n_windows, sequence_length, 128), dtype=np.float32)
+
+    piano_roll = generator._overlap_add(predictions, n_frames)
+    expected = reference_overlap_add(predictions, n_frames, sequence_length)
+    assert piano_roll.shape == (n_frames, 128)
+    assert piano_roll.dtype == np.dtype(roll_dtype)
+    tolerance = 1e-6 if roll_dtype == np.float32 else 2e-3
+    np.testing.assert_allclose(piano_roll, expected, atol=tolerance)
+
+
+@pytest.mark.parametrize("chunk_frames", [1, 7, 64, 400])
+def test_note_tracker_chunks_match_full_roll(chunk_frames):
+    """NoteTracker 分段處理（串流轉錄）與整段擷取的音符相同"""
+    generator = make_generator()
+    piano_roll = fixed_piano_roll()
+    tracker = NoteTracker(generator.processor.frames_per_second)
+    notes = []
+    for start in range(0, len(piano_roll), chunk_frames):
+        notes += tracker.update(piano_roll[start:start + chunk_frames])
+    notes += tracker.finish()
+    # 分段時音符依結束的區塊產生，排序後再比較
+    assert_same_notes(sorted(notes), sorted(generator._extract_notes(piano_roll)))
+
+
+def fake_window_model(n_mels=128, seed=0):
+    """只依窗口內容計算的固定假模型，輸出 (窗口數, sequence_length, 128) 的機率"""
+    weights = np.random.default_rng(seed).standard_normal((n_mels, 128)).astype(np.float32) * 0.2
+
+    def predict(windows, verbose=0, progress_callback=None):
+        logits = np.asarray(windows, dtype=np.float32) @ weights
+        return 1 / (1 + np.exp(-logits))
+    return predict
+
+
+@pytest.fixture
+def tone_wav(tmp_path):
+    """20 秒、數個音高輪流開關的合成音訊"""
+    sr = 22050
+    t = np.arange(20 * sr) / sr
+    y = np.zeros_like(t)
+    for freq, period in [(262, 1.3), (330, 2.1), (440, 0.7), (523, 3.4)]:
+        y += 0.2 * np.sin(2 * np.pi * freq * t) * (np.sin(2 * np.pi * t / period) > 0)
+    path = tmp_path / "tones.wav"
+    sf.write(path, y.astype(np.float32), sr)
+    return path
+
+
+@pytest.mark.parametrize("block_frames", [150, 2048])
+def test_stream_wav_to_midi_matches_wav_to_midi(tone_wav, tmp_path, block_frames):
+    """串流轉錄的鋼琴捲、音符與整段 wav_to_midi 相同，進度單調遞增到 1"""
+    generator = make_generator(fake_window_model())
+    threshold = 0.6
+    piano_roll = generator.wav_to_midi(tone_wav, tmp_path / "full.mid", threshold)
+
+    progress = []
+    roll_path = tmp_path / "roll.npy"
+    n_frames = generator.stream_wav_to_midi(tone_wav, tmp_path / "stream.mid", threshold, block_frames,
+                                            progress_callback=progress.append, roll_path=roll_path)
+    assert n_frames == len(piano_roll)
+    np.testing.assert_allclose(np.load(roll_path), piano_roll, atol=1e-5)
+    assert progress == sorted(progress) and progress[-1] == 1.0
+
+    streamed = list(generator.iter_notes(tone_wav, threshold, block_frames))
+    expected = generator._extract_notes(piano_roll, threshold)
+    assert len(expected) > 20
+    assert_same_notes(sorted(streamed), sorted(expected))
+
+
+def test_stream_wav_to_midi_too_short(tmp_path):
+    path = tmp_path / "short.wav"
+    sf.write(path, np.zeros(2000, dtype=np.float32), 22050)
+    generator = make_generator(fake_window_model())
+    assert generator.stream_wav_to_midi(path, tmp_path / "short.mid") is None
+    assert not (tmp_path / "short.mid").exists()
@@ -0,0 +1,165 @@
+"""
+轉錄結果快取 - Audio2Score Backend
+以 (音訊雜湊, 模型雜湊, 特徵參數) 為 key，在磁碟上保存鋼琴捲機率與各門檻值的 MIDI，
+索引記錄在資料庫中，超過容量上限時依最近使用時間 (LRU) 淘汰
+"""
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from config import settings
+from database import database
+
+class CacheEntry:
+    """一筆快取項目（目錄 cache_dir/<cache_key>/）"""
+    
+    def __init__(self, cache_key: str, audio_sha256: str, model_sha256: str, params: dict):
+        self.cache_key = cache_key
+        self.audio_sha256 = audio_sha256
+        self.model_sha256 = model_sha256
+        self.params = params
+        self.directory = Path(settings.RESULT_CACHE_DIR) / cache_key
+    
+    @property
+    def roll_path(self) -> Path:
+        """鋼琴捲機率（與門檻值無關）"""
+        return self.directory / "piano_roll.npy"
+    
+    def midi_path(self, threshold: float) -> Path:
+        """指定門檻值產生的 MIDI"""
+        return self.directory / f"threshold_{threshold:.4f}.mid"
+
+def _sha256_file(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def _directory_size(directory: Path) -> int:
+    return sum(p.stat().st_size for p in directory.iterdir() if p.is_file()) if directory.exists() else 0
+
+class ResultCache:
+    """轉錄結果快取管理類別"""
+    
+    def __init__(self):
+        self._model_hash = None  # (路徑, mtime, sha256)
+    
+    @property
+    def enabled(self) -> bool:
+        return settings.RESULT_CACHE_MAX_SIZE > 0 and database.get_pool() is not None
+    
+    async def model_sha256(self) -> str:
+        """目前模型檔案的雜湊（模型檔案更新時重新計算）"""
+        path = settings.inference_model_path
+        mtime = os.stat(path).st_mtime_ns
+        if self._model_hash is None or self._model_hash[:2] != (path, mtime):
+            self._model_hash = (path, mtime, await asyncio.to_thread(_sha256_file, path))
+        return self._model_hash[2]
+    
+    async def entry_for(self, audio_sha256: str) -> CacheEntry:
+        """依音訊雜湊、模型雜湊與特徵參數取得快取項目"""
+        model_sha256 = await self.model_sha256()
+        params = {
+            "sr": settings.SAMPLE_RATE,
+            "hop_length": settings.HOP_LENGTH,
+            "n_mels": settings.N_MELS,
+            "sequence_length": settings.SEQUENCE_LENGTH,
+            "feature_dtype": settings.FEATURE_DTYPE,
+            "roll_dtype": settings.ROLL_DTYPE,  # 快取的鋼琴捲以此型別儲存
+        }
+        key_source = json.dumps([audio_sha256, model_sha256, params], sort_keys=True)
+        cache_key = hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+        return CacheEntry(cache_key, audio_sha256, model_sha256, params)
+    
+    async def touch(self, entry: CacheEntry) -> bool:
+        """若鋼琴捲已在快取中則更新最近使用時間，回傳是否命中"""
+        pool = database.get_pool()
+        async with pool.acquire() as conn:
+            hit = await conn.fetchval(
+                """
+                UPDATE transcription_cache SET last_accessed_at = NOW(), hit_count = hit_count + 1
+                WHERE cache_key = $1
+                RETURNING cache_key
+                """,
+                entry.cache_key
+            )
+        return hit is not None and entry.roll_path.exists()
+    
+    def create_staging(self, entry: CacheEntry) -> Path:
+        """建立寫入中的暫存目錄（與快取目錄同一檔案系統），成功保存時才移到 entry.directory"""
+        cache_dir = Path(settings.RESULT_CACHE_DIR)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        return Path(tempfile.mkdtemp(prefix=f".{entry.cache_key}.", suffix=".tmp", dir=cache_dir))
+    
+    def _commit(self, entry: CacheEntry, threshold: float, midi_path: str, staging: Path = None):
+        """把 MIDI 放入暫存目錄，再以 os.replace 整個移到 entry.directory；項目已存在時逐檔移入"""
+        if staging is None:
+            staging = self.create_staging(entry)
+        try:
+            shutil.copyfile(midi_path, staging / entry.midi_path(threshold).name)
+            try:
+                os.replace(staging, entry.directory)
+                return
+            except OSError:
+                pass  # 目錄已存在（命中鋼琴捲，或同時有其他工作先完成）
+            for path in staging.iterdir():
+                os.replace(path, entry.directory / path.name)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+    
+    async def store(self, entry: CacheEntry, threshold: float, midi_path: str, staging: Path = None):
+        """
+        保存 MIDI 並更新索引，之後依容量上限淘汰舊項目
+        
+        staging 為 create_staging 建立、已寫入鋼琴捲的暫存目錄；快取目錄只在保存成功時出現，
+        失敗時暫存目錄由呼叫端刪除，不會留下不完整的項目
+        """
+        await asyncio.to_thread(self._commit, entry, threshold, midi_path, staging)
+        size = await asyncio.to_thread(_directory_size, entry.directory)
+        
+        pool = database.get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO transcription_cache (cache_key, audio_sha256, model_sha256, params, size_bytes)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (cache_key) DO UPDATE
+                SET size_bytes = EXCLUDED.size_bytes, last_accessed_at = NOW()
+                """,
+                entry.cache_key, entry.audio_sha256, entry.model_sha256,
+                json.dumps(entry.params, sort_keys=True), size
+            )
+        await self.evict()
+    
+    async def evict(self):
+        """依最近使用時間淘汰項目，直到總大小不超過 RESULT_CACHE_MAX_SIZE"""
+        pool = database.get_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                DELETE FROM transcription_cache WHERE cache_key IN (
+                    SELECT cache_key FROM (
+                        SELECT cache_key,
+                               SUM(size_bytes) OVER (ORDER BY last_accessed_at DESC, cache_key) AS running_size
+                        FROM transcription_cache
+                    ) ranked
+                    WHERE running_size > $1
+                )
+                RETURNING cache_key
+                """,
+                settings.RESULT_CACHE_MAX_SIZE
+            )
+        
+        for row in rows:
+            directory = Path(settings.RESULT_CACHE_DIR) / row["cache_key"].strip()
+            await asyncio.to_thread(shutil.rmtree, directory, True)
+        if rows:
+            print(f"🧹 [快取] 淘汰 {len(rows)} 筆轉錄結果")
+
+# 全域快取實例
+result_cache = ResultCache()
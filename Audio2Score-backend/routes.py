@@ -4,23 +4,34 @@ API 路由 - Audio2Score Backend
 """
 import os
 import uuid
-from fastapi import APIRouter, HTTPException, status, Request, Depends, Header, File, UploadFile
+from fastapi import APIRouter, HTTPException, status, Request, Depends, Header, Query
 from typing import Optional
 import datetime
 from pathlib import Path
-from music_conversion_tool import music_tool
 
 # Debug: 檢查 runtime 中的 `datetime` 是否被 shadow（啟動時會印出，測試後請移除）
 print("DEBUG: routes module loaded. datetime ->", datetime, type(datetime), "has timezone:", hasattr(datetime, 'timezone'))
 
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, FileResponse
 
-from models import UserCreate, UserLogin, UserWithToken, UserResponse
-from auth import get_password_hash, verify_password, create_access_token, verify_token
+from models import UserCreate, UserLogin, UserWithToken, UserResponse, JobResponse
+from auth import (
+    get_password_hash_async, verify_password_async, needs_rehash, password_metrics,
+    create_access_token, verify_token, user_claims, user_cache, invalidate_user
+)
 from database import database
+from config import settings
+from jobs import job_manager
+from uploads import receive_upload, UploadError, UploadTooLarge
 
 router = APIRouter(prefix="/api/auth", tags=["Authentication"])
 
+# 註冊時衝突欄位對應的錯誤訊息
+REGISTER_CONFLICTS = {
+    "email": "此信箱已被使用",
+    "username": "此使用者名稱已被使用",
+}
+
 @router.post("/register", response_model=UserWithToken, status_code=status.HTTP_201_CREATED)
 async def register(user: UserCreate, request: Request):
     """
@@ -45,57 +56,45 @@ async def register(user: UserCreate, request: Request):
         print(f"🟢 [後端] 請求來源: {request.client.host if request.client else '未知'}")
         print(f"🟢 [後端] 註冊資料: username={user.username}, email={user.email}, password={user.password}")
         
-        pool = database.get_pool()
-        if not pool:
+        if not database.get_pool():
             raise HTTPException(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
                 detail="資料庫連線失敗"
             )
         
-        async with pool.acquire() as conn:
-            # 檢查使用者是否已存在
-            existing_user = await conn.fetchrow(
-                "SELECT * FROM users WHERE email = $1 OR username = $2",
-                user.email, user.username
-            )
-            
-            if existing_user:
-                print("❌ [後端] 使用者名稱或信箱已被使用")
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="使用者名稱或信箱已被使用"
-                )
-            
-            # 加密密碼
-            password_hash = get_password_hash(user.password)
-            
-            # 新增使用者
-            new_user = await conn.fetchrow(
-                """
-                INSERT INTO users (username, email, password_hash, created_at, updated_at)
-                VALUES ($1, $2, $3, $4, $5)
-                RETURNING id, username, email, created_at
-                """,
+        # 加密密碼（在執行緒池中計算，且不佔用資料庫連線）
+        password_hash = await get_password_hash_async(user.password)
+        
+        # 新增使用者（單一語句，重複的名稱或信箱由唯一限制擋下）
+        async with database.acquire() as conn:
+            new_user = await database.fetchrow(
+                conn, "insert_user",
                 user.username, user.email, password_hash, datetime.datetime.utcnow(), datetime.datetime.utcnow()
             )
-            
-            # 建立 Token
-            token = create_access_token(
-                data={"id": new_user["id"], "username": new_user["username"]}
+        
+        if new_user["id"] is None:
+            detail = REGISTER_CONFLICTS.get(new_user["conflict"], "使用者名稱或信箱已被使用")
+            print(f"❌ [後端] {detail}")
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=detail
             )
-            
-            print(f"✅ 新使用者註冊: {user.username} ({user.email})")
-            
-            return {
-                "message": "註冊成功",
-                "user": {
-                    "id": new_user["id"],
-                    "username": new_user["username"],
-                    "email": new_user["email"],
-                    "created_at": new_user["created_at"]
-                },
-                "token": token
-            }
+        
+        # 建立 Token
+        token = create_access_token(data=user_claims(new_user))
+        
+        print(f"✅ 新使用者註冊: {user.username} ({user.email})")
+        
+        return {
+            "message": "註冊成功",
+            "user": {
+                "id": new_user["id"],
+                "username": new_user["username"],
+                "email": new_user["email"],
+                "created_at": new_user["created_at"]
+            },
+            "token": token
+        }
             
     except HTTPException:
         raise
@@ -131,52 +130,58 @@ async def login(credentials: UserLogin, request: Request):
         print(f"🟢 [後端] 請求來源: {request.client.host if request.client else '未知'}")
         print(f"🟢 [後端] 登入資料: email={credentials.email}, password={credentials.password}, type={type(credentials.password)}")
         
-        pool = database.get_pool()
-        if not pool:
+        if not database.get_pool():
             raise HTTPException(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
                 detail="資料庫連線失敗"
             )
         
-        async with pool.acquire() as conn:
+        async with database.acquire() as conn:
             # 查詢使用者
-            user = await conn.fetchrow(
-                "SELECT * FROM users WHERE email = $1",
-                credentials.email
+            user = await database.fetchrow(conn, "user_by_email", credentials.email)
+        
+        if not user:
+            print("❌ [後端] 帳號不存在")
+            password_metrics.logins["failure"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="帳號或密碼錯誤"
             )
-            
-            if not user:
-                print("❌ [後端] 帳號不存在")
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="帳號或密碼錯誤"
-                )
-            
-            # 驗證密碼
-            if not verify_password(credentials.password, user["password_hash"]):
-                print("❌ [後端] 密碼錯誤")
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="帳號或密碼錯誤"
-                )
-            
-            # 建立 Token
-            token = create_access_token(
-                data={"id": user["id"], "username": user["username"]}
+        
+        # 驗證密碼（在執行緒池中計算，且不佔用資料庫連線）
+        if not await verify_password_async(credentials.password, user["password_hash"]):
+            print("❌ [後端] 密碼錯誤")
+            password_metrics.logins["failure"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="帳號或密碼錯誤"
             )
-            
-            print(f"✅ 使用者登入: {user['username']} ({user['email']})")
-            
-            return {
-                "message": "登入成功",
-                "user": {
-                    "id": user["id"],
-                    "username": user["username"],
-                    "email": user["email"],
-                    "created_at": user["created_at"]
-                },
-                "token": token
-            }
+        password_metrics.logins["success"] += 1
+        
+        # cost factor 設定變更後，於登入成功時順便以新設定重新加密
+        if needs_rehash(user["password_hash"]):
+            new_hash = await get_password_hash_async(credentials.password)
+            async with database.acquire() as conn:
+                await database.execute(conn, "update_password_hash", new_hash, user["id"])
+            invalidate_user(user["id"])
+            password_metrics.rehashes += 1
+            print(f"🔑 已更新密碼雜湊強度: {user['username']}")
+        
+        # 建立 Token
+        token = create_access_token(data=user_claims(user))
+        
+        print(f"✅ 使用者登入: {user['username']} ({user['email']})")
+        
+        return {
+            "message": "登入成功",
+            "user": {
+                "id": user["id"],
+                "username": user["username"],
+                "email": user["email"],
+                "created_at": user["created_at"]
+            },
+            "token": token
+        }
             
     except HTTPException:
         raise
@@ -196,6 +201,8 @@ async def get_current_user(authorization: Optional[str] = Header(None)):
     取得目前登入使用者資訊
     
     需要在 Header 中提供 Authorization: Bearer <token>
+    
+    依序使用：Token claims（ME_FROM_TOKEN_CLAIMS 開啟時）→ 使用者快取 → 資料庫
     """
     try:
         if not authorization or not authorization.startswith("Bearer "):
@@ -214,18 +221,24 @@ async def get_current_user(authorization: Optional[str] = Header(None)):
                 detail="無效的 Token"
             )
         
-        pool = database.get_pool()
-        if not pool:
+        # 新版 Token 帶有完整的使用者資料，可以不查詢資料庫直接回應
+        if settings.ME_FROM_TOKEN_CLAIMS and all(
+            key in payload for key in ("username", "email", "created_at")
+        ):
+            return {key: payload[key] for key in ("id", "username", "email", "created_at")}
+        
+        cached_user = user_cache.get(user_id)
+        if cached_user is not None:
+            return cached_user
+        
+        if not database.get_pool():
             raise HTTPException(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
                 detail="資料庫連線失敗"
             )
         
-        async with pool.acquire() as conn:
-            user = await conn.fetchrow(
-                "SELECT id, username, email, created_at FROM users WHERE id = $1",
-                user_id
-            )
+        async with database.acquire() as conn:
+            user = await database.fetchrow(conn, "user_by_id", user_id)
             
             if not user:
                 raise HTTPException(
@@ -233,12 +246,14 @@ async def get_current_user(authorization: Optional[str] = Header(None)):
                     detail="使用者不存在"
                 )
             
-            return {
+            user_data = {
                 "id": user["id"],
                 "username": user["username"],
                 "email": user["email"],
                 "created_at": user["created_at"]
             }
+            user_cache.set(user_id, user_data)
+            return user_data
             
     except HTTPException:
         raise
@@ -251,51 +266,140 @@ async def get_current_user(authorization: Optional[str] = Header(None)):
 
 # 創建專門處理上傳的路由
 upload_router = APIRouter(prefix="/api", tags=["File Upload"])
-@upload_router.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+@upload_router.post(
+    "/upload",
+    status_code=status.HTTP_202_ACCEPTED,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {"file": {"type": "string", "format": "binary"}},
+                        "required": ["file"]
+                    }
+                }
+            }
+        }
+    }
+)
+async def upload_file(request: Request, threshold: Optional[float] = Query(None, gt=0, lt=1)):
     """
-    處理文件上傳 - 簡化版本
+    處理文件上傳，並建立轉錄工作
+    
+    檔案以串流方式寫入磁碟（不整個讀進記憶體），以 SHA-256 命名儲存；
+    儲存後立即回傳 job_id，轉錄在背景工作程序中執行。
+    同一份音訊再次上傳時會使用快取的轉錄結果（可用 threshold 調整音符門檻值）
     """
     try:
         # Request-time debug to check whether `datetime` got shadowed at runtime
         print("🔵 [上傳] 開始處理檔案上傳...")
         print("REQ-DEBUG datetime ->", datetime, type(datetime), "has timezone:", hasattr(datetime, 'timezone'))
 
-        # 基本檢查
-        if not file.filename:
-            return {"error": "沒有收到檔案"}
+        if not database.get_pool():
+            return JSONResponse(status_code=503, content={"error": "資料庫連線失敗"})
 
-        # 讀取檔案內容
-        contents = await file.read()
-        file_size = len(contents)
+        # 串流接收檔案
+        try:
+            upload = await receive_upload(request)
+        except UploadTooLarge as e:
+            print(f"❌ [上傳] {e}")
+            return JSONResponse(status_code=413, content={"error": str(e)})
+        except UploadError as e:
+            print(f"❌ [上傳] {e}")
+            return JSONResponse(status_code=400, content={"error": str(e)})
         
-        # 儲存上傳的檔案
-        uploads_dir = Path(__file__).resolve().parent / "uploads"
-        uploads_dir.mkdir(parents=True, exist_ok=True)
-        file_path = uploads_dir / file.filename
-        with open(file_path, "wb") as f:
-            f.write(contents)
-        
-        print(f"✅ [上傳] 收到檔案: {file.filename}, 大小: {file_size} bytes")
-
-        # print(f"✅ 開始預測處理檔案: {file.filename}")
-
-        # music_tool.generate_midi_from_wav(str(file_path), str(file_path.with_suffix('.mid')))
+        print(f"✅ [上傳] 收到檔案: {upload.filename}, 大小: {upload.size} bytes, SHA-256: {upload.sha256}")
 
+        # 建立轉錄工作
+        job_id = uuid.uuid4().hex
+        results_dir = Path(settings.UPLOAD_DIR) / "results"
+        results_dir.mkdir(parents=True, exist_ok=True)
+        await job_manager.enqueue(
+            job_id, upload.filename, str(upload.path), str(results_dir / f"{job_id}.mid"),
+            audio_sha256=upload.sha256, threshold=threshold
+        )
+        print(f"✅ [上傳] 已建立轉錄工作: {job_id}")
         
-        # 簡單回應
         return {
             "status": "success",
-            "message": "檔案接收成功",
-            "filename": file.filename,
-            "size": file_size,
-            "content_type": file.content_type,
-            "upload_time": datetime.datetime.now(datetime.timezone.utc).isoformat()
+            "message": "檔案接收成功，轉錄工作已排入佇列",
+            "filename": upload.filename,
+            "size": upload.size,
+            "sha256": upload.sha256,
+            "content_type": upload.content_type,
+            "upload_time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "job_id": job_id,
+            "job_url": f"/api/jobs/{job_id}"
         }
 
+    except HTTPException:
+        # 例如連線池忙碌時的 DatabaseBusy（503 + Retry-After），原樣回傳給客戶端
+        raise
     except Exception as e:
         # 印出完整 traceback 到 server 日誌，避免只回傳簡短錯誤
         import traceback
         print(f"❌ [上傳] 錯誤: {str(e)}")
         traceback.print_exc()
         return JSONResponse(status_code=500, content={"error": str(e)})
+
+@upload_router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    """
+    查詢轉錄工作的狀態與進度
+    """
+    if not database.get_pool():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="資料庫連線失敗"
+        )
+    
+    job = await job_manager.get(job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="找不到該轉錄工作"
+        )
+    
+    return {
+        **job,
+        "download_url": f"/api/jobs/{job_id}/download" if job["status"] == "done" else None
+    }
+
+@upload_router.get("/jobs/{job_id}/download")
+async def download_job_result(job_id: str):
+    """
+    下載轉錄完成的 MIDI 檔案
+    """
+    if not database.get_pool():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="資料庫連線失敗"
+        )
+    
+    job = await job_manager.get(job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="找不到該轉錄工作"
+        )
+    
+    if job["status"] != "done":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"轉錄尚未完成（目前狀態: {job['status']}）"
+        )
+    
+    output_path = Path(job["output_path"])
+    if not output_path.exists():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="MIDI 檔案不存在"
+        )
+    
+    return FileResponse(
+        output_path,
+        media_type="audio/midi",
+        filename=Path(job["filename"]).with_suffix(".mid").name
+    )
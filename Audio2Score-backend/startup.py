@@ -0,0 +1,120 @@
+"""
+啟動時間與匯入時間報告 - Audio2Score Backend
+
+- 執行時：main.py / transcriber.py 以 startup_report 記錄各啟動階段的耗時，啟動完成時輸出一行摘要，
+  並在 /metrics 提供 audio2score_startup_phase_seconds
+- 離線檢查：以 python -X importtime 量測匯入模組的耗時，列出最慢的模組；
+  API 程序不應載入 TensorFlow 等推論套件，載入時或超過時間預算時以非零狀態結束，方便在 CI 中發現退步
+
+用法：
+    python startup.py                       # 量測 import main
+    python startup.py --module transcriber --budget 1.5
+    python startup.py --output import_times.json
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+# 只有推論（或訓練）程序需要的套件
+HEAVY_MODULES = ("tensorflow", "keras", "librosa", "numba", "matplotlib", "sklearn", "pretty_midi")
+
+class StartupReport:
+    """記錄啟動各階段的耗時（秒）"""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self._last = time.perf_counter()  # 第一個階段從本模組被匯入時開始計算
+
+    def begin(self):
+        """開始計時下一個階段（例如 gunicorn fork 後的 lifespan）"""
+        self._last = time.perf_counter()
+
+    def mark(self, phase: str):
+        """結束目前階段並記錄耗時"""
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+    @staticmethod
+    def heavy_modules() -> List[str]:
+        """目前程序已載入的推論套件"""
+        return [name for name in HEAVY_MODULES if name in sys.modules]
+
+    def log(self, service: str):
+        phases = "，".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases.items())
+        print(f"⏱️ {service} 啟動耗時: {phases}")
+        heavy = self.heavy_modules()
+        if heavy:
+            print(f"⚠️ {service} 已載入推論套件: {', '.join(heavy)}")
+
+# 全域啟動報告實例
+startup_report = StartupReport()
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def measure_imports(module: str) -> List[dict]:
+    """在新的直譯器中以 -X importtime 匯入 module，回傳每個模組的 self / cumulative 耗時（秒）"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"無法匯入 {module}:\n{result.stderr[-2000:]}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            entries.append({
+                "module": match.group(4),
+                "self_seconds": int(match.group(1)) / 1e6,
+                "cumulative_seconds": int(match.group(2)) / 1e6,
+                "depth": len(match.group(3)) // 2,
+            })
+    return entries
+
+def main():
+    parser = argparse.ArgumentParser(description="Audio2Score 匯入時間報告")
+    parser.add_argument("--module", default="main", help="要量測的模組")
+    parser.add_argument("--top", type=int, default=15, help="列出最慢的模組數")
+    parser.add_argument("--budget", type=float, default=3.0, help="匯入總耗時上限（秒），超過時以非零狀態結束")
+    parser.add_argument("--allow-heavy", action="store_true", help="允許載入推論套件（例如量測訓練腳本）")
+    parser.add_argument("--output", help="將結果另存為 JSON")
+    args = parser.parse_args()
+
+    entries = measure_imports(args.module)
+    total = sum(entry["cumulative_seconds"] for entry in entries if entry["depth"] == 0)
+    top_level = {entry["module"].split(".")[0] for entry in entries}
+    heavy = [name for name in HEAVY_MODULES if name in top_level]
+
+    print(f"import {args.module}: {total:.3f} s，共 {len(entries)} 個模組")
+    print(f"{'cumulative':>12}{'self':>10}  module")
+    for entry in sorted(entries, key=lambda e: e["cumulative_seconds"], reverse=True)[:args.top]:
+        print(f"{entry['cumulative_seconds'] * 1000:>10.1f}ms{entry['self_seconds'] * 1000:>8.1f}ms  "
+              f"{'  ' * entry['depth']}{entry['module']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"module": args.module, "total_seconds": total, "heavy_modules": heavy,
+                       "imports": entries}, f, ensure_ascii=False, indent=2)
+        print(f"結果已儲存至 {args.output}")
+
+    failed = False
+    if heavy and not args.allow_heavy:
+        print(f"❌ import {args.module} 載入了推論套件: {', '.join(heavy)}")
+        failed = True
+    if total > args.budget:
+        print(f"❌ 匯入耗時 {total:.3f} s 超過預算 {args.budget:.3f} s")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("✅ 匯入時間在預算內")
+
+if __name__ == "__main__":
+    main()
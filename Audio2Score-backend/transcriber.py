@@ -0,0 +1,60 @@
+"""
+獨立轉錄服務 - Audio2Score Backend
+生產模式下由 gunicorn.conf.py 啟動：擁有自己的資料庫連線池與推論工作程序，
+從 transcription_jobs 領取 API 程序建立的工作，讓 API 工作程序不需載入模型。
+
+也可以單獨執行：python transcriber.py
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from startup import startup_report
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from config import settings
+from database import database, init_db
+from jobs import job_manager
+from metrics import render_transcription_metrics
+
+startup_report.mark("imports")
+
+async def metrics(request):
+    """轉錄各階段耗時與推論批次統計（Prometheus 文字格式）"""
+    return PlainTextResponse(render_transcription_metrics(), media_type="text/plain; version=0.0.4")
+
+async def serve():
+    """啟動轉錄工作程序，並在 TRANSCRIBER_METRICS_PORT 提供 /metrics；收到 SIGTERM 時優雅結束"""
+    print("🎹 轉錄服務啟動中...")
+    startup_report.begin()
+    await database.connect()
+    startup_report.mark("database")
+    await init_db()
+    startup_report.mark("migrations")
+    await job_manager.start(run_workers=True)
+    startup_report.mark("jobs")
+    startup_report.log("轉錄服務")
+
+    app = Starlette(routes=[Route("/metrics", metrics)])
+    server = uvicorn.Server(uvicorn.Config(
+        app, host="0.0.0.0", port=settings.TRANSCRIBER_METRICS_PORT, log_level="warning"
+    ))
+    try:
+        print(f"📝 轉錄服務指標: http://127.0.0.1:{settings.TRANSCRIBER_METRICS_PORT}/metrics")
+        await server.serve()
+    finally:
+        print("🛑 轉錄服務停止中...")
+        await job_manager.stop()
+        await database.disconnect()
+
+def main():
+    asyncio.run(serve())
+
+if __name__ == "__main__":
+    main()
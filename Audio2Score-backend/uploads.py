@@ -0,0 +1,184 @@
+"""
+串流上傳 - Audio2Score Backend
+直接解析 multipart 串流並分塊寫入暫存檔，邊寫邊計算 SHA-256 與大小，
+完成後以內容雜湊命名（content-addressed）並原子性地移到上傳目錄
+"""
+import asyncio
+import hashlib
+import os
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from fastapi import Request
+from multipart.multipart import MultipartParser, parse_options_header
+
+from config import settings
+
+class UploadError(Exception):
+    """上傳格式錯誤"""
+
+class UploadTooLarge(UploadError):
+    """上傳檔案超過大小上限"""
+
+class StoredUpload:
+    """已儲存的上傳檔案"""
+    
+    def __init__(self, filename: str, content_type: Optional[str], path: Path, sha256: str, size: int):
+        self.filename = filename
+        self.content_type = content_type
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+
+class _FileWriter:
+    """把資料累積到 chunk_size 後才在執行緒中寫入並更新雜湊，避免阻塞事件迴圈"""
+    
+    def __init__(self, path: Path, chunk_size: int):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self._buffer = bytearray()
+        self._file = None
+    
+    async def open(self):
+        self._file = await asyncio.to_thread(open, self.path, "wb")
+    
+    async def write(self, data: bytes):
+        self._buffer += data
+        self.size += len(data)
+        if len(self._buffer) >= self.chunk_size:
+            await self.flush()
+    
+    def _write_chunk(self, chunk: bytes):
+        self.hasher.update(chunk)
+        self._file.write(chunk)
+    
+    async def flush(self):
+        if self._buffer:
+            chunk, self._buffer = bytes(self._buffer), bytearray()
+            await asyncio.to_thread(self._write_chunk, chunk)
+    
+    async def close(self):
+        if self._file is not None:
+            await asyncio.to_thread(self._file.close)
+            self._file = None
+
+async def receive_upload(request: Request, field_name: str = "file") -> StoredUpload:
+    """
+    以串流方式接收 multipart 上傳的檔案
+    
+    Args:
+        request: FastAPI 請求
+        field_name: 檔案欄位名稱
+    
+    Returns:
+        StoredUpload: 以 SHA-256 命名的已儲存檔案
+    
+    Raises:
+        UploadTooLarge: 超過 settings.UPLOAD_MAX_SIZE
+        UploadError: 不是 multipart 請求或沒有檔案欄位
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError("請使用 multipart/form-data 上傳檔案")
+    
+    # 宣告的大小已超過上限時，不必讀取內容就可以拒絕
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.UPLOAD_MAX_SIZE:
+        raise UploadTooLarge(f"檔案超過大小上限 {settings.UPLOAD_MAX_SIZE} bytes")
+    
+    upload_dir = Path(settings.UPLOAD_DIR)
+    tmp_dir = upload_dir / "tmp"
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    
+    # 解析器的 callback 是同步的，先記錄事件，每讀完一個網路區塊再非同步處理
+    events = []
+    headers = {}
+    header_field = bytearray()
+    header_value = bytearray()
+    
+    def on_header_field(data: bytes, start: int, end: int):
+        header_field.extend(data[start:end])
+    
+    def on_header_value(data: bytes, start: int, end: int):
+        header_value.extend(data[start:end])
+    
+    def on_header_end():
+        headers[bytes(header_field).lower()] = bytes(header_value)
+        header_field.clear()
+        header_value.clear()
+    
+    def on_headers_finished():
+        events.append(("headers", dict(headers)))
+        headers.clear()
+    
+    def on_part_data(data: bytes, start: int, end: int):
+        events.append(("data", data[start:end]))
+    
+    def on_part_end():
+        events.append(("end", None))
+    
+    parser = MultipartParser(params[b"boundary"], {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    
+    writer: Optional[_FileWriter] = None
+    writing = False
+    filename = None
+    part_content_type = None
+    
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for event, data in events:
+                if event == "headers":
+                    _, options = parse_options_header(data.get(b"content-disposition", b""))
+                    writing = (
+                        writer is None
+                        and options.get(b"name") == field_name.encode()
+                        and b"filename" in options
+                    )
+                    if writing:
+                        filename = options[b"filename"].decode("utf-8", errors="replace")
+                        part_content_type = data.get(b"content-type", b"").decode("latin-1") or None
+                        writer = _FileWriter(tmp_dir / f"{uuid.uuid4().hex}.part", settings.UPLOAD_CHUNK_SIZE)
+                        await writer.open()
+                elif event == "data" and writing:
+                    if writer.size + len(data) > settings.UPLOAD_MAX_SIZE:
+                        raise UploadTooLarge(f"檔案超過大小上限 {settings.UPLOAD_MAX_SIZE} bytes")
+                    await writer.write(data)
+                elif event == "end" and writing:
+                    writing = False
+                    await writer.flush()
+            events.clear()
+        parser.finalize()
+        
+        if writer is None or not filename:
+            raise UploadError("沒有收到檔案")
+        await writer.flush()
+        await writer.close()
+        
+    except BaseException:
+        if writer is not None:
+            await writer.close()
+            writer.path.unlink(missing_ok=True)
+        raise
+    
+    # 以內容雜湊命名，同樣的內容只保留一份
+    sha256 = writer.hasher.hexdigest()
+    audio_dir = upload_dir / "audio"
+    audio_dir.mkdir(parents=True, exist_ok=True)
+    final_path = audio_dir / f"{sha256}{Path(filename).suffix.lower()}"
+    if final_path.exists():
+        writer.path.unlink(missing_ok=True)
+    else:
+        os.replace(writer.path, final_path)
+    
+    return StoredUpload(filename, part_content_type, final_path, sha256, writer.size)